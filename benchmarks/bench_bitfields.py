@@ -0,0 +1,107 @@
+'''
+Flag word decoding: generator based bit_unpack/bit_pack (legacy) vs BITFIELD tables.
+
+    python benchmarks/bench_bitfields.py [-n iterations]
+'''
+import argparse
+from common import *
+
+def bit_pack():
+    result = 0
+    bitctr = 0
+    while True:
+        next_vals = yield result
+        if next_vals is None: break
+        next_val, n_bits = next_vals
+        next_val = int(next_val)
+        if next_val < 0: raise RuntimeError("pack val must be non-negative")
+        if next_val >= (1<<n_bits): raise RuntimeError("pack type must fit bisize")
+        result += next_val<<bitctr
+        bitctr += n_bits
+
+def bit_unpack(val):
+    retval = None
+    while True:
+        bitsize = yield retval
+        retval = (val)&((1<<bitsize)-1)
+        val = val >> bitsize
+
+class FLAGS: pass
+
+def legacy_flags(fields, val):
+    '''Same sequence of unpacker.send() calls the response parsers made'''
+    obj = FLAGS()
+    unpacker = bit_unpack(val)
+    next(unpacker)
+    for name, n_bits, *conv in fields:
+        field_val = unpacker.send(n_bits)
+        if name: setattr(obj, name, conv[0](field_val) if conv else field_val)
+    return obj
+
+def legacy_srm_code(ch_mask, gains):
+    packer = bit_pack()
+    next(packer)
+    packer.send((1, 2))
+    packer.send((0, 14))
+    for i in range(4): packer.send((int(ch_mask[i]), 1))
+    for i in range(4): code = packer.send((gains[i], 3))
+    return code
+
+def legacy_from_srm_code(code):
+    unpacker = bit_unpack(code)
+    next(unpacker)
+    rate = unpacker.send(2)
+    unpacker.send(14)
+    ch_mask = [unpacker.send(1) for _ in range(4)]
+    gains = [CS_GAIN_CODE(unpacker.send(3)) for _ in range(4)]
+    return rate, ch_mask, gains
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--iterations', type=int, default=50000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    # field tables as (name, n_bits, conv) from the BITFIELD definitions
+    def as_fields(bitfield):
+        fields, pos = list(), 0
+        for name, shift, mask, conv in bitfield.fields:
+            if shift > pos: fields.append((None, shift - pos))
+            fields.append((name, mask.bit_length()) + ((conv,) if conv else ()))
+            pos = shift + mask.bit_length()
+        return fields
+
+    cfg = adc_cfg(1000, 4)
+    state_fields = as_fields(CHA_STATE_RESPONSE.FLAGS)
+    srm_fields = as_fields(CHA_SRM_STATUS_RESPONSE.FLAGS)
+    state_hdr = CHA_PROTO_HDR(CHA_LR_IF_TYPE.WIRED_0, CHA_MSG_TYPE.CNTL_STAT_ACK)
+    srm_hdr = CHA_PROTO_HDR(CHA_LR_IF_TYPE.WIRED_0, CHA_MSG_TYPE.SRM_STAT_ACK)
+    state_payload = cha_state_payload(1)
+    srm_payload = srm_status_payload(cfg)
+    srm_code = cfg.code
+
+    rows = list()
+    for name, legacy, new in [
+        ('CHA_STATE flags', lambda: legacy_flags(state_fields, 0x00FF_FFFF),
+                            lambda: CHA_STATE_RESPONSE.FLAGS.decode_into(FLAGS(), 0x00FF_FFFF)),
+        ('SRM_STATUS flags', lambda: legacy_flags(srm_fields, 0x00FF_F0FF),
+                             lambda: CHA_SRM_STATUS_RESPONSE.FLAGS.decode_into(FLAGS(), 0x00FF_F0FF)),
+        ('ADC cfg encode', lambda: legacy_srm_code(cfg.ch_mask, cfg.gains),
+                           lambda: UNI_ADC_CFG.SRM_CODE.encode(1, *cfg.ch_mask, *cfg.gains)),
+        ('ADC cfg decode', lambda: legacy_from_srm_code(srm_code),
+                           lambda: UNI_ADC_CFG.SRM_CODE.decode(srm_code)),
+    ]:
+        t_old = timeit(legacy, n)
+        t_new = timeit(new, n)
+        rows.append([name, f'{t_old*1e6:.2f}', f'{t_new*1e6:.2f}', f'{t_old/t_new:.2f}x'])
+    report(rows, ['decode', 'legacy us', 'bitfield us', 'speedup'])
+
+    print()
+    rows = [
+        ['CHA_STATE_RESPONSE', f'{timeit(CHA_STATE_RESPONSE, n//5, state_hdr, state_payload)*1e6:.2f}'],
+        ['CHA_SRM_STATUS_RESPONSE', f'{timeit(CHA_SRM_STATUS_RESPONSE, n//5, srm_hdr, srm_payload)*1e6:.2f}'],
+    ]
+    report(rows, ['full parse', 'us'])
+
+if __name__ == '__main__':
+    main()
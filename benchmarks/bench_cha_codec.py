@@ -0,0 +1,88 @@
+'''
+Chassis RX codec: header parse and frame dispatch, frames/sec.
+"legacy" is the format-string/IntEnum header parser and if/elif dispatch
+the codec used before precompiled structs and lookup tables.
+
+    python benchmarks/bench_cha_codec.py [-f recorded_frames.bin] [-r repeats]
+'''
+import argparse, struct, logging
+from common import *
+import iface_chassis
+from rx_backend import read_frames
+from protocol.cha_stream_structs import *
+
+LEGACY_HDR_DATASTRUCT = '<BBH 4x BxxxBBBB'
+
+def legacy_hdr_from_bytes(inpt):
+    tupl = struct.unpack(LEGACY_HDR_DATASTRUCT, inpt)
+    return CHA_PROTO_HDR(CHA_LR_IF_TYPE(tupl[0]), CHA_MSG_TYPE(tupl[6]),
+                         chu=tupl[1], sz=tupl[2], rand=tupl[3],
+                         src=tupl[4], dst=tupl[5], nak=CHA_NAK_CODE(tupl[7]))
+
+def legacy_un_serialize(hdr, payload_bytes):
+    retval = None
+    if hdr.msg_type is CHA_MSG_TYPE.STREAM_DATA:
+        if hdr.nak_code is CHA_NAK_CODE.NO_ERROR: retval = STREAM_DATA_RESPONSE(hdr, payload_bytes)
+    elif hdr.msg_type is CHA_MSG_TYPE.STREAM_START_ACK: retval = STREAM_START_RESPONSE(hdr)
+    elif hdr.msg_type is CHA_MSG_TYPE.STREAM_STOP_ACK: retval = STREAM_STOP_RESPONSE(hdr)
+    elif hdr.msg_type is CHA_MSG_TYPE.CNTL_STAT_ACK: retval = CHA_STATE_RESPONSE(hdr, payload_bytes)
+    elif hdr.msg_type is CHA_MSG_TYPE.SRM_STAT_ACK:
+        if hdr.nak_code is CHA_NAK_CODE.NO_ERROR: retval = CHA_SRM_STATUS_RESPONSE(hdr, payload_bytes)
+    elif hdr.msg_type is CHA_MSG_TYPE.CNTL_NODES_BC_ACK:
+        if hdr.nak_code is CHA_NAK_CODE.NO_ERROR: retval = CHA_DISCOVERY_RESPONSE(hdr, payload_bytes)
+    elif hdr.msg_type is CHA_MSG_TYPE.SRM_RUN_ACK:
+        if hdr.nak_code is CHA_NAK_CODE.NO_ERROR: retval = CHA_RESPONSE(hdr)
+    elif hdr.msg_type is CHA_MSG_TYPE.CNTL_CLK_SET_ACK: retval = CHA_SET_CLOCK_RESPONSE(hdr, payload_bytes)
+    elif hdr.msg_type is CHA_MSG_TYPE.SRM_FAT_ACK: retval = CHA_SRM_TABLE_RESPONSE(hdr, payload_bytes)
+    else: retval = CHA_RESPONSE(hdr)
+    return retval
+
+def legacy_hdr_only(frames):
+    HDR_SZ = CHA_PROTO_HDR.HDR_SZ
+    for f in frames: legacy_hdr_from_bytes(f[:HDR_SZ])
+
+def new_hdr_only(frames):
+    for f in frames: CHA_PROTO_HDR.from_bytes(f)
+
+def legacy_dispatch(frames):
+    HDR_SZ = CHA_PROTO_HDR.HDR_SZ
+    for f in frames:
+        hdr = legacy_hdr_from_bytes(f[:HDR_SZ])
+        legacy_un_serialize(hdr, f[HDR_SZ:HDR_SZ+hdr.chunk_sz])
+
+def new_dispatch(iface, frames):
+    HDR_SZ = CHA_PROTO_HDR.HDR_SZ
+    for f in frames:
+        hdr = CHA_PROTO_HDR.from_bytes(f)
+        iface.un_serialize(hdr, f[HDR_SZ:HDR_SZ+hdr.chunk_sz])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--frames', type=str, help="Recorded frames file (rx_backend record_file)")
+    parser.add_argument('-r', '--repeats', type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    if args.frames: frames = [memoryview(f) for _, f in read_frames(args.frames)]
+    else: frames = [memoryview(f) for f in traffic_mix()]
+    print(f'{len(frames)} frames, {"recorded" if args.frames else "synthetic 15 nodes x 1000 SPS x 4 ch"}')
+
+    iface = iface_chassis.IFACE_CHASSIS(bench_config())
+    nop = lambda msg: None
+    iface.register_msg_handlers(nop, nop, nop)
+
+    rows = list()
+    for name, legacy, new in [
+        ('header', lambda: legacy_hdr_only(frames), lambda: new_hdr_only(frames)),
+        ('header+dispatch', lambda: legacy_dispatch(frames), lambda: new_dispatch(iface, frames)),
+    ]:
+        t_old = timeit(legacy, args.repeats)
+        t_new = timeit(new, args.repeats)
+        rows.append([name, int(len(frames)/t_old), int(len(frames)/t_new), f'{t_old/t_new:.2f}x'])
+
+    t_full = timeit(lambda: [iface.process_frame(f) for f in frames], args.repeats)
+    rows.append(['process_frame', '', int(len(frames)/t_full), ''])
+    report(rows, ['path', 'legacy fr/s', 'current fr/s', 'speedup'])
+
+if __name__ == '__main__':
+    main()
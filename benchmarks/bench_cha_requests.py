@@ -0,0 +1,68 @@
+'''
+Chassis polling request serialization, requests/sec.
+One polling round = state, SRM status, discovery and SRM table requests to every node,
+random_id advancing per request as in CHASSIS.send_and_update_random_id().
+"legacy" is the request classes before header templates: full header struct pack on
+every send, enum lookups and the constructor chain on every request.
+
+    python benchmarks/bench_cha_requests.py [--nodes 32] [--ifaces 1..4] [-r repeats]
+'''
+import argparse
+from common import *
+
+class LEGACY_SIMPLE_REQUEST(CHA_REQUEST):
+    def __init__(self, iface, msg_type, dst, rand):
+        hdr = CHA_PROTO_HDR(iface, msg_type, dst=dst, rand=rand)
+        super().__init__(hdr)
+
+class LEGACY_SRM_STATUS_REQUEST(LEGACY_SIMPLE_REQUEST):
+    def __init__(self, iface, dst, rand): super().__init__(iface, CHA_MSG_TYPE.SRM_STAT_REQ, dst, rand)
+
+class LEGACY_STATE_REQUEST(LEGACY_SIMPLE_REQUEST):
+    def __init__(self, iface, dst, rand): super().__init__(iface, CHA_MSG_TYPE.CNTL_STAT_REQ, dst, rand)
+
+class LEGACY_DISCOVERY_REQUEST(LEGACY_SIMPLE_REQUEST):
+    def __init__(self, iface, dst, rand): super().__init__(iface, CHA_MSG_TYPE.CNTL_NODES_BC_REQ, dst, rand)
+
+class LEGACY_SRM_TABLE_REQUEST(LEGACY_SIMPLE_REQUEST):
+    def __init__(self, iface, dst, rand): super().__init__(iface, CHA_MSG_TYPE.SRM_FAT_REQ, dst, rand)
+
+LEGACY_TYPES = (LEGACY_STATE_REQUEST, LEGACY_SRM_STATUS_REQUEST, LEGACY_DISCOVERY_REQUEST, LEGACY_SRM_TABLE_REQUEST)
+CURRENT_TYPES = (CHA_STATE_REQUEST, CHA_SRM_STATUS_REQUEST, CHA_DISCOVERY_REQUEST, CHA_SRM_TABLE_REQUEST)
+
+def polling_round(types, n_nodes, if_types):
+    requests, rand = list(), 0
+    for if_type in if_types:
+        for addr in range(1, n_nodes + 1):
+            for cls in types:
+                requests.append(cls(if_type, addr, rand))
+                rand = (rand + 1)%256
+    return requests
+
+def serialize(requests):
+    for request in requests: bytes(request)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=32)
+    parser.add_argument('--ifaces', type=int, default=4)
+    parser.add_argument('-r', '--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    if_types = [CHA_LR_IF_TYPE.WIFI_0, CHA_LR_IF_TYPE.WIFI_1, CHA_LR_IF_TYPE.WIRED_0, CHA_LR_IF_TYPE.WIRED_1][:args.ifaces]
+    legacy = polling_round(LEGACY_TYPES, args.nodes, if_types)
+    current = polling_round(CURRENT_TYPES, args.nodes, if_types)
+    assert [bytes(request) for request in legacy] == [bytes(request) for request in current]
+    print(f'{len(current)} requests per round, {args.nodes} nodes x {len(if_types)} ifaces x {len(CURRENT_TYPES)} types')
+
+    rows = list()
+    t_old = timeit(serialize, args.repeats, legacy)
+    t_new = timeit(serialize, args.repeats, current)
+    rows.append(['serialize', int(len(current)/t_old), int(len(current)/t_new), f'{t_old/t_new:.2f}x'])
+    t_old = timeit(lambda: serialize(polling_round(LEGACY_TYPES, args.nodes, if_types)), args.repeats)
+    t_new = timeit(lambda: serialize(polling_round(CURRENT_TYPES, args.nodes, if_types)), args.repeats)
+    rows.append(['create+serialize', int(len(current)/t_old), int(len(current)/t_new), f'{t_old/t_new:.2f}x'])
+    report(rows, ['path', 'legacy req/s', 'current req/s', 'speedup'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+'''
+CHA_STATE_RESPONSE parse cost on the RX thread: eager decode of every sub-block
+(legacy behaviour) vs lazy decode on first access.
+
+    python benchmarks/bench_cha_state.py [-n iterations]
+'''
+import argparse
+from common import *
+
+GROUPS = ('state_srm_connected', 'gps', 'batt_vin', 'chasis_time_valid', 'sn', 'temperature')
+
+def eager_parse(hdr, payload):
+    '''Touch one field per sub-block: same work the eager constructor did'''
+    resp = CHA_STATE_RESPONSE(hdr, payload)
+    for name in GROUPS: getattr(resp, name)
+    return resp
+
+def device_poll(hdr, payload):
+    '''Fields read by CHA_DEVICE on every poll'''
+    resp = CHA_STATE_RESPONSE(hdr, payload)
+    resp.state_srm_connected, resp.chasis_time_valid, resp.state_time_sync_ok
+    return resp
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--iterations', type=int, default=50000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    hdr = CHA_PROTO_HDR(CHA_LR_IF_TYPE.WIRED_0, CHA_MSG_TYPE.CNTL_STAT_ACK)
+    payload = memoryview(cha_state_payload(1))
+
+    rows, t_eager = list(), None
+    for name, func in [
+        ('eager (all sub-blocks)', eager_parse),
+        ('lazy (RX thread only)', CHA_STATE_RESPONSE),
+        ('lazy + device poll fields', device_poll),
+    ]:
+        t = timeit(func, n, hdr, payload)
+        if t_eager is None: t_eager = t
+        rows.append([name, f'{t*1e6:.2f}', f'{t_eager/t:.2f}x'])
+    report(rows, ['parse', 'us', 'vs eager'])
+
+if __name__ == '__main__':
+    main()
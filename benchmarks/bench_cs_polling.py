@@ -0,0 +1,91 @@
+'''
+CS full-tree polling of LINRET_CORE: node id lists, then CHA and SRM state
+of every node, as the CS loops over the tree.
+"legacy" is the linear device scan per serial and per id list.
+
+    python benchmarks/bench_cs_polling.py [-n cycles]
+'''
+import argparse, logging, types
+from common import *
+from protocol.cs_structs import *
+from protocol.sn_emulator import SN_EMULATOR
+SN_EMULATOR(LR_NUM=1)
+import core
+
+class TRUE_TIME_STUB:
+    def get_true_time(self): return time.time()
+
+def legacy_get_dev_by_serial(self, serial):
+    for dev in self.devices.values():
+        if serial in (dev.cha_serial_bytes, dev.srm_serial_bytes): return dev
+    return None
+
+def legacy_get_all_cha_list(self, cs_dev_type):
+    retval = list()
+    for dev in self.devices.values():
+        if dev.cs_dev_type is cs_dev_type: retval.append(CS_DEV_ID(cs_dev_type, dev.cha_serial))
+    return retval
+
+def legacy_get_all_srms_list(self, now):
+    return [CS_DEV_ID(CS_DEV_TYPE.SRM, dev.srm_serial_bytes)
+            for dev in self.devices.values() if dev.srm_serial_bytes is not None]
+
+def cs_hdr(cmd_type, dst):
+    return CS_PROTO_HDR(struct.pack(CS_PROTO_HDR.CS_HDR_STRUCT, CS_PROTO_HDR.CS_PROTO_MAGIC,
+                        CS_PROTO_HDR.CS_PROTO_VER, cmd_type, 0, b'CS000001', dst, 0))
+
+def make_core(n_nodes):
+    # nodes split over both wired lines, serial emulator packs addresses in a byte
+    per_line = n_nodes//2
+    pc = bench_config(max_nodes_per_interface={'LOCAL':0,'WIFI_0':0,'WIFI_1':0,'WIRED_0':per_line,'WIRED_1':per_line})
+    _core = core.LINRET_CORE(pc, TRUE_TIME_STUB())
+    _core.register_msg_handlres(lambda m: None, lambda m: None, lambda m: None, lambda m: None)
+    for if_type in (CHA_LR_IF_TYPE.WIRED_0, CHA_LR_IF_TYPE.WIRED_1):
+        for addr in range(1, per_line+1):
+            hdr = CHA_PROTO_HDR(if_type, CHA_MSG_TYPE.CNTL_STAT_ACK, src=addr)
+            _core.response_from_chassis(CHA_STATE_RESPONSE(hdr, cha_state_payload(addr)))
+    for i, dev in enumerate(_core.devices.values()):
+        dev.srm_serial_bytes = b'SRM%05d'%i # as set by SRM_FAT_ACK
+        _core.index_serial(dev.srm_serial_bytes, dev)
+    return _core
+
+def poll_requests(_core):
+    requests = [
+        CS_NODE_ID_LIST_REQUEST(cs_hdr(CS_PACKET_TYPE.NODE_ID_LIST_REQUEST, b'\0'*8), struct.pack('<H', CS_DEV_TYPE.CHA_RN)),
+        CS_NODE_ID_LIST_REQUEST(cs_hdr(CS_PACKET_TYPE.NODE_ID_LIST_REQUEST, b'\0'*8), struct.pack('<H', CS_DEV_TYPE.SRM)),
+    ]
+    for dev in _core.devices.values():
+        requests.append(CS_REQUEST(cs_hdr(CS_PACKET_TYPE.CHA_STATE_REQUEST, dev.cha_serial_bytes), b''))
+        requests.append(CS_REQUEST(cs_hdr(CS_PACKET_TYPE.SRM_STATE_REQUEST, dev.srm_serial_bytes), b''))
+    return requests
+
+def poll_cycle(_core, requests):
+    for request in requests: _core.request_from_cs(request)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--cycles', type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rows = list()
+    for n_nodes in (16, 64, 256):
+        _core = make_core(n_nodes)
+        requests = poll_requests(_core)
+        serials = [dev.srm_serial_bytes for dev in _core.devices.values()]
+        lookup = lambda: [_core.get_dev_by_serial(sn) for sn in serials]
+        t_lookup = timeit(lookup, args.cycles)
+        t_cycle = timeit(poll_cycle, args.cycles, _core, requests)
+
+        _core.get_dev_by_serial = types.MethodType(legacy_get_dev_by_serial, _core)
+        _core.get_all_cha_list = types.MethodType(legacy_get_all_cha_list, _core)
+        _core.get_all_srms_list = types.MethodType(legacy_get_all_srms_list, _core)
+        t_lookup_old = timeit(lookup, args.cycles)
+        t_cycle_old = timeit(poll_cycle, args.cycles, _core, requests)
+
+        rows.append([n_nodes, f'{t_lookup_old/n_nodes*1e6:.2f}', f'{t_lookup/n_nodes*1e6:.2f}',
+                     f'{t_cycle_old*1e3:.2f}', f'{t_cycle*1e3:.2f}', f'{t_cycle_old/t_cycle:.2f}x'])
+    report(rows, ['nodes', 'legacy lookup us', 'index lookup us', 'legacy cycle ms', 'index cycle ms', 'speedup'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+'''
+CHASSIS response matching with N requests outstanding (degraded link: answers late,
+lost or duplicated), responses/sec.
+"legacy" is the pending deque with a linear header compare scan and deque.remove(),
+"current" the match_key index. Sends included, answers are SRM stop ACKs.
+
+    python benchmarks/bench_pending_match.py [--pending 4 16 64 256] [-r repeats]
+'''
+import argparse, collections, logging, random
+from common import *
+from protocol.sn_emulator import SN_EMULATOR
+SN_EMULATOR(LR_NUM=1)
+from device import CHASSIS
+
+TIMEOUTS = {'packet_lifetime': 1, 'node_total_lifetime': 60, 'packet_wait_timeout': 5}
+
+class LEGACY_CHASSIS(CHASSIS):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.pending_requests = collections.deque()
+
+    def send_and_update_random_id(self, request):
+        self.random_id += 1
+        if self.random_id == 256: self.random_id = 0
+        self.pending_requests.append(request)
+        self.request_to_chassis(request)
+
+    def response_from_chassis(self, response):
+        now = time.monotonic()
+        valid_packet_found = None
+        for request in self.pending_requests:
+            valid_packet_found = request.hdr.if_type is response.hdr.if_type and \
+                                 request.hdr.dst_addr == response.hdr.src_addr and \
+                                 request.hdr.random_id == response.hdr.random_id
+            if valid_packet_found: break
+        if valid_packet_found:
+            self.pending_requests.remove(request)
+            self.stats['rx'].add(now, 0)
+            self.handle_response(request, response, now)
+
+def new_device(cls):
+    hdr = CHA_PROTO_HDR(CHA_LR_IF_TYPE.WIFI_0, CHA_MSG_TYPE.CNTL_STAT_ACK, src=1)
+    return cls(logging.getLogger('BENCH'), TIMEOUTS, lambda request: None,
+               CHA_STATE_RESPONSE(hdr, cha_state_payload(1)))
+
+def traffic(n_pending, seed=0):
+    '''Requests in send order and their answers shuffled, 1 in 8 answered twice'''
+    rnd = random.Random(seed)
+    requests = [CHA_SRM_STOP_REQUEST(CHA_LR_IF_TYPE.WIFI_0, 1, rand%256) for rand in range(n_pending)]
+    responses = [CHA_RESPONSE(CHA_PROTO_HDR(CHA_LR_IF_TYPE.WIFI_0, CHA_MSG_TYPE.SRM_STOP_ACK, rand=r.hdr.random_id, src=1))
+                 for r in requests]
+    responses += rnd.sample(responses, len(responses)//8)
+    rnd.shuffle(responses)
+    return requests, responses
+
+def legacy(dev, requests, responses):
+    dev.pending_requests.clear()
+    for request in requests: dev.send_and_update_random_id(request)
+    for response in responses: dev.response_from_chassis(response)
+
+def current(dev, requests, responses):
+    dev.pending.clear()
+    dev.expiry.clear()
+    dev.closed.clear()
+    for request in requests: dev.send_and_update_random_id(request)
+    for response in responses: dev.response_from_chassis(response)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pending', type=int, nargs='+', default=[4, 16, 64, 256])
+    parser.add_argument('-r', '--repeats', type=int, default=50)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    legacy_dev, dev = new_device(LEGACY_CHASSIS), new_device(CHASSIS)
+
+    rows = list()
+    for n_pending in args.pending:
+        requests, responses = traffic(n_pending)
+        t_old = timeit(legacy, args.repeats, legacy_dev, requests, responses)
+        t_new = timeit(current, args.repeats, dev, requests, responses)
+        rows.append([n_pending, int(len(responses)/t_old), int(len(responses)/t_new), f'{t_old/t_new:.2f}x'])
+    report(rows, ['pending', 'legacy resp/s', 'current resp/s', 'speedup'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+'''
+node_data storage codecs: stored bytes per second and encode/decode CPU per job
+(one job = 1 second of data from all nodes) at every REAL_DATARATE.
+
+    python benchmarks/bench_storage_codec.py [--nodes 15] [--channels 4] [-n jobs]
+'''
+import argparse
+from common import *
+from storage_codec import CODECS, encode_doc, decode_doc
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=15)
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('-n', '--jobs', type=int, default=3)
+    args = parser.parse_args()
+
+    rows = list()
+    for rate in REAL_DATARATE:
+        cfg = adc_cfg(rate.value, args.channels)
+        docs = [{'channels': cfg.ch_bit_mask, 'samples_count': rate.value,
+                 'data': seismic_samples(rate.value, args.channels, seed)} for seed in range(args.nodes)]
+        raw_sz = sum(len(doc['data']) for doc in docs)
+        for codec in CODECS:
+            start = time.process_time()
+            for _ in range(args.jobs): encoded = [encode_doc(doc, codec) for doc in docs]
+            enc_time = (time.process_time() - start)/args.jobs
+            start = time.process_time()
+            for _ in range(args.jobs): decoded = [decode_doc(doc) for doc in encoded]
+            dec_time = (time.process_time() - start)/args.jobs
+            assert decoded == [doc['data'] for doc in docs]
+            enc_sz = sum(len(doc['data']) for doc in encoded)
+            rows.append([rate.name, codec, f'{enc_sz/1024:.1f}', f'{raw_sz/enc_sz:.2f}',
+                         f'{enc_time*1000:.1f}', f'{dec_time*1000:.1f}'])
+    report(rows, ['rate', 'codec', 'KiB/s', 'ratio', 'encode ms/job', 'decode ms/job'])
+
+if __name__ == '__main__':
+    main()
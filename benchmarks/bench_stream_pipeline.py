@@ -0,0 +1,162 @@
+'''
+End-to-end stream pipeline: cha_emulator (loopback) -> IFACE_CHASSIS.process_frame/un_serialize
+-> LINRET_STREAMREADER -> STREAM_INTERFACE_JOB -> DB_WRITER, one job = 1 second of acquisition.
+Reports frames/sec, job start/recv/stop/total latencies, stream requests sent, pipeline threads CPU per second of
+acquisition (emulator excluded) and peak RSS. Every combination runs in its own process.
+DB is mongomock if installed, else an in-bench sink that BSON-encodes what it gets.
+
+    python benchmarks/bench_stream_pipeline.py [--nodes 1 2 4 8 16 32] [--rates 500 1000 2000]
+                                               [--channels 4] [-n jobs] [--max-jobs 4] [--data-loss 0.01] [--no-demux]
+'''
+import argparse, concurrent.futures, logging, multiprocessing, resource, statistics, threading
+import bson, psutil
+from common import *
+from protocol.cha_stream_structs import BITMASK_SZ
+from protocol.sn_emulator import SN_EMULATOR
+
+MAX_PACKETS_PER_NODE = 8 # 3 bit packet_n in the stream data header
+
+class SINK_COLLECTION:
+    def __init__(self):
+        self.n_docs = 0
+        self.n_bytes = 0
+
+    def list_indexes(self): return []
+    def create_index(self, *args, **kwargs): pass
+
+    def insert_many(self, docs, ordered=True):
+        for doc in docs: self.n_bytes += len(bson.encode(doc))
+        self.n_docs += len(docs)
+
+    def bulk_write(self, ops, ordered=True):
+        self.n_docs += len(ops)
+
+class SINK_ADMIN:
+    def command(self, *args): return {'ok': 1}
+
+class SINK_CLIENT:
+    def __init__(self):
+        self.admin = SINK_ADMIN()
+    def close(self): pass
+
+def use_db_stand_in(writer):
+    try:
+        import mongomock
+        writer.db_client = mongomock.MongoClient()
+        db = writer.db_client[writer.db_config['db_name']]
+        writer.data_collection = db[writer.db_config['data_collection']]
+        writer.time_cache_collection = db[writer.db_config['timecache_collection']]
+        return 'mongomock'
+    except ImportError:
+        writer.db_client = SINK_CLIENT()
+        writer.data_collection = SINK_COLLECTION()
+        writer.time_cache_collection = SINK_COLLECTION()
+        return 'sink'
+
+def run_combination(n_nodes, datarate, n_ch, n_jobs, max_jobs, data_loss, packet_interval, demux):
+    SN_EMULATOR(LR_NUM=1)
+    import cha_emulator, iface_chassis, stream_proc, db_writer
+    logging.disable(logging.WARNING)
+
+    pc = bench_config(rx_backend={'type':'loopback', 'batch_size':32},
+                      spool={'enabled': False},
+                      delay_before_request=0, delay_between_requests=0,
+                      stream_jobs={'max_jobs_per_iface': max_jobs, 'max_queued_jobs': n_jobs, 'admission_window': 0.5})
+    emu_cfg = cha_emulator.default_emulator_config()
+    emu_cfg.update({'nodes': {'WIRED_0': n_nodes}, 'data_loss': data_loss,
+                    'packet_interval': packet_interval, 'seed': 0})
+    emulator = cha_emulator.CHA_EMULATOR(emu_cfg, cha_emulator.loopback())
+
+    class TRUE_TIME_STUB:
+        def get_true_time(self): return time.time()
+
+    chassis = iface_chassis.IFACE_CHASSIS(pc)
+    streamer = stream_proc.LINRET_STREAMREADER(pc, TRUE_TIME_STUB())
+    writer = db_writer.DB_WRITER(pc)
+    db_name = use_db_stand_in(writer)
+
+    cfg = adc_cfg(datarate, n_ch)
+    devs = {CHA_LR_IF_TYPE.WIRED_0: [{'addr':addr, 'srm_serial_bytes':b'SRM%05d'%addr}
+                                     for addr in range(1, n_nodes+1)]}
+    first_timestamp = int(time.time()) - n_jobs - 10
+    jobs = [stream_proc.STREAM_JOB(chassis.send_msg_to_chassis, lambda m: None, first_timestamp + i, cfg, devs)
+            for i in range(n_jobs)]
+    chassis.register_msg_handlers(lambda m: None, streamer.send_msg_to_streamer, lambda m: None)
+    streamer.register_msg_handlres(chassis.send_msg_to_chassis, lambda m: None, lambda m: None, writer.send_msg_to_db)
+    writer.register_msg_handlers(lambda m: None)
+    if demux: streamer.register_stream_sinks(chassis.register_stream_sink, chassis.unregister_stream_sink)
+
+    emulator.run()
+    chassis.run()
+    streamer.run()
+    writer.run()
+    pipeline_threads = [chassis.rx_thread, chassis.tx_thread, streamer.t, writer.t] + writer.workers
+
+    start = time.monotonic()
+    for job in jobs: streamer.send_msg_to_streamer(job)
+    while any(job.state is not stream_proc.JOB_GLOBAL_STATE.FINISHED for job in jobs):
+        if time.monotonic() - start > n_jobs*5 + 10: break
+        time.sleep(0.005)
+    wall_time = time.monotonic() - start
+    finished = [job.iface_jobs[CHA_LR_IF_TYPE.WIRED_0] for job in jobs if job.state is stream_proc.JOB_GLOBAL_STATE.FINISHED]
+    rx_frames = chassis.dbg_stats['rx_ctr']
+    native_ids = {t.native_id for t in pipeline_threads}
+    cpu = sum(t.user_time + t.system_time for t in psutil.Process().threads() if t.id in native_ids)
+
+    streamer.send_msg_to_streamer('shutdown')
+    streamer.join()
+    writer.send_msg_to_db('shutdown')
+    writer.join()
+    chassis.send_msg_to_chassis('shutdown')
+    chassis.join()
+    emulator.stop()
+
+    lats = {name: [getattr(job, name) for job in finished] for name in ('start_wait_time', 'data_wait_time', 'stop_wait_time')}
+    lats['job'] = [sum(times) for times in zip(lats['start_wait_time'], lats['data_wait_time'], lats['stop_wait_time'])]
+    fmt = lambda vals: f'{statistics.mean(vals):.0f}/{max(vals)}' if vals else '-'
+    return {
+        'db': db_name,
+        'jobs': f'{sum(job.recvd_packet_mask == job.job_packet_mask for job in finished)}/{len(jobs)}',
+        'jobs/s': f'{len(finished)/wall_time:.1f}',
+        'frames/s': f'{rx_frames/wall_time:.0f}',
+        'start ms': fmt(lats['start_wait_time']),
+        'recv ms': fmt(lats['data_wait_time']),
+        'stop ms': fmt(lats['stop_wait_time']),
+        'job ms': fmt(lats['job']),
+        'cpu ms/s': f'{cpu/max(len(finished), 1)*1000:.1f}',
+        'rss MiB': f'{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024:.0f}',
+        'requests': emulator.stats['requests'],
+        'resent': emulator.stats['data_packets_resent'],
+        'str drops': streamer.bus.n_drops(),
+        'docs': writer.dbg_stats['docs_written'],
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--rates', type=int, nargs='+', default=[r.value for r in REAL_DATARATE])
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('-n', '--jobs', type=int, default=5)
+    parser.add_argument('--max-jobs', type=int, default=4, help="Stream jobs in flight per interface")
+    parser.add_argument('--data-loss', type=float, default=0.0)
+    parser.add_argument('--packet-interval', type=float, default=0.0, help="Emulator link pacing, 0 unpaced")
+    parser.add_argument('--no-demux', action='store_true', help="Stream data through the streamer bus, no RX thread sinks")
+    args = parser.parse_args()
+
+    rows, skipped = list(), list()
+    ctx = multiprocessing.get_context('spawn')
+    for datarate in args.rates:
+        ppn = adc_cfg(datarate, args.channels).packets_per_node()
+        for n_nodes in args.nodes:
+            if ppn > MAX_PACKETS_PER_NODE or n_nodes*ppn > BITMASK_SZ*8:
+                skipped.append(f'{n_nodes}x{datarate}')
+                continue
+            with concurrent.futures.ProcessPoolExecutor(1, mp_context=ctx) as pool:
+                result = pool.submit(run_combination, n_nodes, datarate, args.channels, args.jobs,
+                                     args.max_jobs, args.data_loss, args.packet_interval, not args.no_demux).result()
+            rows.append([n_nodes, datarate] + list(result.values()))
+    if rows: report(rows, ['nodes', 'rate'] + list(result.keys()))
+    if skipped: print(f'skipped (packets per node > {MAX_PACKETS_PER_NODE} or job mask > {BITMASK_SZ*8} bits): {" ".join(skipped)}')
+
+if __name__ == '__main__':
+    main()
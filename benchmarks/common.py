@@ -0,0 +1,89 @@
+import os, sys, json, struct, tempfile, time, random
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'linret_app')
+REPO_CONFIG = os.path.join(APP_DIR, '..', 'config.json')
+sys.path.insert(0, APP_DIR)
+
+from config import PROGRAM_CONFIG
+from protocol.cha_enums import *
+from protocol.cs_enums import *
+from protocol.cha_structs import *
+from protocol.uni_structs import *
+
+'''
+Benchmark helpers: config in a temp file and synthetic chassis frames
+(eth payloads, as returned by RX backends)
+'''
+
+def bench_config(**overrides) -> PROGRAM_CONFIG:
+    with open(REPO_CONFIG) as f: cfg = json.load(f)
+    cfg.update(overrides)
+    fd, filename = tempfile.mkstemp(suffix='.json', prefix='linret_bench_')
+    with os.fdopen(fd, 'w') as f: json.dump(cfg, f)
+    return PROGRAM_CONFIG(filename)
+
+def adc_cfg(datarate=1000, n_ch=4) -> UNI_ADC_CFG:
+    ch_mask = [1 if i < n_ch else 0 for i in range(4)]
+    return UNI_ADC_CFG(REAL_DATARATE(datarate), ch_mask, [CS_GAIN_CODE(0)]*4)
+
+def cha_frame(if_type, msg_type, payload=b'', src=1, dst=0, rand=0, chunk_n=0, nak=CHA_NAK_CODE.NO_ERROR):
+    hdr = CHA_PROTO_HDR(if_type, msg_type, chu=chunk_n, sz=len(payload), rand=rand, src=src, dst=dst, nak=nak)
+    return bytes(hdr) + payload
+
+def stream_data_frames(if_type, rand, node_id, packet_n, payload):
+    half = len(payload)//2
+    data_hdr = bytes([node_id, (packet_n&0x07)|0x08, 0, 0]) # payload present
+    return [
+        cha_frame(if_type, CHA_MSG_TYPE.STREAM_DATA, data_hdr + payload[:half], src=node_id, rand=rand),
+        cha_frame(if_type, CHA_MSG_TYPE.STREAM_DATA, payload[half:], src=node_id, rand=rand, chunk_n=1)
+    ]
+
+def gps_bytes(num_sv=8):
+    return CHA_GPS_STRUCT.CHA_GPS_STRUCT.pack(375000000, 557500000, 3, num_sv, 150, int(time.time()))
+
+def cha_state_payload(addr, flags=0x00FF_FFFF):
+    params = CHA_STATE_RESPONSE.CHA_PARAMS_STRUCT.pack(
+        b'CHA%05d'%addr, b'bench', addr, CHA_DEV_TYPE.NODE_LAND, CHA_VCXO_TYPE.MXO37, CHA_SYNC_SRC.GPS,
+        False, False, CHA_CONN_TYPE.WIRED, 0, bytes(6), CHA_CONN_TYPE.WIRED, 0, bytes(6), 0, 0, 0, 0)
+    adc = CHA_STATE_RESPONSE.ADC_STRUCT.pack(15.5, 15.2, 3.3, 0, 1.2, 0.8, 0, 0)
+    time_sync = CHA_STATE_RESPONSE.TIME_SYNC_STRUCT.pack(1, 1, 0, 1, int(time.time()), int(time.time()))
+    return CHA_STATE_RESPONSE.CHA_STATE_STRUCT.pack(
+        flags, gps_bytes(), gps_bytes(), adc, time_sync, 45.0, 21.5, params, bytes(6), bytes(6))
+
+def srm_status_payload(adc_params:UNI_ADC_CFG, flags=0x00FF_F0FF):
+    return CHA_SRM_STATUS_RESPONSE.SRM_DATA_HDR_STRUCT.pack(
+        0, 0, int(time.time()), 557500000, 375000000, 150, 1013, 0, 0, 1000, 0, 0, 0, 0, 22, 40,
+        flags, adc_params.to_srm_bytes())
+
+def traffic_mix(n_nodes=15, datarate=1000, n_ch=4, if_type=CHA_LR_IF_TYPE.WIRED_0):
+    '''One second of traffic: full stream job data plus state polls of every node'''
+    cfg = adc_cfg(datarate, n_ch)
+    frames = [cha_frame(if_type, CHA_MSG_TYPE.STREAM_START_ACK)]
+    for node_id in range(1, n_nodes+1):
+        for packet_n in range(cfg.packets_per_node()):
+            frames += stream_data_frames(if_type, 0, node_id, packet_n, os.urandom(UNI_ADC_CFG.PACKET_PAYLOAD_SZ))
+    frames.append(cha_frame(if_type, CHA_MSG_TYPE.STREAM_STOP_ACK))
+    for addr in range(1, n_nodes+1):
+        frames.append(cha_frame(if_type, CHA_MSG_TYPE.CNTL_STAT_ACK, cha_state_payload(addr), src=addr))
+        frames.append(cha_frame(if_type, CHA_MSG_TYPE.SRM_STAT_ACK, srm_status_payload(cfg), src=addr))
+    return frames
+
+def seismic_samples(n_samples, n_ch=4, seed=0) -> bytes:
+    '''Node data: noisy random walk per channel, 24 bit BE interleaved like SRM output'''
+    rnd = random.Random(seed)
+    vals, out = [0]*n_ch, bytearray()
+    for _ in range(n_samples):
+        for ch in range(n_ch):
+            vals[ch] = max(-(1<<23), min((1<<23)-1, int(vals[ch]*0.98 + rnd.gauss(0, 2000))))
+            out += (vals[ch] & 0xFFFFFF).to_bytes(3, 'big')
+    return bytes(out)
+
+def timeit(func, n, *args):
+    start = time.perf_counter()
+    for _ in range(n): func(*args)
+    return (time.perf_counter() - start)/n
+
+def report(rows, cols):
+    widths = [max(len(str(c)), *(len(str(r[i])) for r in rows)) for i, c in enumerate(cols)]
+    print('  '.join(str(c).rjust(w) for c, w in zip(cols, widths)))
+    for r in rows: print('  '.join(str(v).rjust(w) for v, w in zip(r, widths)))
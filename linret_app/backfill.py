@@ -0,0 +1,92 @@
+'''
+Backfill of partially received seconds.
+Nodes still missing packets when their stream job ends are written with a 'packets'
+field (bit n set: node packet n received, missing packets are zero filled) and kept
+here. A later job for the same timestamp requests only the missing packets while the
+SRM still holds that second ('max_age' seconds). Records with 'packets' are upserted,
+the backfilled record replaces the partial one.
+'''
+
+class PARTIAL_NODE:
+    __slots__ = ('addr', 'sn', 'buf', 'mask')
+
+    def __init__(self, addr, sn, buf:bytearray, mask):
+        self.addr = addr
+        self.sn = sn
+        self.buf = buf
+        self.mask = mask
+
+class PARTIAL_SECOND:
+    __slots__ = ('timestamp', 'iface', 'adc_params', 'nodes', 'attempts', 'next_try')
+
+    def __init__(self, timestamp, iface, adc_params, nodes:list, next_try, attempts=0):
+        self.timestamp = timestamp
+        self.iface = iface
+        self.adc_params = adc_params
+        self.nodes = nodes
+        self.attempts = attempts
+        self.next_try = next_try
+
+class BACKFILL:
+    def __init__(self, cfg):
+        self.enabled = cfg['enabled']
+        self.retry_delay = cfg['retry_delay']
+        self.max_age = cfg['max_age']
+        self.max_attempts = cfg['max_attempts']
+        self.max_pending = cfg['max_pending']
+        self.pending:dict[tuple, PARTIAL_SECOND] = dict() # (timestamp, iface)
+        self.nodes_completed = 0
+        self.nodes_failed = 0
+        self.stats = {
+            'backfill_pending': 0,
+            'backfill_partial_nodes': 0,
+            'backfill_jobs': 0,
+            'backfill_nodes_completed': 0,
+            'backfill_nodes_failed': 0,
+            'backfill_hit_rate': None,
+            'backfill_bytes_saved': 0 # held packets not transferred again
+        }
+
+    def add(self, timestamp, iface, adc_params, nodes:list, now, attempts=0):
+        if not self.enabled or not nodes: return
+        if attempts == 0: self.stats['backfill_partial_nodes'] += len(nodes)
+        if attempts >= self.max_attempts: return self.failed(len(nodes))
+        if len(self.pending) >= self.max_pending:
+            oldest = min(self.pending, key=lambda key: key[0])
+            self.failed(len(self.pending.pop(oldest).nodes))
+        self.pending[(timestamp, iface)] = PARTIAL_SECOND(timestamp, iface, adc_params, nodes,
+                                                          now + self.retry_delay, attempts)
+        self.update_stats()
+
+    def due(self, now, abs_time, limit) -> list:
+        '''Up to limit PARTIAL_SECONDs to request again now, oldest first'''
+        due = list()
+        for key, second in sorted(self.pending.items(), key=lambda item: item[0][0]):
+            if abs_time - second.timestamp > self.max_age:
+                self.failed(len(self.pending.pop(key).nodes))
+            elif second.next_try <= now and len(due) < limit:
+                due.append(self.pending.pop(key))
+        self.stats['backfill_jobs'] += len(due)
+        self.update_stats()
+        return due
+
+    def done(self, second:PARTIAL_SECOND, packet_sz, complete:list, incomplete:list, now):
+        '''Backfill job result: complete sns and PARTIAL_NODEs still missing packets'''
+        held = {node.sn:node.mask.bit_count() for node in second.nodes}
+        self.stats['backfill_bytes_saved'] += sum(held[sn] for sn in complete)*packet_sz
+        self.nodes_completed += len(complete)
+        self.add(second.timestamp, second.iface, second.adc_params, incomplete, now, second.attempts + 1)
+        self.update_stats()
+
+    def failed(self, n_nodes):
+        self.nodes_failed += n_nodes
+
+    def update_stats(self):
+        self.stats['backfill_pending'] = len(self.pending)
+        self.stats['backfill_nodes_completed'] = self.nodes_completed
+        self.stats['backfill_nodes_failed'] = self.nodes_failed
+        n_done = self.nodes_completed + self.nodes_failed
+        self.stats['backfill_hit_rate'] = round(self.nodes_completed/n_done, 3) if n_done else None
+
+    def get_stats(self):
+        return self.stats
@@ -0,0 +1,418 @@
+import os, time, heapq, threading, random, struct, collections, logging, argparse
+from rawsocketpy import RawSocket
+from protocol.cha_enums import *
+from protocol.cha_structs import *
+from protocol.cha_stream_structs import *
+from protocol.uni_structs import *
+
+'''
+Chassis/SRM emulator: answers 0xEEF9 requests with 0xEEFA responses for N nodes per interface.
+Control: handshake, CNTL_STAT, SRM_STAT, NODES_BC, SRM_FAT (2 chunks), CLK_SET, SRM_RUN/STOP.
+Stream: START/FB/STOP, data packets are paced per interface and split in 2 chunks.
+Every response frame gets 'latency' + uniform(0, 'jitter') delay and is lost with 'loss' probability.
+
+Transports: LOOPBACK_TRANSPORT in-process (rx_backend type 'loopback'),
+RAW_TRANSPORT on an ethernet interface, e.g. one end of a veth pair:
+    python cha_emulator.py -e veth1 -n WIRED_0:15
+'''
+
+EMU_ADC_FLAGS = 0x00FF0F3E # pps, vbus, eeprom, vcxo, adc sync, powered, adc/sensors ok
+CHA_STATE_FLAGS = 0x7FFF | 1<<18 | 0x3F<<24 # ports/hw ok, nodal mode, pps/sync/srm/links ok
+STREAM_LIFETIME = 5 # seconds, streams never stopped are dropped
+
+def default_emulator_config():
+    return {
+        'nodes': {'LOCAL':1, 'WIRED_0':15},
+        'adc': {'datarate':1000, 'ch_mask':[1,1,1,1], 'gains':[0,0,0,0]}, # None: SRMs wait for SRM_RUN
+        'latency': 0.001,
+        'jitter': 0.0,
+        'loss': 0.0,
+        'data_loss': 0.0,
+        'packet_interval': 0.0002, # per interface link time of one data packet
+        'first_chunk_sz': 752,
+        'seed': None
+    }
+
+class EMU_NODE:
+    def __init__(self, if_type:CHA_LR_IF_TYPE, addr, adc:UNI_ADC_CFG):
+        self.if_type = if_type
+        self.addr = addr
+        self.alive = True
+        self.cha_sn = b'CHA%d%04d'%(if_type, addr)
+        self.srm_sn = 'EMU-SRM-SRM%d%04d'%(if_type, addr)
+        self.clock_set = False
+        self.acq_running = adc is not None
+        self.adc_bytes = adc.to_srm_bytes() if adc is not None else bytes(4)
+
+    def state_payload(self):
+        now = int(time.time())
+        gps = CHA_GPS_STRUCT.CHA_GPS_STRUCT.pack(375000000, 557500000, 3, 9, 150, now)
+        params = CHA_STATE_RESPONSE.CHA_PARAMS_STRUCT.pack(
+            self.cha_sn, b'emulator', self.addr, CHA_DEV_TYPE.NODE_LAND, CHA_VCXO_TYPE.MXO37, CHA_SYNC_SRC.GPS,
+            False, False, CHA_CONN_TYPE.WIRED, 0, bytes(6), CHA_CONN_TYPE.WIRED, 0, bytes(6), 0, 0, 0, 0)
+        adc = CHA_STATE_RESPONSE.ADC_STRUCT.pack(15.5, 15.2, 3.3, 0, 1.2, 0.8, 0, 0)
+        time_sync = CHA_STATE_RESPONSE.TIME_SYNC_STRUCT.pack(self.clock_set, True, 0, True, now, now)
+        flags = CHA_STATE_FLAGS | (1<<30 if self.acq_running else 0)
+        return CHA_STATE_RESPONSE.CHA_STATE_STRUCT.pack(
+            flags, gps, gps, adc, time_sync, 45.0, 21.5, params, bytes(6), bytes(6))
+
+    def srm_status_payload(self):
+        flags = EMU_ADC_FLAGS | (1<<6 if self.acq_running else 0)
+        return CHA_SRM_STATUS_RESPONSE.SRM_DATA_HDR_STRUCT.pack(
+            0, 0, int(time.time()), 557500000, 375000000, 150, 1013, 0, 0, 1000, 0, 0, 0, 0, 22, 40,
+            flags, self.adc_bytes)
+
+    def srm_table_payload(self):
+        return CHA_SRM_TABLE_RESPONSE.TABLE_HDR_STRUCT.pack(0, 0, 0, 0, 0, 0, self.srm_sn.encode('ASCII'))
+
+class EMU_STREAM:
+    def __init__(self, if_type, rand_id, timestamp, mask:int, adc:UNI_ADC_CFG):
+        self.if_type = if_type
+        self.rand_id = rand_id
+        self.timestamp = timestamp
+        self.mask = mask
+        self.ppn = adc.packets_per_node()
+        self.in_flight = 0 # packets scheduled, not yet on the link
+        self.stopped = False
+
+class CHA_EMULATOR:
+    def __init__(self, cfg:dict, transport):
+        self.log = logging.getLogger('EMU')
+        self.cfg = cfg
+        self.transport = transport
+        self.rnd = random.Random(cfg['seed'])
+        adc = UNI_ADC_CFG.from_config_json(cfg['adc']) if cfg['adc'] else None
+        self.nodes: dict[int, EMU_NODE] = dict()
+        for iface, n_nodes in cfg['nodes'].items():
+            for addr in range(1, n_nodes + 1):
+                node = EMU_NODE(CHA_LR_IF_TYPE[iface], addr, adc)
+                self.nodes[(node.if_type<<8) + addr] = node
+        self.streams: dict[tuple, EMU_STREAM] = dict() # (if_type, rand_id)
+        self.link_free = collections.defaultdict(float) # if_type -> time the data link is idle
+        self.data_pool = os.urandom(1<<16)
+        self.outbox = list() # heap of (due, seq, frame, stream, packet bit)
+        self.seq = 0
+        self.cond = threading.Condition()
+        self.shutdown = False
+        self.t = threading.Thread(target=self.send_loop)
+        self.handlers = {
+            CHA_MSG_TYPE.LR_HANDSHAKE_REQ: self.on_handshake,
+            CHA_MSG_TYPE.CNTL_STAT_REQ: self.on_state,
+            CHA_MSG_TYPE.SRM_STAT_REQ: self.on_srm_state,
+            CHA_MSG_TYPE.CNTL_NODES_BC_REQ: self.on_discovery,
+            CHA_MSG_TYPE.SRM_FAT_REQ: self.on_srm_table,
+            CHA_MSG_TYPE.CNTL_CLK_SET_REQ: self.on_set_clock,
+            CHA_MSG_TYPE.SRM_RUN_REQ: self.on_srm_run,
+            CHA_MSG_TYPE.SRM_STOP_REQ: self.on_srm_stop,
+            CHA_MSG_TYPE.STREAM_START: self.on_stream_start,
+            CHA_MSG_TYPE.STREAM_FB: self.on_stream_feedback,
+            CHA_MSG_TYPE.STREAM_STOP: self.on_stream_stop,
+        }
+        self.stats = {
+            'requests': 0,
+            'unhandled_requests': 0,
+            'frames_sent': 0,
+            'frames_lost': 0,
+            'streams': 0,
+            'data_packets_sent': 0,
+            'data_packets_resent': 0,
+            'unencodable_packets': 0
+        }
+        transport.attach(self)
+
+    def run(self):
+        self.t.start()
+        self.transport.run()
+
+    def stop(self):
+        with self.cond:
+            self.shutdown = True
+            self.cond.notify()
+        self.t.join()
+        self.transport.close()
+
+    def set_node_alive(self, if_type:CHA_LR_IF_TYPE, addr, alive:bool):
+        self.nodes[(if_type<<8) + addr].alive = alive
+
+    def get_stats(self):
+        return dict(self.stats)
+
+    def queue_frame(self, due, frame, stream=None, bit=0):
+        with self.cond:
+            self.seq += 1
+            heapq.heappush(self.outbox, (due, self.seq, frame, stream, bit))
+            if self.outbox[0][1] == self.seq: self.cond.notify()
+
+    def send_loop(self):
+        while True:
+            with self.cond:
+                while not self.shutdown:
+                    timeout = self.outbox[0][0] - time.monotonic() if self.outbox else None
+                    if timeout is not None and timeout <= 0: break
+                    self.cond.wait(timeout)
+                if self.shutdown: break
+                due, _, frame, stream, bit = heapq.heappop(self.outbox)
+            if stream is not None:
+                stream.in_flight &= ~bit
+                if stream.stopped: continue
+                loss = self.cfg['data_loss']
+            else: loss = self.cfg['loss']
+            if loss and self.rnd.random() < loss:
+                self.stats['frames_lost'] += 1
+                continue
+            self.transport.deliver(frame)
+            self.stats['frames_sent'] += 1
+
+    def response_delay(self):
+        jitter = self.cfg['jitter']
+        return self.cfg['latency'] + (self.rnd.uniform(0, jitter) if jitter else 0)
+
+    def respond(self, req:CHA_PROTO_HDR, payload=b'', chunk_n=0, nak=CHA_NAK_CODE.NO_ERROR, delay=None):
+        hdr = CHA_PROTO_HDR(req.if_type, CHA_MSG_TYPE(req.msg_type|CHA_MSG_TYPE.ACK_BIT), chu=chunk_n,
+                            sz=len(payload), rand=req.random_id, src=req.dst_addr, dst=0, nak=nak)
+        if delay is None: delay = self.response_delay()
+        self.queue_frame(time.monotonic() + delay, bytes(hdr) + payload)
+
+    def handle_frame(self, frame):
+        '''Request frame from the app (eth payload)'''
+        try: hdr = CHA_PROTO_HDR.from_bytes(frame)
+        except (ValueError, struct.error):
+            self.stats['unhandled_requests'] += 1
+            return
+        self.stats['requests'] += 1
+        payload = frame[CHA_PROTO_HDR.HDR_SZ:CHA_PROTO_HDR.HDR_SZ+hdr.chunk_sz]
+        if (handler := self.handlers.get(hdr.msg_type)) is None:
+            self.stats['unhandled_requests'] += 1
+            return
+        handler(hdr, payload)
+
+    def node(self, hdr:CHA_PROTO_HDR):
+        '''Addressed node, None if absent: the request times out'''
+        node = self.nodes.get((hdr.if_type<<8) + hdr.dst_addr)
+        return node if node is not None and node.alive else None
+
+    def on_handshake(self, hdr, payload):
+        self.respond(hdr)
+
+    def on_state(self, hdr, payload):
+        if node := self.node(hdr): self.respond(hdr, node.state_payload())
+
+    def on_srm_state(self, hdr, payload):
+        if node := self.node(hdr): self.respond(hdr, node.srm_status_payload())
+
+    def on_discovery(self, hdr, payload):
+        if self.node(hdr):
+            self.respond(hdr, bytes(CHA_DISCOVERY_SLOT.SLOT_SZ*CHA_DISCOVERY_RESPONSE.N_SLOTS))
+
+    def on_srm_table(self, hdr, payload):
+        if node := self.node(hdr):
+            table = node.srm_table_payload()
+            delay = self.response_delay()
+            self.respond(hdr, table[:len(table)//2], 0, delay=delay)
+            self.respond(hdr, table[len(table)//2:], 1, delay=delay)
+
+    def on_set_clock(self, hdr, payload):
+        if node := self.node(hdr):
+            node.clock_set = True
+            phase = int((time.time()%1)*1000000000)
+            self.respond(hdr, CHA_SET_CLOCK_RESPONSE.DATASTRUCT.pack(phase))
+
+    def on_srm_run(self, hdr, payload):
+        if node := self.node(hdr):
+            srm_cmd = CHA_SRM_RUN_REQUEST.SRM_CMD_DATASTRUCT.unpack_from(payload, CHA_SRM_RUN_REQUEST.CHA_CMD_DATASTRUCT.size)
+            node.adc_bytes = srm_cmd[-1]
+            node.acq_running = True
+            self.respond(hdr)
+
+    def on_srm_stop(self, hdr, payload):
+        if node := self.node(hdr):
+            node.acq_running = False
+            self.respond(hdr)
+
+    def on_stream_start(self, hdr, payload):
+        timestamp, mask_bytes, adc_code = STREAM_START_REQUEST.DATASTRUCT.unpack_from(payload)
+        key = (hdr.if_type, hdr.random_id)
+        self.respond(hdr)
+        if key in self.streams: return # repeated START, already streaming
+        for old_key in [k for k, old in self.streams.items() if old.timestamp + STREAM_LIFETIME < timestamp]:
+            self.streams.pop(old_key).stopped = True
+        adc = UNI_ADC_CFG.from_srm_bytes(struct.pack(UNI_ADC_CFG.SRM_ADC_CFG_DATASTRUCT, adc_code))
+        stream = EMU_STREAM(hdr.if_type, hdr.random_id, timestamp, int.from_bytes(mask_bytes, 'little'), adc)
+        self.streams[key] = stream
+        self.stats['streams'] += 1
+        self.send_packets(stream, stream.mask, time.monotonic() + self.response_delay())
+
+    def on_stream_feedback(self, hdr, payload):
+        if (stream := self.streams.get((hdr.if_type, hdr.random_id))) is None: return
+        _, mask_bytes = STREAM_FEEDBACK_REQUEST.DATASTRUCT.unpack_from(payload)
+        missing = stream.mask & ~int.from_bytes(mask_bytes, 'little') & ~stream.in_flight
+        if missing:
+            n = self.send_packets(stream, missing, time.monotonic())
+            self.stats['data_packets_resent'] += n
+
+    def on_stream_stop(self, hdr, payload):
+        if stream := self.streams.pop((hdr.if_type, hdr.random_id), None): stream.stopped = True
+        self.respond(hdr)
+
+    def send_packets(self, stream:EMU_STREAM, mask, start):
+        '''Schedules mask packets of alive nodes back to back on the interface link'''
+        due = max(start, self.link_free[stream.if_type])
+        interval = self.cfg['packet_interval']
+        jitter = self.cfg['jitter']
+        n = 0
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            packet_n = bit.bit_length() - 1
+            node_id, packet_in_node = packet_n//stream.ppn + 1, packet_n%stream.ppn
+            node = self.nodes.get((stream.if_type<<8) + node_id)
+            if node is None or not node.alive: continue
+            if packet_in_node > 0x07: # 3 bit packet_n in the data header
+                self.stats['unencodable_packets'] += 1
+                continue
+            delay = self.rnd.uniform(0, jitter) if jitter else 0
+            for frame in self.data_frames(stream, node_id, packet_in_node):
+                self.queue_frame(due + delay, frame, stream, bit)
+            stream.in_flight |= bit
+            due += interval
+            n += 1
+        self.link_free[stream.if_type] = due
+        self.stats['data_packets_sent'] += n
+        return n
+
+    def data_frames(self, stream:EMU_STREAM, node_id, packet_in_node):
+        packet_sz = UNI_ADC_CFG.PACKET_PAYLOAD_SZ
+        offset = ((node_id*stream.ppn + packet_in_node)*packet_sz) % (len(self.data_pool) - packet_sz)
+        data = self.data_pool[offset:offset+packet_sz]
+        first = self.cfg['first_chunk_sz']
+        data_hdr = bytes([node_id, packet_in_node | 0x08, 0, 0]) # payload present
+        chunks = (data_hdr + data[:first], data[first:])
+        frames = list()
+        for chunk_n, chunk in enumerate(chunks):
+            hdr = CHA_PROTO_HDR(stream.if_type, CHA_MSG_TYPE.STREAM_DATA, chu=chunk_n, sz=len(chunk),
+                                rand=stream.rand_id, src=node_id, dst=0)
+            frames.append(bytes(hdr) + chunk)
+        return frames
+
+'''
+Transports
+'''
+
+class LOOPBACK_TRANSPORT:
+    '''
+    In-process link. The app side is rx_backend type 'loopback':
+    send() is its TX socket, recv_batch() its RX backend.
+    '''
+    def __init__(self):
+        self.emulator = None
+        self.frames = collections.deque()
+        self.cond = threading.Condition()
+
+    def attach(self, emulator:CHA_EMULATOR):
+        self.emulator = emulator
+
+    def run(self):
+        pass
+
+    def close(self):
+        pass
+
+    def deliver(self, frame):
+        with self.cond:
+            self.frames.append(memoryview(frame))
+            self.cond.notify()
+
+    # app side
+    def send(self, msg, dest=None):
+        if self.emulator is not None: self.emulator.handle_frame(msg)
+
+    def send_batch(self, frames, dest=None):
+        for frame in frames: self.send(frame, dest)
+        return len(frames)
+
+    def recv_batch(self, timeout, batch_size):
+        with self.cond:
+            if not self.frames: self.cond.wait(timeout)
+            n = min(len(self.frames), batch_size)
+            return [self.frames.popleft() for _ in range(n)]
+
+_loopback = LOOPBACK_TRANSPORT()
+
+def loopback() -> LOOPBACK_TRANSPORT:
+    '''Process wide loopback link shared by the emulator and rx_backend'''
+    return _loopback
+
+class RAW_TRANSPORT:
+    '''Raw ethernet, replies go to the MAC of the last request sender'''
+    def __init__(self, eth):
+        self.log = logging.getLogger('EMU')
+        self.rx_sock = RawSocket(eth, 0xEEF9)
+        self.rx_sock.sock.settimeout(0.25)
+        self.tx_sock = RawSocket(eth, 0xEEFA)
+        self.peer_mac = None
+        self.shutdown = False
+        self.t = threading.Thread(target=self.recv_loop)
+
+    def attach(self, emulator:CHA_EMULATOR):
+        self.emulator = emulator
+
+    def run(self):
+        self.t.start()
+
+    def close(self):
+        self.shutdown = True
+        self.t.join()
+        self.rx_sock.close()
+        self.tx_sock.close()
+
+    def deliver(self, frame):
+        try: self.tx_sock.send(frame, dest=self.peer_mac)
+        except OSError as e: self.log.error(f'TX socket exception {repr(e)}')
+
+    def recv_loop(self):
+        while not self.shutdown:
+            try: packet = self.rx_sock.recv()
+            except TimeoutError: continue
+            self.peer_mac = packet.src
+            self.emulator.handle_frame(packet.data)
+
+def main():
+    parser = argparse.ArgumentParser(description='Chassis/SRM emulator on a raw ethernet interface')
+    parser.add_argument('-e', '--eth', type=str, required=True, help="Interface, e.g. one end of a veth pair")
+    parser.add_argument('-n', '--nodes', type=str, nargs='+', default=['LOCAL:1', 'WIRED_0:15'],
+                        help="IFACE:N_NODES")
+    parser.add_argument('-r', '--datarate', type=int, default=1000, choices=[r.value for r in REAL_DATARATE])
+    parser.add_argument('--channels', type=int, default=4, choices=range(1, 5))
+    parser.add_argument('--stopped', action='store_true', help="SRMs wait for SRM_RUN")
+    parser.add_argument('--latency', type=float, default=0.001)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--loss', type=float, default=0.0, help="Control frames loss probability")
+    parser.add_argument('--data-loss', type=float, default=0.0, help="Stream data frames loss probability")
+    parser.add_argument('--packet-interval', type=float, default=0.0002)
+    parser.add_argument('--first-chunk', type=int, default=752, help="Data bytes in the first chunk")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    cfg = default_emulator_config()
+    cfg.update({
+        'nodes': {iface: int(n) for iface, n in (spec.split(':') for spec in args.nodes)},
+        'adc': None if args.stopped else {
+            'datarate': args.datarate, 'ch_mask': [1 if i < args.channels else 0 for i in range(4)], 'gains': [0]*4},
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'loss': args.loss,
+        'data_loss': args.data_loss,
+        'packet_interval': args.packet_interval,
+        'first_chunk_sz': args.first_chunk
+    })
+    emulator = CHA_EMULATOR(cfg, RAW_TRANSPORT(args.eth))
+    emulator.run()
+    try:
+        while True:
+            time.sleep(5)
+            emulator.log.info(emulator.get_stats())
+    except KeyboardInterrupt: pass
+    emulator.stop()
+
+if __name__ == '__main__':
+    main()
@@ -80,6 +80,9 @@ class PROGRAM_CONFIG:
                 'timecache_collection': 'node_data_time_cache'
             }})
             self.save_config()
+        if 'storage_codec' not in self.config['db_config']:
+            self.config['db_config'].update({'storage_codec':'raw'}) # raw, zlib, lzma
+            self.save_config()
         return self.config['db_config']
     
     def get_auto_request_data(self):
@@ -124,6 +127,18 @@ class PROGRAM_CONFIG:
             self.config.update({'nodes_discover_period':1})
             self.save_config()
         return self.config['nodes_discover_period']
+
+    def get_discovery(self):
+        if 'discovery' not in self.config:
+            self.config.update({'discovery':{
+                'window': 4,
+                'probe_timeout': 0.1,
+                'lost_period': 0.2,
+                'lost_time': 10,
+                'max_backoff': 10
+            }})
+            self.save_config()
+        return self.config['discovery']
     
     def get_nodes_timeouts(self):
         if 'node_timeouts' not in self.config:
@@ -149,4 +164,85 @@ class PROGRAM_CONFIG:
                 'delay_before_request':2.4
             })
             self.save_config()
-        return self.config['delay_before_request']
\ No newline at end of file
+        return self.config['delay_before_request']
+
+    def get_stream_jobs(self):
+        if 'stream_jobs' not in self.config:
+            self.config.update({'stream_jobs':{
+                'max_jobs_per_iface': 4,
+                'max_queued_jobs': 10,
+                'admission_window': 0.5
+            }})
+            self.save_config()
+        return self.config['stream_jobs']
+
+    def get_backfill(self):
+        if 'backfill' not in self.config:
+            self.config.update({'backfill':{
+                'enabled': True,
+                'retry_delay': 2,
+                'max_age': 30, # seconds the SRM keeps a second
+                'max_attempts': 3,
+                'max_pending': 30
+            }})
+            self.save_config()
+        return self.config['backfill']
+
+    def get_msg_bus(self):
+        if 'msg_bus' not in self.config:
+            self.config.update({'msg_bus':{
+                'core': {'control': 64, 'data': 256, 'stats': 64, 'batch_size': 32},
+                'chassis': {'control': 256, 'data': 64, 'stats': 128, 'batch_size': 32},
+                'streamer': {'control': 64, 'data': 8192, 'stats': 16, 'batch_size': 256}
+            }})
+            self.save_config()
+        return self.config['msg_bus']
+
+    def get_tx_scheduler(self):
+        if 'tx_scheduler' not in self.config:
+            self.config.update({'tx_scheduler':{
+                'rate': 1000, # frames/s per interface
+                'burst': 16,
+                'iface': {}, # e.g. {'WIRED_0': {'rate': 2000, 'burst': 32}}
+                'max_queue': 512,
+                'batch_size': 32
+            }})
+            self.save_config()
+        return self.config['tx_scheduler']
+
+    def get_rx_backend(self):
+        if 'rx_backend' not in self.config:
+            self.config.update({'rx_backend':{
+                'type': 'rawsocket',
+                'batch_size': 32,
+                'replay_file': None,
+                'record_file': None
+            }})
+            self.save_config()
+        return self.config['rx_backend']
+
+    def get_db_writer(self):
+        if 'db_writer' not in self.config:
+            self.config.update({'db_writer':{
+                'queue_size': 64,
+                'workers': 2,
+                'batch_docs': 64,
+                'max_retries': 5,
+                'retry_backoff': 0.2,
+                'max_backoff': 5
+            }})
+            self.save_config()
+        return self.config['db_writer']
+
+    def get_spool(self):
+        if 'spool' not in self.config:
+            self.config.update({'spool':{
+                'enabled': True,
+                'dir': '/var/spool/linret',
+                'segment_size': 64*1024*1024,
+                'segment_time': 60,
+                'max_size': 2*1024*1024*1024,
+                'fsync_interval': 1
+            }})
+            self.save_config()
+        return self.config['spool']
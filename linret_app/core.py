@@ -1,4 +1,4 @@
-import time, logging, copy, queue
+import time, logging, copy
 from config import PROGRAM_CONFIG
 from device import CHASSIS
 from nmea_true_time import TRUE_TIME
@@ -7,42 +7,59 @@ from protocol.cs_enums import *
 from protocol.cha_structs import *
 from protocol.cs_structs import *
 from stream_proc import STREAM_JOB
+from node_discovery import NODE_DISCOVERY
+from timers import TIMER_HEAP
+from msg_bus import MSG_BUS, LANE
 
 class LINRET_CORE:
+    STATS_PERIOD = 1
+    JOB_PHASE = 0.005 # just after the second boundary
+    SYNC_PHASE = 0.5 # middle of 0.4-0.6 window for run/sync commands
+    NO_TIME_RETRY = 0.1
 
     def __init__(self, program_params:PROGRAM_CONFIG, true_time:TRUE_TIME):
         self.program_params = program_params
         self.auto_request_data = program_params.get_auto_request_data()
         self.true_time = true_time
         self.log = logging.getLogger('CORE')
-        self._queue = queue.Queue(maxsize=25)
+        self.bus = MSG_BUS(self.msg_lane, program_params.get_msg_bus()['core'])
         self.devices: dict[int, CHASSIS] = dict()
+        self.devs_by_serial: dict[bytes, CHASSIS] = dict() # cha and srm serial bytes
+        self.dev_id_lists: dict[CS_DEV_TYPE, list] = dict() # cleared on topology change
         self.serial = CS_SN(CS_DEV_TYPE.LR, 0, 0)
         self.log.info(f"Self CSERIAL: {bytes(self.serial).hex()}")
         self.adc_config = self.program_params.get_latest_adc_config()
         self.log.warning(str(self.adc_config))
-        self.update_period = 0.2
-        self.last_timeout_check_time = 0
-        self.last_discover_time = 0
-        self.last_sync_time = 0
-        self.last_acq_ctl_time = 0
         self.next_job_schedule = None
         self.job_schedule_run = 0
 
         self.job_active = False
-        self.next_stats_send = 0
+        self.timers = TIMER_HEAP()
+        self.dev_timers = TIMER_HEAP() # full_addr -> next CHASSIS.check_timeouts()
+        self.timer_handlers = {
+            'stats': self.on_stats_timer,
+            'discover': self.on_discover_timer,
+            'job': self.on_job_timer,
+            'sync': self.on_sync_timer
+        }
         self.max_addr = dict()
         self.acq_ctl = 'do_nothing'
         self.discover_period = self.program_params.get_discover_period()
         for iface, max_nodes in self.program_params.get_max_nodes_per_iface().items():
             if max_nodes != 0: self.max_addr.update({CHA_LR_IF_TYPE[iface]:max_nodes})
+        self.discovery = NODE_DISCOVERY(self.program_params.get_discovery(), self.discover_period,
+                                        self.max_addr, time.monotonic())
         self.dbg_stats = {
             'cpu_temp': 0,
             'queue_full_drops': 0,
             'invalid_packets_drops': 0,
             'rx_packets_dropped': 0,
+            'rx_stale_responses': 0, # duplicate or late answers
+            'rx_unmatched_responses': 0,
             'cs_rx_packet_errors': 0,
             'n_devs': 0,
+            'timers_fired': 0,
+            'max_timer_lateness_ms': 0,
             'update_time': time.monotonic()
         }
 
@@ -53,20 +70,52 @@ class LINRET_CORE:
         self.send_to_mon = to_mon
 
     def stats_sender(self, now):
-        if now > self.next_stats_send:
-            self.next_stats_send = now + 1
-
-            self.dbg_stats['update_time'] = now
-            self.dbg_stats['n_devs'] = len(self.devices)
-            with open('/sys/class/thermal/thermal_zone0/temp', 'r') as f:
-                self.dbg_stats['cpu_temp'] = int(f.read())/1000
-            self.send_to_mon({'core_stats':copy.deepcopy(self.dbg_stats)})
+        self.dbg_stats['update_time'] = now
+        self.dbg_stats['n_devs'] = len(self.devices)
+        self.dbg_stats.update(self.discovery.get_stats())
+        self.dbg_stats['queue_full_drops'] = self.bus.n_drops()
+        self.dbg_stats['bus'] = self.bus.get_stats()
+        with open('/sys/class/thermal/thermal_zone0/temp', 'r') as f:
+            self.dbg_stats['cpu_temp'] = int(f.read())/1000
+        self.send_to_mon({'core_stats':copy.deepcopy(self.dbg_stats)})
+        self.dbg_stats['max_timer_lateness_ms'] = 0
+
+        devs_stats = [CHASSIS.STATS_DIGEST_HDR]
+        for dev in self.devices.values(): 
+            devs_stats.append(dev.get_stats(now))
 
-            devs_stats = [CHASSIS.STATS_DIGEST_HDR]
-            for dev in self.devices.values(): 
-                devs_stats.append(dev.get_stats(now))
+        self.send_to_mon({'devs_stats':devs_stats})
 
-            self.send_to_mon({'devs_stats':devs_stats})
+    def schedule_on_phase(self, name, now, phase):
+        '''Next true time second + phase, at least half a second from now'''
+        true_time = self.true_time.get_true_time()
+        if true_time is None:
+            self.timers.schedule(name, now + LINRET_CORE.NO_TIME_RETRY)
+            return
+        delay = (phase - true_time%1)%1
+        if delay < 0.5: delay += 1
+        self.timers.schedule(name, now + delay)
+
+    def on_stats_timer(self, now):
+        self.stats_sender(now)
+        self.timers.schedule('stats', now + LINRET_CORE.STATS_PERIOD)
+
+    def on_discover_timer(self, now):
+        self.discover_next(now)
+        deadline = None if self.job_active else self.discovery.next_deadline(now)
+        self.timers.schedule('discover', deadline if deadline is not None else now + self.discover_period)
+
+    def on_job_timer(self, now):
+        true_time = self.true_time.get_true_time()
+        if true_time is not None: self.job_scheduler(now, true_time)
+        self.schedule_on_phase('job', now, LINRET_CORE.JOB_PHASE)
+
+    def on_sync_timer(self, now):
+        true_time = self.true_time.get_true_time()
+        if true_time is not None:
+            self.nodes_syncer(now, true_time)
+            self.acq_controller(now, true_time)
+        self.schedule_on_phase('sync', now, LINRET_CORE.SYNC_PHASE)
 
     def job_scheduler(self, now, true_time):
         if now < self.job_schedule_run: return
@@ -96,135 +145,156 @@ class LINRET_CORE:
     def acq_controller(self, mono_time, true_time):
         phase = true_time%1
         if (phase<0.4) or (phase>0.6): return
-        if mono_time - self.last_acq_ctl_time < 1: return
-        self.last_acq_ctl_time = mono_time
 
         if self.acq_ctl == 'run':
             for dev in self.devices.values(): dev.run_if_nesessary(true_time, self.adc_config)
         elif self.acq_ctl == 'stop':
             for dev in self.devices.values(): dev.stop_if_nesessary(true_time)
         else: return
+        self.schedule_all_devices(mono_time)
 
     def nodes_syncer(self, mono_time, true_time):
         phase = true_time%1
         if (phase<0.4) or (phase>0.6): return
-        if mono_time - self.last_sync_time < 1: return
-        self.last_sync_time = mono_time
         for dev in self.devices.values():
             dev.sync_if_nesessary(true_time)
+        self.schedule_all_devices(mono_time)
+
+    def msg_lane(self, msg):
+        if isinstance(msg, CHA_RESPONSE): return LANE.DATA
+        return LANE.CONTROL
 
     def send_msg_to_core(self, msg):
-        try: self._queue.put_nowait(msg)
-        except queue.Full: self.dbg_stats['queue_full_drops'] += 1
+        self.bus.put(msg)
 
     def main_loop(self):
         self.log.debug('Main loop start')
+        now = time.monotonic()
+        for name in self.timer_handlers: self.timers.schedule(name, now)
+
         while True:
-            
-            mono_time = time.monotonic()
-            true_time = self.true_time.get_true_time()
-
-            if true_time is not None:
-                self.job_scheduler(mono_time, true_time)
-                self.nodes_syncer(mono_time, true_time)
-                self.acq_controller(mono_time, true_time)
-
-            self.check_device_timeouts(mono_time)
-            self.discover_next(mono_time)
-            self.stats_sender(mono_time)
-
-            try: msg = self._queue.get(timeout=0.1) #TODO - calc time to sleep
-            except queue.Empty: continue
-
-            if isinstance(msg, str):
-                if msg == 'shutdown': break
-                elif msg == 'job_active': self.job_active = True
-                elif msg == 'job_finished': self.job_active = False
-                elif msg == 'set_acq_ctl_mode__do_nothing': self.acq_ctl = 'do_nothing'
-                elif msg == 'set_acq_ctl_mode__run': self.acq_ctl = 'run'
-                elif msg == 'set_acq_ctl_mode__stop': self.acq_ctl = 'stop'
-            elif isinstance(msg, CHA_RESPONSE): self.response_from_chassis(msg)
-            elif isinstance(msg, CS_REQUEST): self.request_from_cs(msg)
-            else: self.dbg_stats['invalid_packets_drops'] += 1
+            now = time.monotonic()
+            for name, deadline in self.timers.pop_due(now):
+                lateness = int((now - deadline)*1000)
+                if lateness > self.dbg_stats['max_timer_lateness_ms']:
+                    self.dbg_stats['max_timer_lateness_ms'] = lateness
+                self.timer_handlers[name](now)
+                self.dbg_stats['timers_fired'] += 1
+            self.check_device_timeouts(now)
+
+            # sleep until the next deadline or message
+            next_deadline = self.timers.next_deadline()
+            if (dev_deadline := self.dev_timers.next_deadline()) is not None:
+                next_deadline = min(next_deadline, dev_deadline)
+            timeout = max(0, next_deadline - time.monotonic())
+            if not all(self.handle_msg(msg) for msg in self.bus.get_batch(timeout)): break
 
         self.log.debug('Main loop finish')
 
-    def check_device_timeouts(self, now):
-        if now - self.last_timeout_check_time < 0.1: return
-        self.last_timeout_check_time = now
-
-        timed_out_devs = list()
-        
-        for id, dev in self.devices.items(): 
-            result = dev.check_timeouts(now, self.job_active)
-            if result == 'timed_out': timed_out_devs.append(id)
+    def handle_msg(self, msg):
+        '''False on shutdown'''
+        if isinstance(msg, str):
+            if msg == 'shutdown': return False
+            elif msg == 'job_active':
+                self.job_active = True
+                self.schedule_all_devices(time.monotonic())
+            elif msg == 'job_finished':
+                self.job_active = False
+                self.schedule_all_devices(time.monotonic())
+            elif msg == 'set_acq_ctl_mode__do_nothing': self.acq_ctl = 'do_nothing'
+            elif msg == 'set_acq_ctl_mode__run': self.acq_ctl = 'run'
+            elif msg == 'set_acq_ctl_mode__stop': self.acq_ctl = 'stop'
+        elif isinstance(msg, CHA_RESPONSE): self.response_from_chassis(msg)
+        elif isinstance(msg, CS_REQUEST): self.request_from_cs(msg)
+        else: self.dbg_stats['invalid_packets_drops'] += 1
+        return True
+
+    def schedule_device(self, dev:CHASSIS, now):
+        self.dev_timers.schedule(dev.full_addr, dev.next_deadline(now, self.job_active))
+
+    def schedule_all_devices(self, now):
+        for dev in self.devices.values(): self.schedule_device(dev, now)
 
-        for id in timed_out_devs:
-            self.log.info(f"{self.devices[id]} Lost")
-            del self.devices[id]
+    def check_device_timeouts(self, now):
+        # only devices with an expired deadline
+        for full_addr, _ in self.dev_timers.pop_due(now):
+            if (dev := self.devices.get(full_addr)) is None: continue
+            if dev.check_timeouts(now, self.job_active) == 'timed_out':
+                self.log.info(f"{dev} Lost")
+                self.remove_device(dev)
+                self.discovery.lost(dev.if_type, dev.addr, now)
+                self.timers.schedule('discover', now)
+            else: self.schedule_device(dev, now)
 
     def discover_next(self, now):
         if self.job_active: return
-        if now - self.last_discover_time < self.discover_period: return
-        self.last_discover_time = now
-
-        last_devs = dict()
-        for if_type, max_addr in self.max_addr.items():
-            if if_type not in last_devs:last_devs.update({if_type:list()})
-            
-        for dev in self.devices.values():
-            last_devs[dev.if_type].append(dev.addr)
-
-        for iface, max_addr in self.max_addr.items():
-            full_set = set(range(1, max_addr + 1))
-            devs_present = set(last_devs[iface])
-            missing_devs = list(full_set - devs_present)
-
-            if len(missing_devs) != 0:
-                dst_addr = missing_devs[0]
-                get_cha_state_pkt = CHA_STATE_REQUEST(iface, dst_addr, 0)
-                #self.log.debug(f"Discovering {iface.name}:{dst_addr}")
-                self.send_to_chassis(get_cha_state_pkt)
 
+        for if_type, dst_addr in self.discovery.next_probes(now):
+            get_cha_state_pkt = CHA_STATE_REQUEST(if_type, dst_addr, 0)
+            #self.log.debug(f"Discovering {if_type.name}:{dst_addr}")
+            self.send_to_chassis(get_cha_state_pkt)
 
     def response_from_chassis(self, response:CHA_RESPONSE):
         full_addr = (response.hdr.if_type<<8) + response.hdr.src_addr
         if device := self.devices.get(full_addr):
-            device.response_from_chassis(response)
+            srm_serial_bytes = device.srm_serial_bytes
+            status = device.response_from_chassis(response)
+            if status == 'stale': self.dbg_stats['rx_stale_responses'] += 1
+            elif status == 'unmatched': self.dbg_stats['rx_unmatched_responses'] += 1
+            if device.srm_serial_bytes != srm_serial_bytes:
+                self.unindex_serial(srm_serial_bytes, device)
+                self.index_serial(device.srm_serial_bytes, device)
+            self.schedule_device(device, response.recv_time)
         elif response.hdr.msg_type is CHA_MSG_TYPE.CNTL_STAT_ACK and \
                         response.hdr.nak_code is CHA_NAK_CODE.NO_ERROR:
             #new device discovered
             timeouts = self.program_params.get_nodes_timeouts()
             new_dev = CHASSIS(self.log, timeouts, self.send_to_chassis, response)
-            self.devices.update({full_addr:new_dev})
+            self.add_device(new_dev)
+            self.schedule_device(new_dev, response.recv_time)
             self.log.warning(f"{new_dev} Discovered")
-            # discover next immediately
-            next_request = CHA_STATE_REQUEST(new_dev.if_type, new_dev.addr+1, 0)
-            self.send_to_chassis(next_request)
+            self.discovery.found(new_dev.if_type, new_dev.addr, response.recv_time)
+            # refill the probe window immediately
+            self.timers.schedule('discover', response.recv_time)
         else: 
             self.dbg_stats['rx_packets_dropped'] += 1
 
+    def add_device(self, dev:CHASSIS):
+        self.devices.update({dev.full_addr:dev})
+        self.index_serial(dev.cha_serial_bytes, dev)
+        self.index_serial(dev.srm_serial_bytes, dev)
+
+    def remove_device(self, dev:CHASSIS):
+        del self.devices[dev.full_addr]
+        self.unindex_serial(dev.cha_serial_bytes, dev)
+        self.unindex_serial(dev.srm_serial_bytes, dev)
+
+    def index_serial(self, serial, dev:CHASSIS):
+        if serial is not None: self.devs_by_serial[serial] = dev
+        self.dev_id_lists.clear()
+
+    def unindex_serial(self, serial, dev:CHASSIS):
+        if self.devs_by_serial.get(serial) is dev: del self.devs_by_serial[serial]
+        self.dev_id_lists.clear()
+
     def get_all_srms_list(self, now):
-        retval = list()
-        for dev in self.devices.values():
-            if dev.srm_state is not None:
-                retval.append(CS_DEV_ID(CS_DEV_TYPE.SRM, dev.srm_serial))
+        if (retval := self.dev_id_lists.get(CS_DEV_TYPE.SRM)) is None:
+            retval = [CS_DEV_ID(CS_DEV_TYPE.SRM, dev.srm_serial_bytes)
+                      for dev in self.devices.values() if dev.srm_serial_bytes is not None]
+            self.dev_id_lists[CS_DEV_TYPE.SRM] = retval
+        return retval
 
     def get_all_cha_list(self, cs_dev_type):
-        retval = list()
-        for dev in self.devices.values():
-            if dev.cs_dev_type is cs_dev_type:
-                #self.log.warning(f'{cs_dev_type.name}:{bytes(dev.cha_serial).hex()}')
-                retval.append(CS_DEV_ID(cs_dev_type, dev.cha_serial))
+        if (retval := self.dev_id_lists.get(cs_dev_type)) is None:
+            retval = [CS_DEV_ID(cs_dev_type, dev.cha_serial)
+                      for dev in self.devices.values() if dev.cs_dev_type is cs_dev_type]
+            self.dev_id_lists[cs_dev_type] = retval
         return retval
 
     def get_dev_by_serial(self, serial):
-        #self.log.info(serial.hex())
-        for dev in self.devices.values():
-            #print(dev.cha_serial_bytes.hex())
-            if serial in (dev.cha_serial_bytes, dev.srm_serial_bytes): return dev
-        self.log.warning("No dev found for %s"%serial.hex())
-        return None
+        if (dev := self.devs_by_serial.get(serial)) is None:
+            self.log.warning("No dev found for %s"%serial.hex())
+        return dev
 
     def request_from_cs(self, request:CS_REQUEST):
         now = time.monotonic()
@@ -287,6 +357,7 @@ class LINRET_CORE:
                         dev.run_if_nesessary(self.adc_config)
                 response = CS_ACK_NAK_RESPONSE(resp_hdr, CS_ACK_CODE.ACK)
                 self.log.warning(f'Broadcast[{request.acq_state.name}]')
+                self.schedule_all_devices(now)
 
             else:
                 self.log.warning(f'Acquisition ctl REQUEST: {request.acq_state.name}')
@@ -299,6 +370,7 @@ class LINRET_CORE:
                     if result == 'OK': 
                         response = CS_ACK_NAK_RESPONSE(resp_hdr, CS_ACK_CODE.ACK)
                     self.log.warning(f'Acquisition[{dev}][{request.acq_state.name}][{result}]')
+                    self.schedule_device(dev, now)
 
         else:
             self.log.error(f'Unexpected cs_cmd_type: {request.hdr.cs_cmd_type}')
@@ -0,0 +1,350 @@
+import queue, logging, threading, time, copy
+import pymongo, pymongo.errors
+from config import PROGRAM_CONFIG
+from spool import SPOOL
+from storage_codec import CODECS, encode_doc
+
+DUPLICATE_KEY_ERROR = 11000
+PACKETS_BITS = (1<<63) - 1 # 'packets' is an int64 bitmask
+
+class DB_WRITE_REQUEST:
+    def __init__(self, docs:list, serials:list, time_start, job=None):
+        self.docs = docs
+        self.serials = serials
+        self.time_start = time_start
+        self.job = job # gets db_write_time/db_index_time for jobs stats
+        self.spool_seg = None
+        self.enqueue_time = time.monotonic()
+
+class DB_WRITER:
+    '''
+    Streamer hands finished jobs over to send_msg_to_db() and never waits for mongo.
+    Requests are batched across jobs and written by a pool of worker threads.
+    With the spool enabled every request is persisted first by the spool thread
+    and replayed if not written.
+    '''
+    def __init__(self, pc:PROGRAM_CONFIG):
+        self.log = logging.getLogger('DB')
+        self.db_config = pc.get_db_config()
+        self.storage_codec = self.db_config['storage_codec']
+        if self.storage_codec not in CODECS:
+            self.log.error(f'Unknown storage codec {self.storage_codec}, using raw')
+            self.storage_codec = 'raw'
+        self.cfg = pc.get_db_writer()
+        self._queue = queue.Queue(maxsize=self.cfg['queue_size'])
+        self._batches = queue.Queue(maxsize=self.cfg['workers'])
+        self.t = threading.Thread(target=self.db_loop, args=[])
+        self.workers = [threading.Thread(target=self.worker_loop, args=[]) for _ in range(self.cfg['workers'])]
+        spool_cfg = pc.get_spool()
+        self.spool = None
+        if spool_cfg['enabled']:
+            try: self.spool = SPOOL(spool_cfg)
+            except OSError as e: self.log.error(f'Spool {spool_cfg["dir"]} unusable, running without it: {repr(e)}')
+        self._spool_queue = queue.Queue(maxsize=self.cfg['queue_size'])
+        self.spool_thread = threading.Thread(target=self.spool_loop, args=[]) if self.spool else None
+        self.replay_thread = threading.Thread(target=self.replay_loop, args=[]) if self.spool else None
+        self.stopping = False
+        self.shutdown_pending = False
+        self.last_stats_send = 0
+        self.last_try_db_connect = 0
+        self.stats_lock = threading.Lock()
+
+        self.db_client = pymongo.MongoClient(self.db_config['url'])
+        self.db = self.db_client[self.db_config['db_name']]
+        self.data_collection = self.db[self.db_config['data_collection']]
+        self.time_cache_collection = self.db[self.db_config['timecache_collection']]
+        self.db_connected = False
+
+        self.dbg_stats = {
+            'queue_full_drops': 0,
+            'invalid_packets_drops': 0,
+            'batches_written': 0,
+            'docs_written': 0,
+            'docs_upserted': 0,
+            'docs_duplicate': 0,
+            'docs_failed': 0,
+            'docs_dropped': 0,
+            'time_cache_updates': 0,
+            'time_cache_errors': 0,
+            'retries': 0,
+            'backlog_requests': 0,
+            'backlog_docs': 0,
+            'last_write_ms': 0,
+            'max_write_ms': 0,
+            'last_latency_ms': 0,
+            'max_latency_ms': 0,
+            'db_connected': False
+        }
+        self.backlog_docs = 0
+
+    def run(self):
+        self.t.start()
+        for worker in self.workers: worker.start()
+        if self.spool_thread: self.spool_thread.start()
+        if self.replay_thread: self.replay_thread.start()
+
+    def join(self):
+        self.t.join()
+
+    def register_msg_handlers(self, to_mon):
+        self.send_to_mon = to_mon
+
+    def send_msg_to_db(self, msg):
+        # spool file I/O is on the spool thread, the caller only queues
+        if isinstance(msg, str): (self._spool_queue if self.spool else self._queue).put(msg)
+        elif self.spool:
+            try: self._spool_queue.put_nowait(msg)
+            except queue.Full:
+                with self.stats_lock:
+                    self.dbg_stats['queue_full_drops'] += 1
+                    self.dbg_stats['docs_dropped'] += len(msg.docs)
+        else: self.to_writer(msg)
+
+    def to_writer(self, msg):
+        try:
+            self._queue.put_nowait(msg)
+            with self.stats_lock: self.backlog_docs += len(msg.docs)
+        except queue.Full:
+            with self.stats_lock:
+                self.dbg_stats['queue_full_drops'] += 1
+                if msg.spool_seg is None: self.dbg_stats['docs_dropped'] += len(msg.docs)
+            if msg.spool_seg is not None: self.spool.ack(msg.spool_seg, False)
+
+    def spool_loop(self):
+        # requests dropped on a full writer queue are acked as failed and replayed from the spool
+        while True:
+            self.spool.sync(time.monotonic())
+            try: msg = self._spool_queue.get(timeout=0.025)
+            except queue.Empty: continue
+            if isinstance(msg, str):
+                self._queue.put(msg)
+                if msg == 'shutdown': break
+                continue
+            msg.spool_seg = self.spool.append(msg.docs, msg.serials, msg.time_start)
+            self.to_writer(msg)
+        self.spool.close()
+
+    def try_connect_to_db(self, now):
+        if now - self.last_try_db_connect > 5:
+            self.last_try_db_connect = now
+            try:
+                self.db_client.admin.command('ping')
+                if not self.db_connected:
+                    for collection in (self.data_collection, self.time_cache_collection):
+                        indexes = [index['name'] for index in collection.list_indexes()]
+                        if 'serial_1' not in indexes:
+                            collection.create_index([("serial", 1)], unique=False)
+                        if 'time_start_1' not in indexes:
+                            collection.create_index([("time_start", 1)], unique=False)
+                        if 'serial_1_time_start_1' not in indexes:
+                            collection.create_index([("serial", 1), ("time_start", 1)], unique=True)
+                    self.log.warning(f'Connected to DB {self.db_config["url"]}')
+                self.db_connected = True
+            except pymongo.errors.ConnectionFailure:
+                self.log.error("Connection to DB error")
+                if self.db_connected: self.log.error("Connection to DB lost")
+                self.db_connected = False
+
+    def stats_sender(self, now):
+        if now - self.last_stats_send > 1:
+            with self.stats_lock:
+                self.dbg_stats['backlog_requests'] = self._queue.qsize()
+                self.dbg_stats['backlog_docs'] = self.backlog_docs
+                self.dbg_stats['db_connected'] = self.db_connected
+                stats = copy.deepcopy(self.dbg_stats)
+            stats.update({'update_time':now})
+            msg = {'db_writer_stats':stats}
+            if self.spool: msg['spool_stats'] = self.spool.get_stats()
+            self.send_to_mon(msg)
+            self.last_stats_send = now
+
+    def next_batch(self, first:DB_WRITE_REQUEST):
+        batch = [first]
+        n_docs = len(first.docs)
+        while n_docs < self.cfg['batch_docs']:
+            try: msg = self._queue.get_nowait()
+            except queue.Empty: break
+            if isinstance(msg, DB_WRITE_REQUEST):
+                batch.append(msg)
+                n_docs += len(msg.docs)
+            else:
+                self.shutdown_pending = True
+                break
+        return batch
+
+    def db_loop(self):
+        self.log.debug('DB writer loop start')
+        batch = None
+
+        while True:
+            now = time.monotonic()
+            self.try_connect_to_db(now)
+            self.stats_sender(now)
+
+            if batch is None:
+                if self.shutdown_pending: break
+                try: msg = self._queue.get(timeout=0.025)
+                except queue.Empty: continue
+
+                if isinstance(msg, str) and msg == 'shutdown': break
+                elif isinstance(msg, DB_WRITE_REQUEST): batch = self.next_batch(msg)
+                else:
+                    self.dbg_stats['invalid_packets_drops'] += 1
+                    continue
+
+            # bounded hand over to workers: while they are busy requests wait in _queue
+            try:
+                self._batches.put(batch, timeout=0.025)
+                batch = None
+            except queue.Full: continue
+
+        self.stopping = True
+        for _ in self.workers: self._batches.put('shutdown')
+        for worker in self.workers: worker.join()
+        if self.spool:
+            self.spool_thread.join()
+            self.replay_thread.join()
+        self.db_client.close()
+        self.log.debug('DB writer loop finish')
+
+    def with_retries(self, func, *args):
+        '''Retries on connection errors, True if written'''
+        backoff = self.cfg['retry_backoff']
+        for attempt in range(self.cfg['max_retries'] + 1):
+            if attempt:
+                if self.stopping: break
+                with self.stats_lock: self.dbg_stats['retries'] += 1
+                time.sleep(backoff)
+                backoff = min(backoff*2, self.cfg['max_backoff'])
+            if not self.db_connected: continue
+            try:
+                func(*args)
+                return True
+            except pymongo.errors.ConnectionFailure as e:
+                self.log.warning(f'DB write retry: {repr(e)}')
+        return False
+
+    def insert_docs(self, docs):
+        try:
+            self.data_collection.insert_many(docs, ordered=False)
+            with self.stats_lock: self.dbg_stats['docs_written'] += len(docs)
+        except pymongo.errors.BulkWriteError as e:
+            # duplicates are documents already written by a previous attempt
+            errors = e.details.get('writeErrors', [])
+            n_dups = sum(1 for err in errors if err.get('code') == DUPLICATE_KEY_ERROR)
+            with self.stats_lock:
+                self.dbg_stats['docs_written'] += e.details.get('nInserted', 0)
+                self.dbg_stats['docs_duplicate'] += n_dups
+                self.dbg_stats['docs_failed'] += len(errors) - n_dups
+            if len(errors) > n_dups:
+                self.log.warning(f'DB insert_many errors {[err.get("errmsg") for err in errors if err.get("code") != DUPLICATE_KEY_ERROR][:3]}')
+
+    def upsert_partial_docs(self, docs):
+        # a partial record is replaced by one holding all its packets, a complete record is never replaced
+        ops = [pymongo.ReplaceOne({"serial": doc["serial"], "time_start": doc["time_start"],
+                                   "packets": {"$bitsAllClear": ~doc["packets"] & PACKETS_BITS}}, doc, upsert=True)
+               for doc in docs]
+        try:
+            self.data_collection.bulk_write(ops, ordered=False)
+            with self.stats_lock:
+                self.dbg_stats['docs_written'] += len(ops)
+                self.dbg_stats['docs_upserted'] += len(ops)
+        except pymongo.errors.BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            n_dups = sum(1 for err in errors if err.get('code') == DUPLICATE_KEY_ERROR)
+            with self.stats_lock:
+                self.dbg_stats['docs_written'] += len(ops) - len(errors)
+                self.dbg_stats['docs_upserted'] += len(ops) - len(errors)
+                self.dbg_stats['docs_duplicate'] += n_dups
+                self.dbg_stats['docs_failed'] += len(errors) - n_dups
+
+    def write_docs(self, docs):
+        # docs with 'packets' are partial or backfilled seconds
+        inserts = [doc for doc in docs if 'packets' not in doc]
+        upserts = [doc for doc in docs if 'packets' in doc]
+        if inserts: self.insert_docs(inserts)
+        if upserts: self.upsert_partial_docs(upserts)
+
+    def update_time_cache(self, batch):
+        # one upsert per serial for the whole batch, latest time_start wins
+        latest = dict()
+        for req in batch:
+            for int_mac in req.serials:
+                if int_mac not in latest or latest[int_mac] < req.time_start: latest[int_mac] = req.time_start
+        serials = list(latest)
+        ops = [pymongo.UpdateOne({"serial": int_mac}, {"$max": {"time_start": latest[int_mac]}}, upsert=True)
+               for int_mac in serials]
+        try:
+            self.time_cache_collection.bulk_write(ops, ordered=False)
+            with self.stats_lock: self.dbg_stats['time_cache_updates'] += len(ops)
+        except pymongo.errors.BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            with self.stats_lock:
+                self.dbg_stats['time_cache_updates'] += len(ops) - len(errors)
+                self.dbg_stats['time_cache_errors'] += len(errors)
+            for err in errors:
+                self.log.warning(f'DB time cache update {serials[err["index"]]:016X}: {err.get("errmsg")}')
+
+    def write_batch(self, batch):
+        docs = [encode_doc(doc, self.storage_codec) for req in batch for doc in req.docs]
+        n_docs = len(docs)
+
+        write_start = time.monotonic()
+        written = self.with_retries(self.write_docs, docs)
+        write_time = int((time.monotonic() - write_start)*1000)
+
+        index_start = time.monotonic()
+        if written: self.with_retries(self.update_time_cache, batch)
+        index_time = int((time.monotonic() - index_start)*1000)
+
+        now = time.monotonic()
+        latency = int((now - min(req.enqueue_time for req in batch))*1000)
+        with self.stats_lock:
+            if written:
+                self.dbg_stats['batches_written'] += 1
+                self.dbg_stats['last_write_ms'] = write_time
+                self.dbg_stats['max_write_ms'] = max(self.dbg_stats['max_write_ms'], write_time)
+                self.dbg_stats['last_latency_ms'] = latency
+                self.dbg_stats['max_latency_ms'] = max(self.dbg_stats['max_latency_ms'], latency)
+            else: self.dbg_stats['docs_dropped'] += n_docs
+
+        for req in batch:
+            if written and req.job is not None:
+                req.job.db_write_time = write_time
+                req.job.db_index_time = index_time
+            req.docs = None # release node data
+        return written
+
+    def worker_loop(self):
+        while True:
+            batch = self._batches.get()
+            if isinstance(batch, str) and batch == 'shutdown': break
+            n_docs = sum(len(req.docs) for req in batch)
+            written = False
+            try: written = self.write_batch(batch)
+            except Exception as e: self.log.error(f'DB writer exception {repr(e)}')
+            with self.stats_lock: self.backlog_docs -= n_docs
+            for req in batch:
+                if req.spool_seg is not None: self.spool.ack(req.spool_seg, written)
+
+    def replay_loop(self):
+        # records go through the same path as new requests: unique index and $max make it idempotent
+        while not self.stopping:
+            seg = None
+            if self.db_connected and self._queue.qsize() < self.cfg['queue_size']//2:
+                seg = self.spool.next_replay()
+            if seg is None:
+                time.sleep(0.5)
+                continue
+
+            self.log.warning(f'Replaying spool segment {seg.seq}')
+            for rec in self.spool.replay_records(seg):
+                req = DB_WRITE_REQUEST(rec['docs'], rec['serials'], rec['time_start'])
+                req.spool_seg = seg
+                while not self.stopping:
+                    try:
+                        self._queue.put(req, timeout=0.5)
+                        with self.stats_lock: self.backlog_docs += len(req.docs)
+                        break
+                    except queue.Full: continue
+                if self.stopping: break # segment stays on disk
@@ -1,12 +1,61 @@
-import copy
+import copy, collections, array
 from typing import Optional
 from protocol.cha_enums import *
 from protocol.cs_enums import *
 from protocol.cha_structs import *
 from protocol.cs_structs import *
 
+class WINDOW:
+    '''
+    (time, value) samples of the last `length` seconds in a fixed size ring,
+    oldest are overwritten when full. Running sum for the mean.
+    '''
+    def __init__(self, length, capacity):
+        self.length = length
+        self.capacity = capacity
+        self.times = array.array('d', bytes(8*capacity))
+        self.vals = array.array('d', bytes(8*capacity))
+        self.head = 0 # oldest sample
+        self.n = 0
+        self.sum = 0.0
+
+    def drop_oldest(self):
+        self.sum -= self.vals[self.head]
+        self.head = (self.head + 1)%self.capacity
+        self.n -= 1
+        if not self.n: self.sum = 0.0
+
+    def add(self, now, val):
+        self.prune(now)
+        if self.n == self.capacity: self.drop_oldest()
+        idx = (self.head + self.n)%self.capacity
+        self.times[idx] = now
+        self.vals[idx] = val
+        self.n += 1
+        self.sum += val
+
+    def prune(self, now):
+        while self.n and now - self.times[self.head] > self.length: self.drop_oldest()
+
+    def __len__(self):
+        return self.n
+
+    def mean(self):
+        return self.sum/self.n
+
+    def values(self):
+        end = self.head + self.n
+        if end <= self.capacity: return self.vals[self.head:end]
+        return self.vals[self.head:] + self.vals[:end - self.capacity]
+
+    def percentiles(self, *pcts):
+        vals = sorted(self.values())
+        return [vals[min(self.n - 1, int(pct*self.n/100))] for pct in pcts]
+
 class CHASSIS:
     STATS_TIMEOUT = 60
+    STATS_WINDOW_SZ = 1024
+    RETRY_PERIOD = 0.1 # requests that are due are repeated at this rate
 
     def __init__(self, log, timeouts, request_to_chassis, state:CHA_STATE_RESPONSE):
         self.log = log
@@ -33,35 +82,46 @@ class CHASSIS:
         self.time_to_request = lambda now, p: now > (p.recv_time+timeouts['packet_lifetime'])
         self.time_to_kill = lambda now, p: now > (p.recv_time+timeouts['node_total_lifetime'])
         self.still_pending = lambda now, r: now < (r.send_time+timeouts['packet_wait_timeout'])
-        self.pending_requests:list[CHA_REQUEST] = list()
-        self.stats = {'lats': dict(), 'rx': dict()
+        self.pending:dict[tuple, CHA_REQUEST] = dict() # match_key -> request
+        # same wait timeout for all requests: send order is expiry order, answered ones are skipped
+        self.expiry:collections.deque[tuple] = collections.deque() # (match_key, request)
+        self.closed:dict[tuple, CHA_REQUEST] = dict() # answered or expired, until the random_id wraps
+        self.stats = {
+            'lats': WINDOW(CHASSIS.STATS_TIMEOUT, CHASSIS.STATS_WINDOW_SZ),
+            'rx': WINDOW(CHASSIS.STATS_TIMEOUT, CHASSIS.STATS_WINDOW_SZ)
         }
+        self.next_retry = 0
 
     def send_and_update_random_id(self, request):
         self.random_id += 1
         if self.random_id == 256: self.random_id = 0
         #self.log.debug(f"{str(self)} sendig {request}")
-        self.pending_requests.append(request)
+        key = request.match_key()
+        self.pending[key] = request
+        self.closed.pop(key, None)
+        self.expiry.append((key, request))
         self.request_to_chassis(request)
 
+    def skip_answered(self):
+        while self.expiry and self.pending.get(self.expiry[0][0]) is not self.expiry[0][1]:
+            self.expiry.popleft()
+
     def check_timeouts(self, now, job_is_active):
         if self.time_to_kill(now, self.cha_state): return 'timed_out'
 
-        new_pending_requests = list()
-        for r in self.pending_requests:
-            if self.still_pending(now, r): new_pending_requests.append(r)
-            else: self.stats['rx'].update({now:1})
-        self.pending_requests = new_pending_requests
+        while self.expiry and not self.still_pending(now, self.expiry[0][1]):
+            key, request = self.expiry.popleft()
+            if self.pending.get(key) is request:
+                del self.pending[key]
+                self.closed[key] = request
+                self.stats['rx'].add(now, 1)
+            self.skip_answered()
 
-        keys_to_del = [key for key in self.stats['rx'] if now-key > CHASSIS.STATS_TIMEOUT]
-        for key in keys_to_del:
-            del self.stats['rx'][key]
+        # woken up by a pending request expiry between retries
+        if now < self.next_retry: return 'OK'
+        self.next_retry = now + CHASSIS.RETRY_PERIOD
 
-        keys_to_del = [key for key in self.stats['lats'] if now-key > CHASSIS.STATS_TIMEOUT]
-        for key in keys_to_del:
-            del self.stats['lats'][key]
-
-        if len(self.pending_requests) > 10: self.log.warning(f'{self} Too many pendings')
+        if len(self.pending) > 10: self.log.warning(f'{self} Too many pendings')
 
         if self.time_to_request(now, self.cha_state):
             packet = CHA_STATE_REQUEST(self.if_type, self.addr, self.random_id)
@@ -95,6 +155,28 @@ class CHASSIS:
 
         return 'OK'
 
+    def next_deadline(self, now, job_is_active):
+        '''When check_timeouts() has something to do, assuming it was called at now'''
+        lifetime = self.timeouts['packet_lifetime']
+        retry = max(self.next_retry, now)
+        deadlines = [
+            self.cha_state.recv_time + self.timeouts['node_total_lifetime'],
+            max(self.cha_state.recv_time + lifetime, retry)
+        ]
+        if self.expiry:
+            deadlines.append(self.expiry[0][1].send_time + self.timeouts['packet_wait_timeout'])
+
+        if not job_is_active:
+            if not self.srm_fat_state and self.srm_state: deadlines.append(retry)
+            if self.srm_state is None:
+                if self.cha_state.state_srm_connected: deadlines.append(retry)
+            else: deadlines.append(max(self.srm_state.recv_time + lifetime, retry))
+            if (self.srm_state is not None) and (not self.was_in_stopped_state): deadlines.append(retry)
+            if not self.discovery_state: deadlines.append(retry)
+            else: deadlines.append(max(self.discovery_state.recv_time + lifetime, retry))
+
+        return min(deadlines)
+
     def is_active_dev(self, active_adc_config):
         if self.srm_state is None: return False
         if self.srm_serial is None: return False
@@ -151,68 +233,71 @@ class CHASSIS:
         return self.cha_state
     
     def response_from_chassis(self, response:CHA_RESPONSE):
+        '''OK, stale (answer to an answered or expired request) or unmatched'''
         now = time.monotonic()
-        valid_packet_found = None
-        for request in self.pending_requests:
-            if valid_packet_found := request.validate_response(response): break
-
-        if valid_packet_found:
-            self.pending_requests.remove(request)
-            self.stats['rx'].update({now:0})
-
-            if response.hdr.msg_type == CHA_MSG_TYPE.CNTL_STAT_ACK:
-                #if self.addr > 10: self.log.warning(f'{self} STATE: {response} ')
-                if response.hdr.nak_code != CHA_NAK_CODE.NO_ERROR:
-                    self.log.warning(f'{request} {response.hdr.nak_code.name}')
-                else:
-                    self.cha_state = response
-                    delay = response.recv_time - request.send_time
-                    #time_offset = time.time() - delay - self.cha_state.curr_time
-                    #print(time_offset)
-                    self.stats['lats'].update({now:delay*1000})
-                    
-            elif response.hdr.msg_type == CHA_MSG_TYPE.SRM_STAT_ACK:
-                if response.hdr.nak_code != CHA_NAK_CODE.NO_ERROR:
-                    self.log.warning(f'SRM REQUEST ERR {request} {response.hdr.nak_code.name}')
-                else: 
-                    self.srm_state = response
-                    #self.log.info(self)
-                    #self.log.info(self.srm_state.adc_params)
-                    #print(time.time() - self.srm_state.unix_timestamp)
-                    
-            elif response.hdr.msg_type == CHA_MSG_TYPE.CNTL_NODES_BC_ACK:
-                if response.hdr.nak_code != CHA_NAK_CODE.NO_ERROR:
-                    self.log.warning(f'{request} {response.hdr.nak_code.name}')
-                else: self.discovery_state = response
-
-            elif response.hdr.msg_type == CHA_MSG_TYPE.SRM_RUN_ACK:
-                if response.hdr.nak_code != CHA_NAK_CODE.NO_ERROR:
-                    self.log.warning(f'{request} {response.hdr.nak_code.name}')
-                else: pass
-
-            elif response.hdr.msg_type == CHA_MSG_TYPE.CNTL_CLK_SET_ACK:
-                if response.phase is not None:
-                    req_ph = int((request.true_unix_time%1)*1000)
-                    resp_ph = response.phase//1000000
-                    diff = req_ph - resp_ph
-                    self.log.info(f'{self} SYNC {req_ph}ms {resp_ph}ms {diff}ms')
-                    if abs(diff) < 100:
-                        self.synced = True
-                        self.appended_unix_time = request.second
-                        self.log.warning(f'{self} SYNC OK {req_ph}ms {resp_ph}ms {diff}ms')
-                    else:
-                        self.log.info(f'{self} SYNC FAILED {req_ph}ms {resp_ph}ms {diff}ms')
-                        self.synced = False
-                        self.appended_unix_time = None
-
-            elif response.hdr.msg_type == CHA_MSG_TYPE.SRM_FAT_ACK:
-                if response.hdr.nak_code != CHA_NAK_CODE.NO_ERROR:
-                    self.log.warning(f'{request} {response.hdr.nak_code.name}')
+        key = response.match_key()
+        if (request := self.pending.pop(key, None)) is None:
+            return 'stale' if key in self.closed else 'unmatched'
+        self.closed[key] = request
+        self.skip_answered()
+        self.stats['rx'].add(now, 0)
+        self.handle_response(request, response, now)
+        return 'OK'
+
+    def handle_response(self, request:CHA_REQUEST, response:CHA_RESPONSE, now):
+        if response.hdr.msg_type == CHA_MSG_TYPE.CNTL_STAT_ACK:
+            #if self.addr > 10: self.log.warning(f'{self} STATE: {response} ')
+            if response.hdr.nak_code != CHA_NAK_CODE.NO_ERROR:
+                self.log.warning(f'{request} {response.hdr.nak_code.name}')
+            else:
+                self.cha_state = response
+                delay = response.recv_time - request.send_time
+                #time_offset = time.time() - delay - self.cha_state.curr_time
+                #print(time_offset)
+                self.stats['lats'].add(now, delay*1000)
+
+        elif response.hdr.msg_type == CHA_MSG_TYPE.SRM_STAT_ACK:
+            if response.hdr.nak_code != CHA_NAK_CODE.NO_ERROR:
+                self.log.warning(f'SRM REQUEST ERR {request} {response.hdr.nak_code.name}')
+            else: 
+                self.srm_state = response
+                #self.log.info(self)
+                #self.log.info(self.srm_state.adc_params)
+                #print(time.time() - self.srm_state.unix_timestamp)
+
+        elif response.hdr.msg_type == CHA_MSG_TYPE.CNTL_NODES_BC_ACK:
+            if response.hdr.nak_code != CHA_NAK_CODE.NO_ERROR:
+                self.log.warning(f'{request} {response.hdr.nak_code.name}')
+            else: self.discovery_state = response
+
+        elif response.hdr.msg_type == CHA_MSG_TYPE.SRM_RUN_ACK:
+            if response.hdr.nak_code != CHA_NAK_CODE.NO_ERROR:
+                self.log.warning(f'{request} {response.hdr.nak_code.name}')
+            else: pass
+
+        elif response.hdr.msg_type == CHA_MSG_TYPE.CNTL_CLK_SET_ACK:
+            if response.phase is not None:
+                req_ph = int((request.true_unix_time%1)*1000)
+                resp_ph = response.phase//1000000
+                diff = req_ph - resp_ph
+                self.log.info(f'{self} SYNC {req_ph}ms {resp_ph}ms {diff}ms')
+                if abs(diff) < 100:
+                    self.synced = True
+                    self.appended_unix_time = request.second
+                    self.log.warning(f'{self} SYNC OK {req_ph}ms {resp_ph}ms {diff}ms')
                 else:
-                    self.srm_fat_state = response
-                    self.srm_serial = response.srm_sn
-                    self.srm_serial_bytes = response.srm_sn[-CS_SERIAL_SZ:].encode("ASCII")
-                    self.log.warning(f'{self} SRM serial: {self.srm_serial}')
+                    self.log.info(f'{self} SYNC FAILED {req_ph}ms {resp_ph}ms {diff}ms')
+                    self.synced = False
+                    self.appended_unix_time = None
+
+        elif response.hdr.msg_type == CHA_MSG_TYPE.SRM_FAT_ACK:
+            if response.hdr.nak_code != CHA_NAK_CODE.NO_ERROR:
+                self.log.warning(f'{request} {response.hdr.nak_code.name}')
+            else:
+                self.srm_fat_state = response
+                self.srm_serial = response.srm_sn
+                self.srm_serial_bytes = response.srm_sn[-CS_SERIAL_SZ:].encode("ASCII")
+                self.log.warning(f'{self} SRM serial: {self.srm_serial}')
 
     def wifi_digest(self):
         retval = {'downlink':None, 'uplink':None}
@@ -289,10 +374,12 @@ class CHASSIS:
             return {'txt':str(self.cha_state.gps.num_sv), 'color': color}
         
         def link_stat(s):
+            s['rx'].prune(now)
+            s['lats'].prune(now)
             if len(s['rx']) == 0: 
                 lost_txt = '---'
             else: 
-                loss = sum(self.stats['rx'].values())/len(self.stats['rx'])
+                loss = s['rx'].mean()
                 good = 1 - loss
                 good = good ** (1/self.addr)
                 loss = 1 - good
@@ -301,10 +388,15 @@ class CHASSIS:
             if len(s['lats']) == 0: 
                 lat_txt = '---'
             else: 
-                lats = sum(s['lats'].values())/len(s['lats'])
+                lats = s['lats'].mean()
                 lat_txt = str(int(lats)) + 'ms'
 
             return {'txt':f'{lost_txt}/{lat_txt}', 'color':''}
+
+        def lat_percentiles(s):
+            if len(s['lats']) == 0: return {'txt':'---', 'color':''}
+            p50, p95, p99 = s['lats'].percentiles(50, 95, 99)
+            return {'txt':f'{int(p50)}/{int(p95)}/{int(p99)}ms', 'color':''}
         
         def sync_stat():
             txt = self.cha_state.sync_src.name
@@ -325,11 +417,12 @@ class CHASSIS:
             srm_pps_state(),
             {'txt':'', 'color': sd_color},
             {'txt':adc_txt, 'color': adc_color},
-            link_stat(self.stats)
+            link_stat(self.stats),
+            lat_percentiles(self.stats)
         ]
 
     STATS_DIGEST_HDR = [{'txt':v} for v in [
-        'IF','ADDR','SN','GPS','SYNC','BAT0','BAT1','CH0','CH1','SRM','PPS','SD','ADC','STAT'
+        'IF','ADDR','SN','GPS','SYNC','BAT0','BAT1','CH0','CH1','SRM','PPS','SD','ADC','STAT','LAT 50/95/99'
         ]]
 
     def __str__(self):
@@ -1,6 +1,8 @@
-import logging, queue, threading, time, copy
-from rawsocketpy import RawSocket
+import logging, threading, time, copy, struct
+from rx_backend import open_rx_backend, open_tx_socket
 from config import PROGRAM_CONFIG
+from msg_bus import MSG_BUS, LANE
+from tx_scheduler import TX_SCHEDULER, TX_CLASS
 from protocol.cha_enums import *
 from protocol.cs_enums import *
 from protocol.cha_structs import *
@@ -14,23 +16,33 @@ class IFACE_CHASSIS:
         self.program_params = program_params
         self.eth = program_params.get_eth_iface()
         self.chassis_mac = program_params.get_chassis_mac()
+        self.rx_backend_cfg = program_params.get_rx_backend()
+        self.tx_cfg = program_params.get_tx_scheduler()
+        self.tx_sched = TX_SCHEDULER(self.tx_class, self.tx_cfg, time.monotonic())
+        self.packet_waiting_next_chunk = None
         self.chassis_connected = False
         self.rx_thread = threading.Thread(target=self.recv_loop)
         self.tx_thread = threading.Thread(target=self.send_loop)
         self.last_rx_activity = 0
         self.last_stats_send = 0
-        self._queue = queue.Queue(maxsize=50)
+        self.bus = MSG_BUS(self.msg_lane, program_params.get_msg_bus()['chassis'])
+        self.stream_sinks = dict() # (if_type, rand_id) -> sink(STREAM_DATA_RESPONSE) called on the RX thread
         self.dbg_stats = {
             'tx_ctr': 0,
             'rx_ctr': 0,
+            'rx_batches': 0,
             'queue_full_drops': 0,
             'inpt_hdr_errors': 0,
             'extra_bytes_recvd': 0,
             'serialize_errors': 0,
             'un_serialize_errors': 0,
             'tx_sock_exceptions': 0,
+            'tx_batches': 0,
+            'tx_frames_dropped': 0,
             'if_type_drived_recvs': 0,
-            'chunk_sequence_error': 0
+            'chunk_sequence_error': 0,
+            'stream_sink_rx': 0,
+            'stream_sink_errors': 0
         }
 
     def run(self):
@@ -46,9 +58,26 @@ class IFACE_CHASSIS:
         self.send_msg_to_streamproc = to_str
         self.send_msg_to_mon = to_mon
 
+    def register_stream_sink(self, key, sink):
+        self.stream_sinks[key] = sink
+
+    def unregister_stream_sink(self, key):
+        self.stream_sinks.pop(key, None)
+
+    def msg_lane(self, msg):
+        # stream requests first, periodic polling last
+        if isinstance(msg, (str, STREAM_START_REQUEST, STREAM_FEEDBACK_REQUEST, STREAM_STOP_REQUEST)): return LANE.CONTROL
+        if isinstance(msg, (CHA_STATE_REQUEST, CHA_SRM_STATUS_REQUEST, CHA_DISCOVERY_REQUEST)): return LANE.STATS
+        return LANE.DATA
+
+    def tx_class(self, msg):
+        if isinstance(msg, (STREAM_START_REQUEST, STREAM_FEEDBACK_REQUEST, STREAM_STOP_REQUEST)): return TX_CLASS.STREAM_CONTROL
+        if isinstance(msg, CHA_SET_CLOCK_REQUEST): return TX_CLASS.CLOCK_SYNC
+        if isinstance(msg, (CHA_STATE_REQUEST, CHA_SRM_STATUS_REQUEST, CHA_DISCOVERY_REQUEST)): return TX_CLASS.POLLING
+        return TX_CLASS.ACQ_CONTROL
+
     def send_msg_to_chassis(self, msg):
-        try: self._queue.put(msg, timeout = 1)
-        except queue.Full: self.dbg_stats['queue_full_drops'] += 1
+        self.bus.put(msg, wait=1)
 
     def handshaker(self, now):
         if now - self.last_rx_activity > 3:
@@ -60,7 +89,10 @@ class IFACE_CHASSIS:
 
     def stats_sender(self, now):
         if now - self.last_stats_send > 1:
+            self.dbg_stats['queue_full_drops'] = self.bus.n_drops()
             stats_copy = copy.deepcopy(self.dbg_stats)
+            stats_copy['bus'] = self.bus.get_stats()
+            stats_copy['tx_classes'] = self.tx_sched.get_stats()
             stats_copy.update({'update_time':now})
             self.send_msg_to_mon({'iface_chassis_stats':stats_copy})
             self.last_stats_send = now
@@ -68,159 +100,164 @@ class IFACE_CHASSIS:
     def send_loop(self):
         self.log.debug("CHA send loop start")
         try:
-            tx_sock = RawSocket(self.eth, 0xEEF9)
+            tx_sock = open_tx_socket(self.eth, 0xEEF9, self.rx_backend_cfg, self.tx_cfg['batch_size'])
         except Exception as e:
-            self.log.critical(f'Cannot open RAW EHT RECV socket:{repr(e)}')
+            self.log.critical(f'Cannot open RAW EHT SEND socket:{repr(e)}')
             return
-        tx_sock.sock.settimeout(0.01)
 
         while True:
             now = time.monotonic()
             self.handshaker(now)
             self.stats_sender(now)
-            
-            try: msg = self._queue.get(timeout=1)
-            except queue.Empty: continue
-
-            if isinstance(msg, str):
-                if msg == 'shutdown': break
-
-            elif isinstance(msg, CHA_REQUEST):
-                #try: 
-                msg_bytes = bytes(msg)
-                #except Exception as e:
-                #    self.dbg_stats['serialize_errors'] += 1
-                #    self.log.error(f'Serialize exception:\n\t{msg.hdr}\n\t{repr(e)}')
-                #    continue
-
-                try: 
-                    #self.log.debug(f'SEND:{msg.hdr}')
-                    tx_sock.send(msg_bytes, dest=self.chassis_mac)
-                    self.dbg_stats['tx_ctr'] += 1
-                except: self.dbg_stats['tx_sock_exceptions'] += 1
-                time.sleep(0.001)
-
-            else: raise RuntimeError('Unexpected msg type in CHA send')
+
+            # sleep until the next token or the next message, whichever comes first
+            next_send = self.tx_sched.next_send(now)
+            timeout = 1 if next_send is None else min(max(next_send - now, 0), 1)
+            if self.tx_sched.full(): time.sleep(timeout)
+            elif not all(self.queue_msg(msg, now) for msg in self.bus.get_batch(timeout=timeout)): break
+            self.send_batch(tx_sock, self.tx_sched.next_batch(time.monotonic(), self.tx_cfg['batch_size']))
 
         self.shutdown = True
         self.log.debug("Send loop exit")
 
+    def queue_msg(self, msg, now):
+        '''False on shutdown'''
+        if isinstance(msg, str):
+            if msg == 'shutdown': return False
+
+        elif isinstance(msg, CHA_REQUEST): self.tx_sched.put(msg, now)
+
+        else: raise RuntimeError('Unexpected msg type in CHA send')
+        return True
+
+    def send_batch(self, tx_sock, msgs):
+        frames = list()
+        for msg in msgs:
+            try: frames.append(bytes(msg))
+            except Exception as e:
+                self.dbg_stats['serialize_errors'] += 1
+                self.log.error(f'Serialize exception:\n\t{msg.hdr}\n\t{repr(e)}')
+        if not frames: return
+        try: sent = tx_sock.send_batch(frames, self.chassis_mac)
+        except Exception:
+            self.dbg_stats['tx_sock_exceptions'] += 1
+            sent = 0
+        self.dbg_stats['tx_ctr'] += sent
+        self.dbg_stats['tx_batches'] += 1
+        self.dbg_stats['tx_frames_dropped'] += len(frames) - sent
+
+    # msg_type: (parser, parse NAK'ed responses too)
+    RESPONSE_PARSERS = {
+        CHA_MSG_TYPE.STREAM_DATA:       (STREAM_DATA_RESPONSE, False),
+        CHA_MSG_TYPE.STREAM_START_ACK:  (lambda hdr, _: STREAM_START_RESPONSE(hdr), True),
+        CHA_MSG_TYPE.STREAM_STOP_ACK:   (lambda hdr, _: STREAM_STOP_RESPONSE(hdr), True),
+        CHA_MSG_TYPE.CNTL_STAT_ACK:     (CHA_STATE_RESPONSE, True),
+        CHA_MSG_TYPE.SRM_STAT_ACK:      (CHA_SRM_STATUS_RESPONSE, False),
+        CHA_MSG_TYPE.CNTL_NODES_BC_ACK: (CHA_DISCOVERY_RESPONSE, False),
+        CHA_MSG_TYPE.SRM_RUN_ACK:       (lambda hdr, _: CHA_RESPONSE(hdr), False),
+        CHA_MSG_TYPE.CNTL_CLK_SET_ACK:  (CHA_SET_CLOCK_RESPONSE, True),
+        CHA_MSG_TYPE.SRM_FAT_ACK:       (CHA_SRM_TABLE_RESPONSE, True),
+    }
+
     def un_serialize(self, hdr:CHA_PROTO_HDR, payload_bytes):
-            retval = None
-        #try: 
-            if hdr.msg_type is CHA_MSG_TYPE.STREAM_DATA:
-                if hdr.nak_code is CHA_NAK_CODE.NO_ERROR:
-                    retval = STREAM_DATA_RESPONSE(hdr, payload_bytes)
-                else:
-                    self.log.debug(f'ERR_RECV:{hdr}')
-
-            elif hdr.msg_type is CHA_MSG_TYPE.STREAM_START_ACK:
-                retval = STREAM_START_RESPONSE(hdr)
-
-            elif hdr.msg_type is CHA_MSG_TYPE.STREAM_STOP_ACK:
-                retval = STREAM_STOP_RESPONSE(hdr)
-
-            elif hdr.msg_type is CHA_MSG_TYPE.CNTL_STAT_ACK:
-                retval = CHA_STATE_RESPONSE(hdr, payload_bytes)
-
-            elif hdr.msg_type is CHA_MSG_TYPE.SRM_STAT_ACK:
-                if hdr.nak_code is CHA_NAK_CODE.NO_ERROR:
-                    retval = CHA_SRM_STATUS_RESPONSE(hdr, payload_bytes)
-                else:
-                    #self.log.debug(f'RECV:{hdr}')
-                    pass
-
-            elif hdr.msg_type is CHA_MSG_TYPE.CNTL_NODES_BC_ACK:
-                if hdr.nak_code is CHA_NAK_CODE.NO_ERROR:
-                    retval = CHA_DISCOVERY_RESPONSE(hdr, payload_bytes)
-                else:
-                    self.log.debug(f'RECV:{hdr}')
-
-            elif hdr.msg_type is CHA_MSG_TYPE.SRM_RUN_ACK:
-                if hdr.nak_code is CHA_NAK_CODE.NO_ERROR:
-                    retval = CHA_RESPONSE(hdr)
-                else:
-                    self.log.debug(f'RECV:{hdr}')
-
-            elif hdr.msg_type is CHA_MSG_TYPE.CNTL_CLK_SET_ACK:
-                retval = CHA_SET_CLOCK_RESPONSE(hdr, payload_bytes)
-
-            elif hdr.msg_type is  CHA_MSG_TYPE.SRM_FAT_ACK:
-                retval = CHA_SRM_TABLE_RESPONSE(hdr, payload_bytes)
+        parser = IFACE_CHASSIS.RESPONSE_PARSERS.get(hdr.msg_type)
+        if parser is None:
+            self.log.debug(f'RECV:{hdr}')
+            return CHA_RESPONSE(hdr)
+
+        parse, parse_nak = parser
+        if (hdr.nak_code is not CHA_NAK_CODE.NO_ERROR) and not parse_nak:
+            self.log.debug(f'RECV:{hdr}')
+            return None
+
+        try: return parse(hdr, payload_bytes)
+        except (struct.error, ValueError) as e:
+            self.dbg_stats['un_serialize_errors'] += 1
+            self.log.error(f'Unserialize error {hdr}: {repr(e)}')
+            return None
+
+    def process_frame(self, packet_bytes):
+        HDR_SZ = CHA_PROTO_HDR.HDR_SZ
+        self.dbg_stats['rx_ctr'] += 1
+        if len(packet_bytes) < HDR_SZ:
+            self.dbg_stats['inpt_hdr_errors'] += 1
+            return
+        try: hdr = CHA_PROTO_HDR.from_bytes(packet_bytes)
+        except ValueError:
+            self.dbg_stats['inpt_hdr_errors'] += 1
+            return
+        #self.log.debug(f'RECV:{hdr}')
 
-            else:
-                retval = CHA_RESPONSE(hdr)
-                self.log.debug(f'RECV:{hdr}')
+        payload_sz = len(packet_bytes) - HDR_SZ
+        if payload_sz < hdr.chunk_sz:
+            self.log.debug(f'RECV:{hdr} Payload size mismatch {payload_sz}/{hdr.chunk_sz}')
+            self.dbg_stats['inpt_hdr_errors'] += 1
+            return
+        elif payload_sz > hdr.chunk_sz:
+            self.dbg_stats['extra_bytes_recvd'] += 1
+
+        payload_bytes = packet_bytes[HDR_SZ:HDR_SZ+hdr.chunk_sz]
 
-        #except Exception as e:
-        #    self.dbg_stats['un_serialize_errors'] += 1
-        #    self.log.error(f"UN-Serialize {hdr.msg_type.name} exception :\n\t{repr(e)}")
-        #    retval = None
-            return retval
+        if hdr.if_type is CHA_LR_IF_TYPE.DRIVER:
+            if not self.chassis_connected:
+                self.log.warning("Chassis connected")
+                self.chassis_connected = True
+            self.dbg_stats['if_type_drived_recvs'] += 1
+            return
+
+        if not (packet := self.un_serialize(hdr, payload_bytes)):
+            return
+
+        if packet.hdr.wait_next_chunk: 
+            if self.packet_waiting_next_chunk:
+                self.log.warning("Chunk sequence error #1")
+                self.dbg_stats['chunk_sequence_error'] += 1
+            self.packet_waiting_next_chunk = packet
+            return
+
+        if packet.hdr.chunk_n:
+            if not self.packet_waiting_next_chunk:
+                self.log.warning("Chunk sequence error #2")
+                self.dbg_stats['chunk_sequence_error'] += 1
+                return
+            else: 
+                self.packet_waiting_next_chunk.concat_payloads(packet)
+                packet = self.packet_waiting_next_chunk
+                self.packet_waiting_next_chunk = None
+
+        if (int(packet.hdr.msg_type)&int(CHA_MSG_TYPE.STR_BIT)) != 0: # stream bit set
+            # data of a registered job goes straight to it, ACKs drive the streamer state machine
+            sink = self.stream_sinks.get((packet.hdr.if_type, packet.hdr.random_id)) \
+                if packet.hdr.msg_type is CHA_MSG_TYPE.STREAM_DATA else None
+            if sink is None: self.send_msg_to_streamproc(packet)
+            else:
+                self.dbg_stats['stream_sink_rx'] += 1
+                # job code runs on the RX thread: a bad frame is dropped, receive goes on
+                try: sink(packet)
+                except Exception as e:
+                    self.dbg_stats['stream_sink_errors'] += 1
+                    self.log.error(f'Stream sink error {packet.hdr}: {repr(e)}')
+        else: self.send_msg_to_core(packet)
 
     def recv_loop(self):
         self.log.debug("CHA recv loop start")
         try:
-            rx_sock = RawSocket(self.eth, 0xEEFA)
+            rx_backend = open_rx_backend(self.eth, 0xEEFA, self.rx_backend_cfg, 0.25)
         except Exception as e:
             self.log.critical(f'Cannot open RAW EHT RECV socket:{repr(e)}')
             return
-        
-        rx_sock.sock.settimeout(0.25)
-        HDR_SZ = CHA_PROTO_HDR.HDR_SZ
-        packet_waiting_next_chunk = None
+        self.log.info(f'RX backend: {self.rx_backend_cfg["type"]}')
         
         while not self.shutdown:
-            try: packet_bytes = rx_sock.recv().data
-            except TimeoutError: continue
+            try: frames = rx_backend.recv_batch()
             except Exception as e:
                 self.log.error("RX socket exception:\b\t%s"%repr(e))
-
-            self.dbg_stats['rx_ctr'] += 1
-            self.last_rx_activity = time.monotonic()
-            hdr = CHA_PROTO_HDR.from_bytes(packet_bytes[:HDR_SZ])
-            #self.log.debug(f'RECV:{hdr}')
-
-            payload_sz = len(packet_bytes) - HDR_SZ
-            if payload_sz < hdr.chunk_sz:
-                self.log.debug(f'RECV:{hdr} Payload size mismatch {payload_sz}/{hdr.chunk_sz}')
-                self.dbg_stats['inpt_hdr_errors'] += 1
                 continue
-            elif payload_sz > hdr.chunk_sz:
-                self.dbg_stats['extra_bytes_recvd'] += 1
-
-            payload_bytes = packet_bytes[HDR_SZ:HDR_SZ+hdr.chunk_sz]
+            if not frames: continue
 
-            if hdr.if_type is CHA_LR_IF_TYPE.DRIVER:
-                if not self.chassis_connected:
-                    self.log.warning("Chassis connected")
-                    self.chassis_connected = True
-                self.dbg_stats['if_type_drived_recvs'] += 1
-                continue
-
-            if not (packet := self.un_serialize(hdr, payload_bytes)):
-                continue
-
-            if packet.hdr.wait_next_chunk: 
-                if packet_waiting_next_chunk:
-                    self.log.warning("Chunk sequence error #1")
-                    self.dbg_stats['chunk_sequence_error'] += 1
-                packet_waiting_next_chunk = packet
-                continue
-
-            if packet.hdr.chunk_n:
-                if not packet_waiting_next_chunk:
-                    self.log.warning("Chunk sequence error #2")
-                    self.dbg_stats['chunk_sequence_error'] += 1
-                    continue
-                else: 
-                    packet_waiting_next_chunk.concat_payloads(packet)
-                    packet = packet_waiting_next_chunk
-                    packet_waiting_next_chunk = None
-
-            if (int(packet.hdr.msg_type)&int(CHA_MSG_TYPE.STR_BIT)) != 0: # stream bit set
-                self.send_msg_to_streamproc(packet)
-            else: self.send_msg_to_core(packet)
-
-        self.log.debug("Recv loop exit")
+            self.last_rx_activity = time.monotonic()
+            self.dbg_stats['rx_batches'] += 1
+            for packet_bytes in frames: self.process_frame(packet_bytes)
 
+        rx_backend.close()
+        self.log.debug("Recv loop exit")
\ No newline at end of file
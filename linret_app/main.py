@@ -1,5 +1,5 @@
 import os, sys, psutil, signal, logging, coloredlogs, argparse
-import core, iface_chassis, iface_cs, monitor, stream_proc, config
+import core, iface_chassis, iface_cs, monitor, stream_proc, db_writer, config
 import nmea_true_time
 from protocol.sn_emulator import *
 
@@ -35,17 +35,19 @@ def main():
     _chassis = iface_chassis.IFACE_CHASSIS(program_params)
     _cs = iface_cs.IFACE_TO_CS(program_params)
     _stream = stream_proc.LINRET_STREAMREADER(program_params, true_time)
+    _db = db_writer.DB_WRITER(program_params)
 
+    # per producer policy on a full bus lane: threads serving sockets never wait
     _core.register_msg_handlres(
-        _chassis.send_msg_to_chassis,
+        _chassis.bus.sender(wait=0.1),
         _cs.send_msg_to_cs,
         _stream.send_msg_to_streamer,
         _mon.send_msg_to_mon
     )
 
     _chassis.register_msg_handlers(
-        _core.send_msg_to_core,
-        _stream.send_msg_to_streamer,
+        _core.bus.sender(wait=0),
+        _stream.bus.sender(wait=0),
         _mon.send_msg_to_mon
     )
 
@@ -55,8 +57,18 @@ def main():
     )
 
     _stream.register_msg_handlres(
-        _chassis.send_msg_to_chassis,
+        _chassis.bus.sender(wait=0.05),
         _core.send_msg_to_core,
+        _mon.send_msg_to_mon,
+        _db.send_msg_to_db
+    )
+
+    _stream.register_stream_sinks(
+        _chassis.register_stream_sink,
+        _chassis.unregister_stream_sink
+    )
+
+    _db.register_msg_handlers(
         _mon.send_msg_to_mon
     )
 
@@ -69,6 +81,7 @@ def main():
     _cs.run()
     _mon.run()
     _stream.run()
+    _db.run()
 
     def shutdown_signal(sig, frame): 
         logger.critical("Exit signal %d"%sig)
@@ -87,6 +100,9 @@ def main():
     logger.info("Program is stopping")
 
     _stream.join()
+    # after the streamer: jobs it handed over are written before shutdown
+    _db.send_msg_to_db('shutdown')
+    _db.join()
     _chassis.join()
     _cs.join()
     _mon.join()
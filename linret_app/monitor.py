@@ -16,6 +16,7 @@ class HTTP_MONITOR:
         self.app.router.add_get('/core', self.get_core_stats)
         self.app.router.add_get('/devs', self.get_devs_stats)
         self.app.router.add_get('/stream', self.get_streamer_stats)
+        self.app.router.add_get('/db', self.get_db_writer_stats)
         self.app.router.add_get('/table', self.get_table_html)
         self.app.router.add_get('/stat', self.get_stat_html)
         self.app.router.add_get('/chrony', self.get_chrony_stats)
@@ -42,6 +43,8 @@ class HTTP_MONITOR:
         self.core_stats = dict()
         self.devs_stats = list()
         self.streamer_stats = dict()
+        self.db_writer_stats = dict()
+        self.spool_stats = dict()
         self.jobs_stats = list()
         #self.latest_image = None
 
@@ -105,8 +108,11 @@ class HTTP_MONITOR:
         return web.json_response(self.devs_stats)
     
     async def get_streamer_stats(self, request):
-        return web.json_response(self.streamer_stats)
+        return web.json_response({**self.streamer_stats, 'spool': self.spool_stats})
     
+    async def get_db_writer_stats(self, request):
+        return web.json_response(self.db_writer_stats)
+
     async def get_jobs_stats(self, request):
         return web.json_response(self.jobs_stats)
 
@@ -171,6 +177,12 @@ class HTTP_MONITOR:
             if 'streamer_stats' in msg:
                 self.streamer_stats = msg['streamer_stats']
 
+            if 'db_writer_stats' in msg:
+                self.db_writer_stats = msg['db_writer_stats']
+
+            if 'spool_stats' in msg:
+                self.spool_stats = msg['spool_stats']
+
             if 'jobs_stats' in msg:
                 self.jobs_stats = msg['jobs_stats']
 
@@ -0,0 +1,77 @@
+'''
+Inter-thread message bus, one per consumer thread.
+Messages are sorted into bounded priority lanes by the consumer classify(msg) and
+dequeued in batches, control lane first, then data, then stats: a stats message never
+takes the place of stream data and control never waits behind data.
+A producer either drops on a full lane (wait=0) or waits up to 'wait' seconds for room.
+Drops are counted per message type.
+'''
+import collections, enum, threading, time
+
+class LANE(enum.IntEnum):
+    CONTROL = 0
+    DATA = 1
+    STATS = 2
+
+def msg_type_name(msg):
+    if isinstance(msg, str): return msg
+    hdr = getattr(msg, 'hdr', None)
+    if hdr is not None and hasattr(hdr, 'msg_type'): return hdr.msg_type.name
+    return type(msg).__name__
+
+class MSG_BUS:
+    def __init__(self, classify, cfg):
+        self.classify = classify
+        self.sizes = [cfg['control'], cfg['data'], cfg['stats']]
+        self.batch_size = cfg['batch_size']
+        self.lanes = [collections.deque() for _ in LANE]
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.drops = collections.Counter()
+        self.max_len = [0 for _ in LANE]
+
+    def put(self, msg, wait=0) -> bool:
+        lane = self.classify(msg)
+        q = self.lanes[lane]
+        with self.lock:
+            if len(q) >= self.sizes[lane] and wait:
+                deadline = time.monotonic() + wait
+                while len(q) >= self.sizes[lane] and (left := deadline - time.monotonic()) > 0:
+                    self.not_full.wait(left)
+            if len(q) >= self.sizes[lane]:
+                self.drops[msg_type_name(msg)] += 1
+                return False
+            q.append(msg)
+            if len(q) > self.max_len[lane]: self.max_len[lane] = len(q)
+            self.not_empty.notify()
+        return True
+
+    def sender(self, wait=0):
+        '''Producer side put() with its own full-lane policy'''
+        return lambda msg: self.put(msg, wait)
+
+    def get_batch(self, timeout=None) -> list:
+        '''Up to batch_size messages in lane priority order, empty list on timeout'''
+        with self.lock:
+            if not any(self.lanes):
+                self.not_empty.wait(timeout)
+            batch = list()
+            for q in self.lanes:
+                while q and len(batch) < self.batch_size: batch.append(q.popleft())
+            if batch: self.not_full.notify_all()
+        return batch
+
+    def qsize(self):
+        return sum(len(q) for q in self.lanes)
+
+    def n_drops(self):
+        with self.lock: return sum(self.drops.values())
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'lanes_len': {lane.name:len(self.lanes[lane]) for lane in LANE},
+                'lanes_max_len': {lane.name:self.max_len[lane] for lane in LANE},
+                'drops': dict(self.drops)
+            }
@@ -0,0 +1,91 @@
+'''
+Discovery of missing chassis addresses.
+Up to 'window' probes per interface are in flight at once. An address that does not
+answer is probed with exponential backoff (known-dead), a lost device is probed every
+'lost_period' for 'lost_time' seconds before it is treated as dead.
+'''
+
+class ADDR_PROBE:
+    __slots__ = ('if_type', 'addr', 'next_probe', 'backoff', 'in_flight_until', 'lost_until')
+
+    def __init__(self, if_type, addr, next_probe, backoff, lost_until=0):
+        self.if_type = if_type
+        self.addr = addr
+        self.next_probe = next_probe
+        self.backoff = backoff
+        self.in_flight_until = 0
+        self.lost_until = lost_until
+
+class NODE_DISCOVERY:
+    def __init__(self, cfg, discover_period, max_addr:dict, now):
+        self.window = cfg['window']
+        self.probe_timeout = cfg['probe_timeout']
+        self.lost_period = cfg['lost_period']
+        self.lost_time = cfg['lost_time']
+        self.max_backoff = cfg['max_backoff']
+        self.discover_period = discover_period
+        self.missing = {if_type:dict() for if_type in max_addr} # if_type -> addr -> ADDR_PROBE
+        for if_type, max_node in max_addr.items():
+            for addr in range(1, max_node + 1):
+                self.missing[if_type][addr] = ADDR_PROBE(if_type, addr, now, discover_period)
+        self.incomplete_since = now
+        self.topology_change = now # start or last loss
+        self.stats = {
+            'discover_probes': 0,
+            'discover_missing': 0,
+            'time_to_topology_ms': None, # to the last discovered device
+            'time_to_full_topology_ms': None,
+            'topology_full': False
+        }
+        self.update_stats()
+
+    def next_probes(self, now) -> list:
+        '''(if_type, addr) to probe now'''
+        probes = list()
+        for if_type, missing in self.missing.items():
+            in_flight = sum(1 for probe in missing.values() if probe.in_flight_until > now)
+            for addr, probe in missing.items():
+                if in_flight >= self.window: break
+                if probe.next_probe > now or probe.in_flight_until > now: continue
+                probe.in_flight_until = now + self.probe_timeout
+                if now < probe.lost_until: probe.next_probe = now + self.lost_period
+                else:
+                    probe.next_probe = now + probe.backoff
+                    probe.backoff = min(probe.backoff*2, self.max_backoff)
+                in_flight += 1
+                probes.append((if_type, addr))
+        self.stats['discover_probes'] += len(probes)
+        return probes
+
+    def next_deadline(self, now):
+        '''Earliest time a probe is due or a window slot frees up'''
+        deadline = None
+        for missing in self.missing.values():
+            in_flight = [probe.in_flight_until for probe in missing.values() if probe.in_flight_until > now]
+            for probe in missing.values():
+                due = probe.next_probe if len(in_flight) < self.window else max(probe.next_probe, min(in_flight))
+                if deadline is None or due < deadline: deadline = due
+        return deadline
+
+    def found(self, if_type, addr, now):
+        missing = self.missing.get(if_type)
+        if missing is None or missing.pop(addr, None) is None: return
+        self.stats['time_to_topology_ms'] = int((now - self.topology_change)*1000)
+        if self.incomplete_since is not None and not any(self.missing.values()):
+            self.stats['time_to_full_topology_ms'] = int((now - self.incomplete_since)*1000)
+            self.incomplete_since = None
+        self.update_stats()
+
+    def lost(self, if_type, addr, now):
+        if if_type not in self.missing: return
+        self.missing[if_type][addr] = ADDR_PROBE(if_type, addr, now, self.discover_period, now + self.lost_time)
+        if self.incomplete_since is None: self.incomplete_since = now
+        self.topology_change = now
+        self.update_stats()
+
+    def update_stats(self):
+        self.stats['discover_missing'] = sum(len(missing) for missing in self.missing.values())
+        self.stats['topology_full'] = self.incomplete_since is None
+
+    def get_stats(self):
+        return self.stats
@@ -1,5 +1,8 @@
 from enum import IntEnum
 
+# value -> member, same result as calling the enum but a plain dict lookup
+enum_table = lambda e: {m.value: m for m in e}
+
 class CHA_LR_IF_TYPE(IntEnum):
     INVALID = 0
     DRIVER = 1
@@ -1,33 +1,22 @@
 from .cha_structs import *
 
 '''
-Helpers
+Packet masks are ints, bit n = packet n. On the wire they are BITMASK_SZ_32
+little-endian 32-bit words, which is exactly int.to_bytes(4*BITMASK_SZ_32, 'little')
 '''
 
-split_to_words = lambda n: (n>>5, 1<<(n&0x1F))
-
-def bit_set(mask:list[int], bit_n:int):
-    cell, bit = split_to_words(bit_n)
-    mask[cell] |= bit
-
-def bit_clear(mask:list[int], bit_n:int):
-    cell, bit = split_to_words(bit_n)
-    mask[cell] &= (~bit)&0xFFFFFFFF
-
-def bit_read(mask:list[int], bit_n:int):
-    cell, bit = split_to_words(bit_n)
-    return bool(mask[cell]&bit)
+BITMASK_SZ_32 = 13
+BITMASK_SZ = 4*BITMASK_SZ_32
 
 '''
 REQUESTS
 '''
 
 class STREAM_START_REQUEST(CHA_REQUEST):
-    BITMASK_SZ_32 = 13
-    DATASTRUCT = f'<L{BITMASK_SZ_32}LL'
+    DATASTRUCT = struct.Struct(f'<L{BITMASK_SZ}sL')
 
     def __init__(self, if_type:CHA_LR_IF_TYPE, random_id:int,
-                 timestamp:int, packets:list[int], adc_config_code:int
+                 timestamp:int, packets:int, adc_config_code:int
                  ):
         self.hdr = CHA_PROTO_HDR(if_type, 
                                  CHA_MSG_TYPE.STREAM_START, 
@@ -38,23 +27,19 @@ class STREAM_START_REQUEST(CHA_REQUEST):
         self.adc_config_code = adc_config_code
 
     def __bytes__(self):
-        mask = [0]*STREAM_START_REQUEST.BITMASK_SZ_32
-        for packet_n in self.packets: bit_set(mask, packet_n)
-
-        payload_bytes = struct.pack(STREAM_START_REQUEST.DATASTRUCT, 
+        payload_bytes = STREAM_START_REQUEST.DATASTRUCT.pack(
                            self.timestamp,
-                           *mask,
+                           self.packets.to_bytes(BITMASK_SZ, 'little'),
                            self.adc_config_code
                            )
         self.hdr.chunk_sz = len(payload_bytes)
         return bytes(self.hdr) + payload_bytes
     
 class STREAM_FEEDBACK_REQUEST(CHA_REQUEST):
-    BITMASK_SZ_32 = 13
-    DATASTRUCT = f'<L{BITMASK_SZ_32}L'
+    DATASTRUCT = struct.Struct(f'<L{BITMASK_SZ}s')
 
     def __init__(self, if_type:CHA_LR_IF_TYPE, random_id:int,
-                 timestamp:int, packets:list[int]
+                 timestamp:int, packets:int
                  ):
         self.hdr = CHA_PROTO_HDR(if_type, 
                                  CHA_MSG_TYPE.STREAM_FB, 
@@ -64,12 +49,9 @@ class STREAM_FEEDBACK_REQUEST(CHA_REQUEST):
         self.timestamp = timestamp
 
     def __bytes__(self):
-        mask = [0]*STREAM_FEEDBACK_REQUEST.BITMASK_SZ_32
-        for packet_n in self.packets: bit_set(mask, packet_n)
-
-        payload_bytes = struct.pack(STREAM_FEEDBACK_REQUEST.DATASTRUCT,
+        payload_bytes = STREAM_FEEDBACK_REQUEST.DATASTRUCT.pack(
                                     self.timestamp,
-                                    *mask
+                                    self.packets.to_bytes(BITMASK_SZ, 'little')
                                     )
         
         self.hdr.chunk_sz = len(payload_bytes)
@@ -94,24 +76,30 @@ class STREAM_STOP_RESPONSE(CHA_RESPONSE):
     pass
 
 class STREAM_DATA_RESPONSE(CHA_RESPONSE):
+    DATA_HDR = BITFIELD(('packet_n', 3), ('payload_present', 1, bool), ('err_code', 4))
 
     def __init__(self, hdr:CHA_PROTO_HDR, payload_bytes:bytes):
         super().__init__(hdr)
         if self.hdr.chunk_n == 0: #first chunk contains data hdr
             self.node_id = payload_bytes[0]
-            unpacker = bit_unpack(payload_bytes[1])
-            next(unpacker)
-            self.packet_n = unpacker.send(3)
-            self.payload_present = bool(unpacker.send(1))
-            self.err_code = unpacker.send(4)
+            STREAM_DATA_RESPONSE.DATA_HDR.decode_into(self, payload_bytes[1])
             if self.payload_present: 
                 self.hdr.wait_next_chunk = True
-                self.payload = payload_bytes[4:]
+                self.chunks = [payload_bytes[4:]]
         else:
-            self.payload = payload_bytes
+            self.chunks = [payload_bytes]
 
     def concat_payloads(self, second_chunk:'STREAM_DATA_RESPONSE'):
-        self.payload += second_chunk.payload
+        # chunks stay views of the rx buffers until copied into the job buffer
+        self.chunks.extend(second_chunk.chunks)
+
+    def copy_payload_to(self, dst:memoryview):
+        offset = 0
+        for chunk in self.chunks:
+            n = min(len(chunk), len(dst) - offset)
+            dst[offset:offset+n] = chunk[:n]
+            offset += n
+        return offset
 
 __all__ = [
     'STREAM_START_REQUEST',
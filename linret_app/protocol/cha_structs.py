@@ -11,8 +11,14 @@ CHA-LR HEADER
 '''
 
 class CHA_PROTO_HDR:
-    CHA_HDR_DATASTRUCT = '<BBH 4x BxxxBBBB'
-    HDR_SZ = struct.calcsize(CHA_HDR_DATASTRUCT)
+    CHA_HDR_DATASTRUCT = struct.Struct('<BBH 4x BxxxBBBB')
+    HDR_SZ = CHA_HDR_DATASTRUCT.size
+    RAND_OFFSET = 8
+    IF_TYPES = enum_table(CHA_LR_IF_TYPE)
+    MSG_TYPES = enum_table(CHA_MSG_TYPE)
+    NAK_CODES = enum_table(CHA_NAK_CODE)
+    __slots__ = ('if_type', 'src_addr', 'dst_addr', 'msg_type', 'nak_code', 
+                 'random_id', 'chunk_n', 'chunk_sz', 'wait_next_chunk')
 
     def __init__(self, iface:CHA_LR_IF_TYPE, msg:CHA_MSG_TYPE,
                  chu:int=0, sz:int=0, rand:int=0, 
@@ -25,15 +31,22 @@ class CHA_PROTO_HDR:
         self.wait_next_chunk = False
 
     @classmethod
-    def from_bytes(cls, inpt:bytes) -> CHA_PROTO_HDR:
-        tupl = struct.unpack(cls.CHA_HDR_DATASTRUCT, inpt)
-        return cls(CHA_LR_IF_TYPE(tupl[0]), CHA_MSG_TYPE(tupl[6]),
-                   chu=tupl[1], sz=tupl[2], rand=tupl[3], 
-                   src=tupl[4], dst=tupl[5], nak=CHA_NAK_CODE(tupl[7])
-        )
+    def from_bytes(cls, inpt:bytes, offset:int=0) -> CHA_PROTO_HDR:
+        if_type, chu, sz, rand, src, dst, msg, nak = cls.CHA_HDR_DATASTRUCT.unpack_from(inpt, offset)
+        hdr = cls.__new__(cls)
+        try:
+            hdr.if_type = cls.IF_TYPES[if_type]
+            hdr.msg_type = cls.MSG_TYPES[msg]
+            hdr.nak_code = cls.NAK_CODES[nak]
+        except KeyError as e:
+            raise ValueError(f'Invalid CHA header field value {e}')
+        hdr.chunk_n, hdr.chunk_sz, hdr.random_id = chu, sz, rand
+        hdr.src_addr, hdr.dst_addr = src, dst
+        hdr.wait_next_chunk = False
+        return hdr
 
     def __bytes__(self):
-        return struct.pack(CHA_PROTO_HDR.CHA_HDR_DATASTRUCT, 
+        return CHA_PROTO_HDR.CHA_HDR_DATASTRUCT.pack(
             self.if_type, self.chunk_n, self.chunk_sz,
             self.random_id, self.src_addr, self.dst_addr,
             self.msg_type, self.nak_code
@@ -47,14 +60,19 @@ class CHA_PROTO_HDR:
 REQUESTS TO CHASSIS/SRM
 '''
 class CHA_REQUEST:
+    ACK_BIT = CHA_MSG_TYPE.ACK_BIT.value
+
     def __init__(self, hdr:CHA_PROTO_HDR):
         self.hdr = hdr
         self.send_time = time.monotonic()
 
+    def match_key(self):
+        '''(expected response msg_type, if_type, addr, random_id), see CHA_RESPONSE.match_key()'''
+        hdr = self.hdr
+        return (hdr.msg_type|CHA_REQUEST.ACK_BIT, hdr.if_type, hdr.dst_addr, hdr.random_id)
+
     def validate_response(self, response:CHA_RESPONSE):
-        return self.hdr.if_type is response.hdr.if_type and \
-                self.hdr.dst_addr == response.hdr.src_addr and \
-                self.hdr.random_id == response.hdr.random_id
+        return self.match_key() == response.match_key()
     
     def __bytes__(self):
         return bytes(self.hdr)   
@@ -68,33 +86,45 @@ class CHA_HANDSHAKE_REQUEST(CHA_REQUEST):
         super().__init__(hdr)
     
 class CHA_SIMPLE_REQUEST(CHA_REQUEST):
-    def __init__(self, iface:CHA_LR_IF_TYPE, msg_type:CHA_MSG_TYPE, dst, rand):
-        hdr = CHA_PROTO_HDR(iface, msg_type, dst=dst, rand=rand)
-        super().__init__(hdr)
+    '''
+    Header only request, polled continuously for every node. Serialized from a cached
+    per (msg_type, if_type, dst) header template with only the random_id byte filled in.
+    '''
+    MSG_TYPE:CHA_MSG_TYPE = None
+    TEMPLATES:dict[tuple, tuple] = dict() # (msg_type, if_type, dst) -> (bytes before, after random_id)
+    RAND_BYTES = tuple(bytes((rand,)) for rand in range(256))
+
+    def __init__(self, iface:CHA_LR_IF_TYPE, dst:int, rand:int):
+        self.hdr = CHA_PROTO_HDR(iface, self.MSG_TYPE, 0, 0, rand, 0, dst)
+        self.send_time = time.monotonic()
+
+    def __bytes__(self):
+        hdr = self.hdr
+        key = (hdr.msg_type, hdr.if_type, hdr.dst_addr)
+        if (template := CHA_SIMPLE_REQUEST.TEMPLATES.get(key)) is None:
+            hdr_bytes = bytes(hdr)
+            template = (hdr_bytes[:CHA_PROTO_HDR.RAND_OFFSET], hdr_bytes[CHA_PROTO_HDR.RAND_OFFSET+1:])
+            CHA_SIMPLE_REQUEST.TEMPLATES[key] = template
+        return template[0] + CHA_SIMPLE_REQUEST.RAND_BYTES[hdr.random_id] + template[1]
     
 class CHA_SRM_STATUS_REQUEST(CHA_SIMPLE_REQUEST):
-    def __init__(self, iface:CHA_LR_IF_TYPE, dst, rand):
-        super().__init__(iface, CHA_MSG_TYPE.SRM_STAT_REQ, dst, rand)
+    MSG_TYPE = CHA_MSG_TYPE.SRM_STAT_REQ
     
 class CHA_STATE_REQUEST(CHA_SIMPLE_REQUEST):
-    def __init__(self, iface:CHA_LR_IF_TYPE, dst:int, rand:int):
-        super().__init__(iface, CHA_MSG_TYPE.CNTL_STAT_REQ, dst, rand)
+    MSG_TYPE = CHA_MSG_TYPE.CNTL_STAT_REQ
     
 class CHA_DISCOVERY_REQUEST(CHA_SIMPLE_REQUEST):
-    def __init__(self, iface:CHA_LR_IF_TYPE, dst:int, rand:int):
-        super().__init__(iface, CHA_MSG_TYPE.CNTL_NODES_BC_REQ, dst, rand)
+    MSG_TYPE = CHA_MSG_TYPE.CNTL_NODES_BC_REQ
 
 class CHA_SRM_STOP_REQUEST(CHA_SIMPLE_REQUEST):
-    def __init__(self, iface:CHA_LR_IF_TYPE, dst:int, rand:int):
-        super().__init__(iface, CHA_MSG_TYPE.SRM_STOP_REQ, dst, rand)
+    MSG_TYPE = CHA_MSG_TYPE.SRM_STOP_REQ
 
 class CHA_SRM_TABLE_REQUEST(CHA_SIMPLE_REQUEST):
-    def __init__(self, iface:CHA_LR_IF_TYPE, dst, rand):
-        super().__init__(iface, CHA_MSG_TYPE.SRM_FAT_REQ, dst, rand)
+    MSG_TYPE = CHA_MSG_TYPE.SRM_FAT_REQ
     
 class CHA_SRM_RUN_REQUEST(CHA_REQUEST):
-    SRM_CMD_DATASTRUCT = '<L?xHLL4s'
-    CHA_CMD_DATASTRUCT = '<??xx'
+    SRM_CMD_DATASTRUCT = struct.Struct('<L?xHLL4s')
+    CHA_CMD_DATASTRUCT = struct.Struct('<??xx')
 
     def __init__(self, iface:CHA_LR_IF_TYPE, dst, rand,\
                  adc_params:UNI_ADC_CFG, gps:CHA_GPS_STRUCT):
@@ -116,14 +146,14 @@ class CHA_SRM_RUN_REQUEST(CHA_REQUEST):
         super().__init__(hdr)
 
     def __bytes__(self):
-        srm_cmd_bytes = struct.pack(self.SRM_CMD_DATASTRUCT,
+        srm_cmd_bytes = self.SRM_CMD_DATASTRUCT.pack(
             int(self.cmd_send_time),
             self.ignore_pps,
             self.height, self.lat, self.lon, # gps
             self.adc_params.to_srm_bytes()
         )
 
-        cha_cmd_bytes = struct.pack(self.CHA_CMD_DATASTRUCT,
+        cha_cmd_bytes = self.CHA_CMD_DATASTRUCT.pack(
             self.flag_use_chassis_time, self.flag_use_chassis_coord
         )
 
@@ -133,6 +163,8 @@ class CHA_SRM_RUN_REQUEST(CHA_REQUEST):
 
     
 class CHA_SET_CLOCK_REQUEST(CHA_REQUEST):
+    DATASTRUCT = struct.Struct('<L')
+
     def __init__(self, iface:CHA_LR_IF_TYPE, dst, rand, true_unix_time):
         hdr = CHA_PROTO_HDR(iface, CHA_MSG_TYPE.CNTL_CLK_SET_REQ, dst=dst, rand=rand)
         self.second = int(true_unix_time)
@@ -140,7 +172,7 @@ class CHA_SET_CLOCK_REQUEST(CHA_REQUEST):
         super().__init__(hdr)
 
     def __bytes__(self):
-        payload = struct.pack('<L', self.second)
+        payload = CHA_SET_CLOCK_REQUEST.DATASTRUCT.pack(self.second)
         self.hdr.chunk_sz = len(payload)
         return bytes(self.hdr) + payload
 
@@ -148,26 +180,62 @@ class CHA_SET_CLOCK_REQUEST(CHA_REQUEST):
 RESPONSES FROM CHASSIS/SRM
 '''
 class CHA_RESPONSE:
+    __slots__ = ('hdr', 'recv_time')
     def __init__(self, hdr:CHA_PROTO_HDR):
         self.hdr = hdr
         self.recv_time = time.monotonic()
 
+    def match_key(self):
+        hdr = self.hdr
+        return (hdr.msg_type, hdr.if_type, hdr.src_addr, hdr.random_id)
+
     def __str__(self):
         return f'{self.hdr.msg_type.name} from {self.hdr.if_type.name}:{self.hdr.src_addr}'
 
 class CHA_SET_CLOCK_RESPONSE(CHA_RESPONSE):
+    DATASTRUCT = struct.Struct('<L')
+
     def __init__(self, hdr:CHA_PROTO_HDR, payload_bytes:bytes):
         super().__init__(hdr)
-        if payload_bytes: self.phase = struct.unpack('<L', payload_bytes)[0]
+        if payload_bytes: self.phase = CHA_SET_CLOCK_RESPONSE.DATASTRUCT.unpack_from(payload_bytes)[0]
         else: self.phase = None
 
 class CHA_SRM_STATUS_RESPONSE(CHA_RESPONSE):
-    SRM_DATA_HDR_STRUCT = f'<qqLllhH3h3hHBBL4s'
+    SRM_DATA_HDR_STRUCT = struct.Struct(f'<qqLllhH3h3hHBBL4s')
+    FLAGS = BITFIELD(
+        ('fatal_error', 1, bool),
+        ('pps_present', 1, bool),
+        ('vbus_present', 1, bool),
+        ('eeprom_consts_ok', 1, bool),
+        ('vcxo_pwm_in_range', 1, bool),
+        ('adc_sync_ok', 1, bool),
+        ('acq_running', 1, bool),
+        ('sd_record_running', 1),
+
+        ('test_mode_on', 1, bool),
+        ('card_reader_on', 1, bool),
+        ('sensor_power_on', 1, bool),
+        ('adc_power_on', 1, bool),
+        ('rsrvd2', 4),
+
+        ('adc0_ok', 1, bool),
+        ('adc1_ok', 1, bool),
+        ('adc2_ok', 1, bool),
+        ('adc3_ok', 1, bool),
+
+        ('sd_ok', 1, bool),
+        ('acc_ok', 1, bool),
+        ('humid_ok', 1, bool),
+        ('press_ok', 1, bool),
+
+        ('fw_ver', 4),
+        ('fw_subver', 4),
+    )
 
     def __init__(self, hdr:CHA_PROTO_HDR, payload_bytes:bytes):
         super().__init__(hdr)
         
-        tupl = struct.unpack(CHA_SRM_STATUS_RESPONSE.SRM_DATA_HDR_STRUCT, payload_bytes)
+        tupl = CHA_SRM_STATUS_RESPONSE.SRM_DATA_HDR_STRUCT.unpack_from(payload_bytes)
         self.samples_timestamp_ns = tupl[0]
         self.pps_timestamp_ns = tupl[1]
         self.unix_timestamp = tupl[2]
@@ -182,42 +250,13 @@ class CHA_SRM_STATUS_RESPONSE(CHA_RESPONSE):
         self.humidity = tupl[15]
         self.adc_params = UNI_ADC_CFG.from_srm_bytes(tupl[17])
 
-        #flags
-        unpacker = bit_unpack(tupl[16])
-        next(unpacker)
-
-        self.fatal_error = bool(unpacker.send(1))
-        self.pps_present = bool(unpacker.send(1))
-        self.vbus_present = bool(unpacker.send(1))
-        self.eeprom_consts_ok = bool(unpacker.send(1))
-        self.vcxo_pwm_in_range = bool(unpacker.send(1))
-        self.adc_sync_ok = bool(unpacker.send(1))
-        self.acq_running = bool(unpacker.send(1))
-        self.sd_record_running = unpacker.send(1)
-
-        self.test_mode_on = bool(unpacker.send(1))
-        self.card_reader_on = bool(unpacker.send(1))
-        self.sensor_power_on = bool(unpacker.send(1))
-        self.adc_power_on = bool(unpacker.send(1))
-        self.rsrvd2 = unpacker.send(4)
-
-        self.adc0_ok = bool(unpacker.send(1))
-        self.adc1_ok = bool(unpacker.send(1))
-        self.adc2_ok = bool(unpacker.send(1))
-        self.adc3_ok = bool(unpacker.send(1))
-
-        self.sd_ok = bool(unpacker.send(1))
-        self.acc_ok = bool(unpacker.send(1))
-        self.humid_ok = bool(unpacker.send(1))
-        self.press_ok = bool(unpacker.send(1))
-
-        self.fw_ver =  unpacker.send(4)
-        self.fw_subver =  unpacker.send(4)
+        CHA_SRM_STATUS_RESPONSE.FLAGS.decode_into(self, tupl[16])
 
 class CHA_GPS_STRUCT:
-    CHA_GPS_STRUCT = '<llBBhL'
-    def __init__(self, payload_bytes):
-        tupl = struct.unpack(CHA_GPS_STRUCT.CHA_GPS_STRUCT, payload_bytes)
+    CHA_GPS_STRUCT = struct.Struct('<llBBhL')
+    __slots__ = ('gps_lon', 'gps_lat', 'fix', 'num_sv', 'gps_height', 'unix_time')
+    def __init__(self, payload_bytes, offset=0):
+        tupl = CHA_GPS_STRUCT.CHA_GPS_STRUCT.unpack_from(payload_bytes, offset)
         self.gps_lon = tupl[0]/10000000
         self.gps_lat = tupl[1]/10000000
         self.fix = tupl[2]
@@ -227,107 +266,121 @@ class CHA_GPS_STRUCT:
         
 class CHA_STATE_RESPONSE(CHA_RESPONSE):
     CHA_PARAMS_COMMENT_SZ = 64
-    CHA_PARAMS_STRUCT = f'<{CHA_PARAMS_SN_SZ}s{CHA_PARAMS_COMMENT_SZ}sBBBB??xxBB6sBB6sBBBB'
-    PARAMS_SZ = struct.calcsize(CHA_PARAMS_STRUCT)
-    CHA_STATE_STRUCT = f'<L16s16s32s12sff{PARAMS_SZ}s6s6s'
+    CHA_PARAMS_STRUCT = struct.Struct(f'<{CHA_PARAMS_SN_SZ}s{CHA_PARAMS_COMMENT_SZ}sBBBB??xxBB6sBB6sBBBB')
+    PARAMS_SZ = CHA_PARAMS_STRUCT.size
+    CHA_STATE_STRUCT = struct.Struct(f'<L16s16s32s12sff{PARAMS_SZ}s6s6s')
+    GPS_OFFSET = 4
+    LATEST_GPS_OFFSET = GPS_OFFSET + 16
+    ADC_OFFSET = LATEST_GPS_OFFSET + 16
+    TIME_SYNC_OFFSET = ADC_OFFSET + 32
+    ETC_STRUCT = struct.Struct(f'<ff{PARAMS_SZ}x6s6s')
+    ETC_OFFSET = TIME_SYNC_OFFSET + 12
+    PARAMS_OFFSET = ETC_OFFSET + 8
+    ADC_STRUCT = struct.Struct('<8f')
+    TIME_SYNC_STRUCT = struct.Struct('<BBBBLL')
+    FLAGS = BITFIELD(
+        ('sys_wifi_port0_ok', 1, bool),
+        ('sys_wifi_port1_ok', 1, bool),
+        ('sys_rs485_port0_ok', 1, bool),
+        ('sys_rs485_port1_ok', 1, bool),
+        ('sys_ethernet_ok', 1, bool),
+        ('sys_srm_port_ok', 1, bool),
+        ('sys_wifi_link0_ok', 1, bool),
+        ('sys_wifi_link1_ok', 1, bool),
+
+        ('hw_pca9536d_ok', 1, bool),
+        ('hw_gps_ok', 1, bool),
+        ('hw_hts221_ok', 1, bool),
+        ('hw_vcxo_ok', 1, bool),
+        ('hw_pvc_pwr_ok', 1, bool),
+        ('hw_batt_0_charging', 1, bool),
+        ('hw_batt_1_charging', 1, bool),
+        ('hw_reserved', 1),
+
+        ('mode_lr', 1, bool),
+        ('mode_obs', 1, bool),
+        ('mode_nodal', 1, bool),
+        ('mode_reserved', 5),
+
+        ('state_pps_ok', 1, bool),
+        ('state_time_sync_ok', 1, bool),
+        ('state_srm_powered', 1, bool),
+        ('state_srm_connected', 1, bool),
+        ('state_downlink_ok', 1, bool),
+        ('state_uplink_ok', 1, bool),
+        ('state_srm_active', 1, bool),
+        ('state_srm_scheduled', 1, bool),
+    )
+
+    # Sub-blocks are decoded on first access, the RX thread only keeps the payload
+    __slots__ = ('payload', '_flags', '_gps', '_adc', '_time_sync', '_params', '_etc')
 
     def __init__(self, hdr:CHA_PROTO_HDR, payload_bytes:bytes):
         super().__init__(hdr)
+        if len(payload_bytes) < CHA_STATE_RESPONSE.CHA_STATE_STRUCT.size:
+            raise struct.error(f'CHA_STATE_RESPONSE requires {CHA_STATE_RESPONSE.CHA_STATE_STRUCT.size} bytes')
+        self.payload = bytes(payload_bytes)
 
-        tupl = struct.unpack(CHA_STATE_RESPONSE.CHA_STATE_STRUCT, payload_bytes)
-
-        #flags
-        unpacker = bit_unpack(tupl[0])
-        next(unpacker)
-        self.sys_wifi_port0_ok = bool(unpacker.send(1))
-        self.sys_wifi_port1_ok = bool(unpacker.send(1))
-        self.sys_rs485_port0_ok = bool(unpacker.send(1))
-        self.sys_rs485_port1_ok = bool(unpacker.send(1))
-        self.sys_ethernet_ok = bool(unpacker.send(1))
-        self.sys_srm_port_ok = bool(unpacker.send(1))
-        self.sys_wifi_link0_ok = bool(unpacker.send(1))
-        self.sys_wifi_link1_ok = bool(unpacker.send(1))
-
-        self.hw_pca9536d_ok = bool(unpacker.send(1))
-        self.hw_gps_ok = bool(unpacker.send(1))
-        self.hw_hts221_ok = bool(unpacker.send(1))
-        self.hw_vcxo_ok = bool(unpacker.send(1))
-        self.hw_pvc_pwr_ok =  bool(unpacker.send(1))
-        self.hw_batt_0_charging =  bool(unpacker.send(1))
-        self.hw_batt_1_charging =  bool(unpacker.send(1))
-        self.hw_reserved = unpacker.send(1)
-
-        self.mode_lr = bool(unpacker.send(1))
-        self.mode_obs = bool(unpacker.send(1))
-        self.mode_nodal = bool(unpacker.send(1))
-        self.mode_reserved = unpacker.send(5)
-
-        self.state_pps_ok = bool(unpacker.send(1))
-        self.state_time_sync_ok = bool(unpacker.send(1))
-        self.state_srm_powered = bool(unpacker.send(1))
-        self.state_srm_connected = bool(unpacker.send(1))
-        self.state_downlink_ok = bool(unpacker.send(1))
-        self.state_uplink_ok = bool(unpacker.send(1))
-        self.state_srm_active = bool(unpacker.send(1))
-        self.state_srm_scheduled = bool(unpacker.send(1))
+    def _decode_flags(self):
+        return CHA_STATE_RESPONSE.FLAGS.decode(int.from_bytes(self.payload[:4], 'little'))
 
+    def _decode_gps(self):
         # GPS readings
-        self.gps = CHA_GPS_STRUCT(tupl[1])
-        self.latest_valid_gps = CHA_GPS_STRUCT(tupl[2])
+        return (CHA_GPS_STRUCT(self.payload, CHA_STATE_RESPONSE.GPS_OFFSET),
+                CHA_GPS_STRUCT(self.payload, CHA_STATE_RESPONSE.LATEST_GPS_OFFSET))
 
+    def _decode_adc(self):
         # ADC readings
-        adc_vals = struct.unpack('<8f', tupl[3])
-        self.batt_vin = [adc_vals[0], adc_vals[1]]
-        self.miniBatt_v = adc_vals[2]
-        self.pvc_vin = adc_vals[3]
-        self.chassis_pwr = adc_vals[4]
-        self.srm_pwr = adc_vals[5]
-        self.charge_curr = adc_vals[6]
-        self.charge_pwr = adc_vals[7]
+        adc_vals = CHA_STATE_RESPONSE.ADC_STRUCT.unpack_from(self.payload, CHA_STATE_RESPONSE.ADC_OFFSET)
+        return ([adc_vals[0], adc_vals[1]],) + adc_vals[2:]
 
+    def _decode_time_sync(self):
         # Time sync state
-        datastruct = '<BBBBLL'
-        ts_vals = struct.unpack(datastruct, tupl[4])
-        self.chasis_time_valid = bool(ts_vals[0])
-        self.inpt_pps_valid = bool(ts_vals[1])
-        self.pps_mode = ts_vals[2]
-        self.vcxo_pwm_in_range = bool(ts_vals[3])
-        self.appended_unix_time = ts_vals[4]
-        self.curr_time = ts_vals[5]
-
-        # Params
-        params = struct.unpack(CHA_STATE_RESPONSE.CHA_PARAMS_STRUCT, tupl[7])
-        self.sn = params[0].strip(b'\0').decode(encoding="ASCII", errors='ignore')
-        self.comment = params[1].strip(b'\0').decode(encoding="ASCII", errors='ignore')
-        self.node_id = params[2]
-        self.dev_type = CHA_DEV_TYPE(params[3])
-        self.vcxo_type = CHA_VCXO_TYPE(params[4])
-        self.sync_src = CHA_SYNC_SRC(params[5])
-        self.ext_out_0_en = params[6]
-        self.ext_out_1_en = params[7]
-        self.downlink_if = CHA_CONN_TYPE(params[8])
-        self.downlink_wifi_ch = params[9]
-        self.downlink_mac = params[10].hex()
-        self.uplink_if = CHA_CONN_TYPE(params[11])
-        self.uplink_wifi_ch = params[12]
-        self.uplink_mac = params[13].hex()
-        #self.wifi_power = params[14]
-        #self.wifi_speed = SL_WLAN_RATE(params[15])
-        #self.wifi_preamble = SL_WLAN_PREAMBLE(params[16])
-        #self.wifi_cci = SlTxInhibitThreshold(params[17])
-
-        # etc
-        self.humidity = round(tupl[5], 1)
-        self.temperature = round(tupl[6], 1)
-        self.wifi_mac_downlink = tupl[8].hex()
-        self.wifi_mac_uplink = tupl[9].hex()
+        ts_vals = CHA_STATE_RESPONSE.TIME_SYNC_STRUCT.unpack_from(self.payload, CHA_STATE_RESPONSE.TIME_SYNC_OFFSET)
+        return (bool(ts_vals[0]), bool(ts_vals[1]), ts_vals[2], bool(ts_vals[3]), ts_vals[4], ts_vals[5])
+
+    def _decode_params(self):
+        params = CHA_STATE_RESPONSE.CHA_PARAMS_STRUCT.unpack_from(self.payload, CHA_STATE_RESPONSE.PARAMS_OFFSET)
+        return (
+            params[0].strip(b'\0').decode(encoding="ASCII", errors='ignore'),
+            params[1].strip(b'\0').decode(encoding="ASCII", errors='ignore'),
+            params[2],
+            CHA_DEV_TYPE(params[3]),
+            CHA_VCXO_TYPE(params[4]),
+            CHA_SYNC_SRC(params[5]),
+            params[6],
+            params[7],
+            CHA_CONN_TYPE(params[8]),
+            params[9],
+            params[10].hex(),
+            CHA_CONN_TYPE(params[11]),
+            params[12],
+            params[13].hex(),
+            #SL_WLAN_RATE(params[15]), SL_WLAN_PREAMBLE(params[16]), SlTxInhibitThreshold(params[17])
+        )
+
+    def _decode_etc(self):
+        etc = CHA_STATE_RESPONSE.ETC_STRUCT.unpack_from(self.payload, CHA_STATE_RESPONSE.ETC_OFFSET)
+        return (round(etc[0], 1), round(etc[1], 1), etc[2].hex(), etc[3].hex())
+
+lazy_fields(CHA_STATE_RESPONSE, '_flags', CHA_STATE_RESPONSE._decode_flags, CHA_STATE_RESPONSE.FLAGS.names)
+lazy_fields(CHA_STATE_RESPONSE, '_gps', CHA_STATE_RESPONSE._decode_gps, ('gps', 'latest_valid_gps'))
+lazy_fields(CHA_STATE_RESPONSE, '_adc', CHA_STATE_RESPONSE._decode_adc,
+    ('batt_vin', 'miniBatt_v', 'pvc_vin', 'chassis_pwr', 'srm_pwr', 'charge_curr', 'charge_pwr'))
+lazy_fields(CHA_STATE_RESPONSE, '_time_sync', CHA_STATE_RESPONSE._decode_time_sync,
+    ('chasis_time_valid', 'inpt_pps_valid', 'pps_mode', 'vcxo_pwm_in_range', 'appended_unix_time', 'curr_time'))
+lazy_fields(CHA_STATE_RESPONSE, '_params', CHA_STATE_RESPONSE._decode_params,
+    ('sn', 'comment', 'node_id', 'dev_type', 'vcxo_type', 'sync_src', 'ext_out_0_en', 'ext_out_1_en',
+     'downlink_if', 'downlink_wifi_ch', 'downlink_mac', 'uplink_if', 'uplink_wifi_ch', 'uplink_mac'))
+lazy_fields(CHA_STATE_RESPONSE, '_etc', CHA_STATE_RESPONSE._decode_etc,
+    ('humidity', 'temperature', 'wifi_mac_downlink', 'wifi_mac_uplink'))
 
 class CHA_DISCOVERY_SLOT:
-    SLOT_STRUCT = f'<{CHA_PARAMS_SN_SZ}sllBBBB6s6s6s6sBBxx'
-    SLOT_SZ = struct.calcsize(SLOT_STRUCT)
+    SLOT_STRUCT = struct.Struct(f'<{CHA_PARAMS_SN_SZ}sllBBBB6s6s6s6sBBxx')
+    SLOT_SZ = SLOT_STRUCT.size
 
-    def __init__(self, slot_bytes):
-        tupl = struct.unpack(CHA_DISCOVERY_SLOT.SLOT_STRUCT, slot_bytes)
+    def __init__(self, slot_bytes, offset=0):
+        tupl = CHA_DISCOVERY_SLOT.SLOT_STRUCT.unpack_from(slot_bytes, offset)
         self.sn = tupl[0].strip(b'\0').decode(encoding="ASCII", errors='ignore')
         self.gps_lon = tupl[1]/10000000
         self.gps_lat = tupl[2]/10000000
@@ -366,23 +419,21 @@ class CHA_DISCOVERY_RESPONSE(CHA_RESPONSE):
         self.slots:list[CHA_DISCOVERY_RESPONSE] = list()
         slot_sz = CHA_DISCOVERY_SLOT.SLOT_SZ
         for i in range(CHA_DISCOVERY_RESPONSE.N_SLOTS):
-            slot_bytes = payload_bytes[slot_sz*i:slot_sz*(i+1)]
-            self.slots.append(CHA_DISCOVERY_SLOT(slot_bytes))
+            self.slots.append(CHA_DISCOVERY_SLOT(payload_bytes, slot_sz*i))
 
 class CHA_SRM_TABLE_RESPONSE(CHA_RESPONSE):
-    TABLE_HDR_STRUCT = '<6L16s'
+    TABLE_HDR_STRUCT = struct.Struct('<6L16s')
 
     def __init__(self, hdr:CHA_PROTO_HDR, payload_bytes:bytes):
         super().__init__(hdr)
         if self.hdr.chunk_n == 0 and self.hdr.nak_code == CHA_NAK_CODE.NO_ERROR: 
             self.hdr.wait_next_chunk = True
-        self.payload = payload_bytes
+        self.payload = bytes(payload_bytes)
 
     def concat_payloads(self, second_chunk:'CHA_SRM_TABLE_RESPONSE'):
         self.payload += second_chunk.payload
 
-        hdr_sz = struct.calcsize(CHA_SRM_TABLE_RESPONSE.TABLE_HDR_STRUCT)
-        tupl = struct.unpack(CHA_SRM_TABLE_RESPONSE.TABLE_HDR_STRUCT, self.payload[:hdr_sz])
+        tupl = CHA_SRM_TABLE_RESPONSE.TABLE_HDR_STRUCT.unpack_from(self.payload)
         self.srm_sn = tupl[6].decode('ASCII').strip('\0')
         
 
@@ -195,11 +195,10 @@ class CS_STATUS_CHA_RESPONSE(CS_RESPONSE):
             client_bytes.append(bytes(client))
         return n_clients_byte + b''.join(client_bytes)
     
+    BATT_STATE = BITFIELD(('bat0', 4), ('bat1', 4))
+
     def batt_state_code(self, v0, v1):
-        packer = bit_pack()
-        next(packer)
-        packer.send((v0, 4))
-        return packer.send((v1, 4))
+        return CS_STATUS_CHA_RESPONSE.BATT_STATE.encode(v0, v1)
 
          
 class CS_STATUS_CHA_RN_RESPONSE(CS_STATUS_CHA_RESPONSE):
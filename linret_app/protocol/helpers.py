@@ -1,23 +1,63 @@
-def bit_pack():
-    result = 0
-    bitctr = 0
-    while True:
-        next_vals = yield result
-        if next_vals is None: break
-        next_val, n_bits = next_vals
-        next_val = int(next_val)
-        #if type(next_val) != int: raise RuntimeError("pack type must be int")
-        if next_val < 0: raise RuntimeError("pack val must be non-negative")
-        if next_val >= (1<<n_bits): raise RuntimeError("pack type must fit bisize")
-        result += next_val<<bitctr
-        bitctr += n_bits
-
-def bit_unpack(val):
-    retval = None
-    while True:
-        bitsize = yield retval
-        retval = (val)&((1<<bitsize)-1)
-        val = val >> bitsize
+class BITFIELD:
+    '''
+    Bit layout of a packed word, fields listed from LSB:
+    (name, n_bits) or (name, n_bits, conv), name None for reserved bits.
+    Shifts and masks are computed once, decode is a single pass over the table.
+    '''
+    def __init__(self, *fields):
+        self.fields = list()
+        shift = 0
+        for field in fields:
+            name, n_bits = field[0], field[1]
+            conv = field[2] if len(field) > 2 else None
+            if name is not None: self.fields.append((name, shift, (1<<n_bits)-1, conv))
+            shift += n_bits
+        self.n_bits = shift
+        self.names = [f[0] for f in self.fields]
+
+    def decode(self, val) -> list:
+        return [(val>>shift)&mask if conv is None else conv((val>>shift)&mask)
+                for _, shift, mask, conv in self.fields]
+
+    def decode_into(self, obj, val):
+        for name, shift, mask, conv in self.fields:
+            field_val = (val>>shift)&mask
+            setattr(obj, name, field_val if conv is None else conv(field_val))
+
+    def encode(self, *vals) -> int:
+        result = 0
+        for (name, shift, mask, _), val in zip(self.fields, vals, strict=True):
+            val = int(val)
+            if val < 0: raise RuntimeError(f"{name}: pack val must be non-negative")
+            if val > mask: raise RuntimeError(f"{name}: pack val must fit bitsize")
+            result |= val<<shift
+        return result
+
+    def encode_from(self, obj) -> int:
+        return self.encode(*(getattr(obj, name) for name in self.names))
+
+class LAZY_FIELD:
+    '''
+    Attribute decoded on first access. decoder(obj) returns the values of the
+    whole group as a tuple, which is cached in the obj slot cache_slot.
+    '''
+    __slots__ = ('cache', 'decoder', 'idx')
+    def __init__(self, cache, decoder, idx):
+        self.cache = cache
+        self.decoder = decoder
+        self.idx = idx
+
+    def __get__(self, obj, owner=None):
+        if obj is None: return self
+        try: vals = self.cache.__get__(obj, owner)
+        except AttributeError:
+            vals = self.decoder(obj)
+            self.cache.__set__(obj, vals)
+        return vals[self.idx]
+
+def lazy_fields(cls, cache_slot, decoder, names):
+    cache = cls.__dict__[cache_slot]
+    for idx, name in enumerate(names): setattr(cls, name, LAZY_FIELD(cache, decoder, idx))
 
 def string_pack(inpt, n_bytes):
     byte_str = inpt.encode("utf-8")
@@ -17,43 +17,37 @@ class REAL_DATARATE(IntEnum):
 class UNI_ADC_CFG:
     CS_ADC_CFG_DATASTRUCT = '<BBH'
     SRM_ADC_CFG_DATASTRUCT = '<L'
+    SAMPLE_SZ = 3
+    PACKET_PAYLOAD_SZ = 1500
+    CS_CH_MASK = BITFIELD(*[(f'ch{i}', 1) for i in range(4)])
+    CS_GAINS = BITFIELD(*[(f'gain{i}', 4, CS_GAIN_CODE) for i in range(4)])
+    SRM_CODE = BITFIELD(('rate', 2, SRM_DATARATE), (None, 14),
+                        *[(f'ch{i}', 1) for i in range(4)],
+                        *[(f'gain{i}', 3, CS_GAIN_CODE) for i in range(4)])
 
     def __init__(self, rate:REAL_DATARATE, ch:list[int], gains:list[CS_GAIN_CODE]):
         self.adc_datarate = rate
         self.gains = gains
         self.ch_mask = ch
         self.to_srm_bytes() # to init code attr
-        ch_en_packer = bit_pack()
-        gain_packer = bit_pack()
-        next(ch_en_packer)
-        next(gain_packer)
-        for i in range(4): 
-            self.ch_bit_mask = ch_en_packer.send((self.ch_mask[i], 1))
-            self.gain_bit_mask = gain_packer.send((self.gains[i], 4))
+        self.ch_bit_mask = UNI_ADC_CFG.CS_CH_MASK.encode(*self.ch_mask)
+        self.gain_bit_mask = UNI_ADC_CFG.CS_GAINS.encode(*self.gains)
         self.n_ch = sum(self.ch_mask)
 
     @classmethod
     def from_cs_bytes(cls, inpt:bytes) -> UNI_ADC_CFG:
         rate, channels, gains = struct.unpack(cls.CS_ADC_CFG_DATASTRUCT, inpt)
-        channels_unpacker = bit_unpack(channels)
-        gain_unpacker = bit_unpack(gains)
-        next(channels_unpacker)
-        next(gain_unpacker)
         rate = REAL_DATARATE[CS_ADC_DR_CODE(rate).name]
-        ch_mask = [channels_unpacker.send(1) for _ in range(4)]
-        gains = [CS_GAIN_CODE(gain_unpacker.send(4)) for _ in range(4)]
+        ch_mask = cls.CS_CH_MASK.decode(channels)
+        gains = cls.CS_GAINS.decode(gains)
         return cls(rate, ch_mask, gains)
         
     @classmethod
     def from_srm_bytes(cls, inpt:bytes) -> UNI_ADC_CFG:
         code = struct.unpack(cls.SRM_ADC_CFG_DATASTRUCT, inpt)[0]
-        unpacker = bit_unpack(code)
-        next(unpacker)
-        rate = REAL_DATARATE[SRM_DATARATE(unpacker.send(2)).name]
-        unpacker.send(14)
-        ch_mask = [unpacker.send(1) for _ in range(4)]
-        gains = [CS_GAIN_CODE(unpacker.send(3)) for _ in range(4)]
-        return cls(rate, ch_mask, gains)
+        fields = cls.SRM_CODE.decode(code)
+        rate = REAL_DATARATE[fields[0].name]
+        return cls(rate, fields[1:5], fields[5:9])
     
     @classmethod
     def from_config_json(cls, inpt:dict) -> UNI_ADC_CFG:
@@ -70,32 +64,22 @@ class UNI_ADC_CFG:
         }
 
     def to_cs_bytes(self):
-        ch_en_packer = bit_pack()
-        gain_packer = bit_pack()
-        next(ch_en_packer)
-        next(gain_packer)
-        for i in range(4): 
-            channels = ch_en_packer.send((self.ch_mask[i], 1))
-            gains = gain_packer.send((self.gains[i], 4))
-        
         return struct.pack(UNI_ADC_CFG.CS_ADC_CFG_DATASTRUCT,
-            CS_ADC_DR_CODE[self.adc_datarate.name], channels, gains)
+            CS_ADC_DR_CODE[self.adc_datarate.name], self.ch_bit_mask, self.gain_bit_mask)
     
     def to_srm_bytes(self):       
-        packer = bit_pack()
-        next(packer)
-        packer.send((SRM_DATARATE[self.adc_datarate.name], 2))
-        packer.send((0, 14))
-        #print(self.ch_mask)
-        for i in range(4): packer.send((int(self.ch_mask[i]), 1))
-        for i in range(4): self.code = packer.send((self.gains[i], 3))
+        self.code = UNI_ADC_CFG.SRM_CODE.encode(
+            SRM_DATARATE[self.adc_datarate.name], *self.ch_mask, *self.gains)
         return struct.pack(UNI_ADC_CFG.SRM_ADC_CFG_DATASTRUCT, self.code)
     
     def datarate_value(self):
         return self.adc_datarate.value
     
+    def bytes_per_node(self):
+        return self.adc_datarate*UNI_ADC_CFG.SAMPLE_SZ*sum(self.ch_mask)
+
     def packets_per_node(self):
-        return self.adc_datarate*3*sum(self.ch_mask)//1500
+        return self.bytes_per_node()//UNI_ADC_CFG.PACKET_PAYLOAD_SZ
     
     def __str__(self):
         ch_vals = list()
@@ -0,0 +1,247 @@
+import ctypes, ctypes.util, socket, select, struct, time
+from rawsocketpy import RawSocket
+
+'''
+Chassis RX backends.
+recv_batch() returns a list of memoryviews, one per ethernet payload (eth header stripped),
+or an empty list on timeout.
+'''
+
+ETH_HDR_SZ = 14
+RX_FRAME_SZ = 2048
+
+class RAWSOCKET_RX:
+    def __init__(self, eth, ethertype, timeout):
+        self.sock = RawSocket(eth, ethertype)
+        self.sock.sock.settimeout(timeout)
+
+    def recv_batch(self):
+        try: return [memoryview(self.sock.recv().data)]
+        except TimeoutError: return []
+
+    def close(self):
+        self.sock.close()
+
+'''
+recvmmsg() on AF_PACKET socket
+'''
+
+class _IOVEC(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class _MSGHDR(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(_IOVEC)), ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int)
+    ]
+
+class _MMSGHDR(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MSGHDR), ('msg_len', ctypes.c_uint)]
+
+class MMSG_RX:
+    MSG_DONTWAIT = 0x40
+    SOCK_RCVBUF = 4*1024*1024
+
+    def __init__(self, eth, ethertype, timeout, batch_size):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMSGHDR),
+                                       ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ethertype))
+        self.sock.bind((eth, 0))
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MMSG_RX.SOCK_RCVBUF)
+        self.poll = select.poll()
+        self.poll.register(self.sock, select.POLLIN)
+        self.timeout_ms = int(timeout*1000)
+        self.batch_size = batch_size
+        self.iovecs = (_IOVEC * batch_size)()
+        self.msgs = (_MMSGHDR * batch_size)()
+        for i in range(batch_size):
+            self.iovecs[i].iov_len = RX_FRAME_SZ
+            self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    def recv_batch(self):
+        if not self.poll.poll(self.timeout_ms): return []
+
+        # new buffer per batch, not per frame: returned views keep it alive
+        # until the parser is done with them, so it is never overwritten
+        buf = bytearray(RX_FRAME_SZ*self.batch_size)
+        base = ctypes.addressof((ctypes.c_char*len(buf)).from_buffer(buf))
+        for i in range(self.batch_size):
+            self.iovecs[i].iov_base = base + i*RX_FRAME_SZ
+
+        n = self.libc.recvmmsg(self.sock.fileno(), self.msgs, self.batch_size,
+                               MMSG_RX.MSG_DONTWAIT, None)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in (11, 4): return [] # EAGAIN, EINTR
+            raise OSError(err, 'recvmmsg failed')
+
+        view = memoryview(buf)
+        retval = list()
+        for i in range(n):
+            offset = i*RX_FRAME_SZ
+            retval.append(view[offset+ETH_HDR_SZ:offset+self.msgs[i].msg_len])
+        return retval
+
+    def close(self):
+        self.sock.close()
+
+'''
+Recorded frames: <dH (monotonic time, length) + eth payload
+'''
+
+FRAME_REC_HDR = struct.Struct('<dH')
+
+def write_frame(f, timestamp, frame):
+    f.write(FRAME_REC_HDR.pack(timestamp, len(frame)))
+    f.write(frame)
+
+def read_frames(filename):
+    with open(filename, 'rb') as f:
+        while hdr := f.read(FRAME_REC_HDR.size):
+            if len(hdr) < FRAME_REC_HDR.size: break
+            timestamp, sz = FRAME_REC_HDR.unpack(hdr)
+            frame = f.read(sz)
+            if len(frame) < sz: break
+            yield timestamp, frame
+
+class REPLAY_RX:
+    def __init__(self, filename, timeout, batch_size, realtime=True):
+        self.frames = read_frames(filename)
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.realtime = realtime
+        self.time_offset = None
+        self.pending = None
+
+    def recv_batch(self):
+        retval = list()
+        while len(retval) < self.batch_size:
+            if self.pending is None:
+                self.pending = next(self.frames, None)
+                if self.pending is None: break
+            timestamp, frame = self.pending
+            if self.realtime:
+                now = time.monotonic()
+                if self.time_offset is None: self.time_offset = now - timestamp
+                delay = timestamp + self.time_offset - now
+                if delay > 0:
+                    if retval: break
+                    time.sleep(min(delay, self.timeout))
+                    if delay > self.timeout: break
+            retval.append(memoryview(frame))
+            self.pending = None
+
+        if not retval and self.pending is None: time.sleep(self.timeout) # EOF
+        return retval
+
+    def close(self):
+        self.frames.close()
+
+class RECORDING_RX:
+    def __init__(self, backend, filename):
+        self.backend = backend
+        self.f = open(filename, 'ab')
+
+    def recv_batch(self):
+        frames = self.backend.recv_batch()
+        now = time.monotonic()
+        for frame in frames: write_frame(self.f, now, frame)
+        return frames
+
+    def close(self):
+        self.backend.close()
+        self.f.close()
+
+'''
+In-process link to cha_emulator
+'''
+
+class LOOPBACK_RX:
+    def __init__(self, timeout, batch_size):
+        import cha_emulator
+        self.link = cha_emulator.loopback()
+        self.timeout = timeout
+        self.batch_size = batch_size
+
+    def recv_batch(self):
+        return self.link.recv_batch(self.timeout, self.batch_size)
+
+    def close(self):
+        pass
+
+'''
+Chassis TX sockets, send_batch(frames, dest) returns the number of frames sent.
+'''
+
+class RAWSOCKET_TX:
+    def __init__(self, eth, ethertype):
+        self.sock = RawSocket(eth, ethertype)
+        self.sock.sock.settimeout(0.01)
+
+    def send_batch(self, frames, dest):
+        for frame in frames: self.sock.send(frame, dest=dest)
+        return len(frames)
+
+    def close(self):
+        self.sock.close()
+
+class MMSG_TX:
+    '''sendmmsg() on AF_PACKET socket, one syscall per batch'''
+    def __init__(self, eth, ethertype, batch_size):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMSGHDR), ctypes.c_uint, ctypes.c_int]
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ethertype))
+        self.sock.bind((eth, 0))
+        self.src_mac = self.sock.getsockname()[4]
+        self.ethertype = struct.pack('>H', ethertype)
+        self.batch_size = batch_size
+        self.iovecs = (_IOVEC * batch_size)()
+        self.msgs = (_MMSGHDR * batch_size)()
+        for i in range(batch_size):
+            self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    def send_batch(self, frames, dest):
+        eth_hdr = dest + self.src_mac + self.ethertype
+        sent = 0
+        for start in range(0, len(frames), self.batch_size):
+            chunk = frames[start:start + self.batch_size]
+            bufs = [ctypes.create_string_buffer(eth_hdr + frame, ETH_HDR_SZ + len(frame)) for frame in chunk]
+            for i, buf in enumerate(bufs):
+                self.iovecs[i].iov_base = ctypes.addressof(buf)
+                self.iovecs[i].iov_len = len(buf)
+            n = self.libc.sendmmsg(self.sock.fileno(), self.msgs, len(chunk), 0)
+            if n < 0:
+                err = ctypes.get_errno()
+                if err in (11, 4): break # EAGAIN, EINTR
+                raise OSError(err, 'sendmmsg failed')
+            sent += n
+            if n < len(chunk): break
+        return sent
+
+    def close(self):
+        self.sock.close()
+
+def open_tx_socket(eth, ethertype, cfg, batch_size=32):
+    '''TX side matching the RX backend: sendmmsg() with recvmmsg()'''
+    if cfg['type'] == 'loopback':
+        import cha_emulator
+        return cha_emulator.loopback()
+    if cfg['type'] == 'recvmmsg': return MMSG_TX(eth, ethertype, batch_size)
+    return RAWSOCKET_TX(eth, ethertype)
+
+def open_rx_backend(eth, ethertype, cfg, timeout):
+    batch_size = cfg.get('batch_size', 32)
+    if cfg['type'] == 'rawsocket': backend = RAWSOCKET_RX(eth, ethertype, timeout)
+    elif cfg['type'] == 'loopback': backend = LOOPBACK_RX(timeout, batch_size)
+    elif cfg['type'] == 'recvmmsg': backend = MMSG_RX(eth, ethertype, timeout, batch_size)
+    elif cfg['type'] == 'replay':
+        backend = REPLAY_RX(cfg['replay_file'], timeout, batch_size, cfg.get('realtime', True))
+    else: raise ValueError(f'Unknown RX backend {cfg["type"]}')
+
+    if cfg.get('record_file'): backend = RECORDING_RX(backend, cfg['record_file'])
+    return backend
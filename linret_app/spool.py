@@ -0,0 +1,222 @@
+import os, threading, time, logging, collections, struct
+import bson, bson.errors
+
+'''
+Write-ahead spool for DB requests.
+Segment files are a sequence of BSON documents (each starts with its int32 length),
+one document per request: {'time_start', 'serials', 'docs'}.
+A segment is deleted when it is closed and all its requests are written to DB,
+segments with failed requests and segments found on startup are replayed.
+A corrupt segment is replayed up to the bad record and kept as .bad for inspection.
+append(), sync() and close() are called from one spool thread that owns the open
+segment: writes and fsync are done outside the lock, which only guards the segment
+bookkeeping shared with ack() and the replay thread.
+'''
+
+SEGMENT_EXT = '.seg'
+CORRUPT_EXT = '.bad'
+BSON_LEN = struct.Struct('<l')
+MIN_RECORD_SZ = 5 # int32 length and the trailing 0
+MAX_RECORD_SZ = 16*1024*1024 # mongo document size limit
+
+class SPOOL_SEGMENT:
+    def __init__(self, seq, path, size=0, closed=False):
+        self.seq = seq
+        self.path = path
+        self.size = size
+        self.closed = closed
+        self.pending = 0
+        self.failed = False
+        self.corrupt = False
+        self.open_time = time.monotonic()
+
+def read_records(path):
+    '''Yields decoded records, stops at a torn tail, ValueError on a corrupt record'''
+    with open(path, 'rb') as f:
+        while hdr := f.read(BSON_LEN.size):
+            if len(hdr) < BSON_LEN.size: break
+            offset = f.tell() - BSON_LEN.size
+            rec_len = BSON_LEN.unpack(hdr)[0]
+            if not MIN_RECORD_SZ <= rec_len <= MAX_RECORD_SZ:
+                raise ValueError(f'Bad record length {rec_len} at offset {offset}')
+            body = f.read(rec_len - BSON_LEN.size)
+            if len(body) < rec_len - BSON_LEN.size: break
+            try: rec = bson.decode(hdr + body)
+            except bson.errors.InvalidBSON as e: raise ValueError(f'Bad record at offset {offset}: {e}') from e
+            yield rec
+
+class SPOOL:
+    def __init__(self, cfg):
+        self.log = logging.getLogger('SPOOL')
+        self.dir = cfg['dir']
+        self.segment_size = cfg['segment_size']
+        self.segment_time = cfg['segment_time']
+        self.max_size = cfg['max_size']
+        self.fsync_interval = cfg['fsync_interval']
+        self.lock = threading.Lock()
+        self.segments = collections.OrderedDict() # seq -> SPOOL_SEGMENT, all files on disk
+        self.replay_queue = collections.deque()
+        self.current = None
+        self.fd = None
+        self.dirty = False
+        self.last_fsync = 0
+        self.total_size = 0
+        self.next_seq = 0
+        self.stats = {
+            'records_appended': 0,
+            'records_replayed': 0,
+            'segments_written': 0,
+            'segments_replayed': 0,
+            'segments_dropped': 0,
+            'bytes_dropped': 0,
+            'write_errors': 0,
+            'segments_corrupt': 0
+        }
+
+        # crash recovery: whatever is on disk may not be in DB
+        os.makedirs(self.dir, exist_ok=True)
+        for flname in sorted(os.listdir(self.dir)):
+            if not flname.endswith(SEGMENT_EXT): continue
+            try: seq = int(flname[:-len(SEGMENT_EXT)])
+            except ValueError: continue
+            path = os.path.join(self.dir, flname)
+            seg = SPOOL_SEGMENT(seq, path, os.path.getsize(path), closed=True)
+            self.segments[seq] = seg
+            self.replay_queue.append(seg)
+            self.total_size += seg.size
+            self.next_seq = seq + 1
+        if self.segments:
+            self.log.warning(f'{len(self.segments)} segments ({self.total_size} bytes) to replay')
+
+    def open_segment(self):
+        seq = self.next_seq
+        self.next_seq += 1
+        seg = SPOOL_SEGMENT(seq, os.path.join(self.dir, f'{seq:010d}{SEGMENT_EXT}'))
+        fd = os.open(seg.path, os.O_WRONLY|os.O_CREAT|os.O_APPEND, 0o644)
+        with self.lock:
+            self.segments[seq] = seg
+            self.fd, self.current = fd, seg
+
+    def close_segment(self):
+        seg, fd = self.current, self.fd
+        if seg is None: return
+        try:
+            if self.dirty: os.fsync(fd)
+        except OSError as e:
+            with self.lock: self.stats['write_errors'] += 1
+            self.log.error(f'Spool fsync error {repr(e)}')
+        os.close(fd)
+        with self.lock:
+            self.fd, self.current, self.dirty = None, None, False
+            seg.closed = True
+            self.stats['segments_written'] += 1
+            self.release(seg)
+
+    def release(self, seg):
+        if not seg.closed or seg.pending or seg.seq not in self.segments: return
+        if seg.failed:
+            seg.failed = False
+            self.replay_queue.append(seg)
+        else: self.remove(seg)
+
+    def remove(self, seg):
+        del self.segments[seg.seq]
+        self.total_size -= seg.size
+        try:
+            if seg.corrupt: os.rename(seg.path, seg.path[:-len(SEGMENT_EXT)] + CORRUPT_EXT)
+            else: os.unlink(seg.path)
+        except OSError as e: self.log.error(f'Segment remove error {repr(e)}')
+
+    def enforce_limit(self):
+        while self.total_size > self.max_size:
+            oldest = next(iter(self.segments.values()))
+            if oldest is self.current: break
+            self.stats['segments_dropped'] += 1
+            self.stats['bytes_dropped'] += oldest.size
+            self.log.error(f'Spool full, segment {oldest.seq} dropped')
+            if oldest in self.replay_queue: self.replay_queue.remove(oldest)
+            self.remove(oldest)
+
+    def append(self, docs, serials, time_start):
+        '''Returns segment for ack(), None if not persisted'''
+        data = bson.encode({'time_start': time_start, 'serials': serials, 'docs': docs})
+        try:
+            if self.current is None: self.open_segment()
+            n = os.write(self.fd, data)
+        except OSError as e:
+            with self.lock: self.stats['write_errors'] += 1
+            self.log.error(f'Spool write error {repr(e)}')
+            return None
+        seg = self.current
+        self.dirty = True
+        if n < len(data):
+            # the torn record has to stay the segment tail
+            with self.lock:
+                seg.size += n
+                self.total_size += n
+                self.stats['write_errors'] += 1
+            self.log.error(f'Spool short write {n}/{len(data)} bytes')
+            self.close_segment()
+            return None
+        with self.lock:
+            seg.size += len(data)
+            seg.pending += 1
+            self.total_size += len(data)
+            self.stats['records_appended'] += 1
+            self.enforce_limit()
+        if seg.size >= self.segment_size: self.close_segment()
+        return seg
+
+    def ack(self, seg, written:bool):
+        with self.lock:
+            seg.pending -= 1
+            if not written: seg.failed = True
+            self.release(seg)
+
+    def sync(self, now):
+        '''Batched fsync and time based segment rotation, called periodically'''
+        if self.current is None: return
+        if now - self.current.open_time > self.segment_time: self.close_segment()
+        elif self.dirty and now - self.last_fsync > self.fsync_interval:
+            try: os.fsync(self.fd)
+            except OSError as e:
+                with self.lock: self.stats['write_errors'] += 1
+                self.log.error(f'Spool fsync error {repr(e)}')
+            self.dirty = False
+            self.last_fsync = now
+
+    def next_replay(self):
+        '''Oldest segment to replay, its requests must be ack()ed'''
+        with self.lock:
+            if not self.replay_queue: return None
+            seg = self.replay_queue.popleft()
+            seg.pending += 1 # held until all records are sent
+            self.stats['segments_replayed'] += 1
+            return seg
+
+    def replay_records(self, seg):
+        try:
+            for rec in read_records(seg.path):
+                with self.lock: seg.pending += 1
+                self.stats['records_replayed'] += 1
+                yield rec
+        except OSError as e: self.log.error(f'Segment read error {repr(e)}')
+        except ValueError as e:
+            self.log.error(f'Segment {seg.seq} corrupt, rest of it dropped: {e}')
+            with self.lock:
+                seg.corrupt = True
+                self.stats['segments_corrupt'] += 1
+        self.ack(seg, True)
+
+    def close(self):
+        self.close_segment()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats.update({
+                'segments': len(self.segments),
+                'bytes': self.total_size,
+                'replay_queue': len(self.replay_queue)
+            })
+        return stats
@@ -0,0 +1,84 @@
+import sys, zlib, lzma, array, itertools, operator
+
+'''
+node_data 'data' encoding.
+Raw data is 24 bit big endian signed samples, interleaved: s0ch0 s0ch1 .. s1ch0 ..
+Encoded data is per channel (in ch_bit_mask order) first sample + deltas as int32,
+byte-shuffled (all byte0, all byte1, ..) and compressed.
+Documents without 'codec' field are raw.
+'''
+
+SAMPLE_SZ = 3
+COMPRESSORS = {
+    'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+    'lzma': (lambda data: lzma.compress(data, preset=1), lzma.decompress),
+}
+CODECS = ['raw'] + list(COMPRESSORS)
+SIGN_EXT = bytes(0xFF if b & 0x80 else 0 for b in range(256))
+
+def codec_name(codec):
+    return f'delta24_{codec}'
+
+def n_channels(ch_bit_mask):
+    return bin(ch_bit_mask).count('1')
+
+def to_int32(data, n_ch, ch):
+    '''Channel ch samples of interleaved 24 bit BE data'''
+    step = n_ch*SAMPLE_SZ
+    hi = data[ch*SAMPLE_SZ::step]
+    buf = bytearray(len(hi)*4)
+    buf[0::4] = data[ch*SAMPLE_SZ+2::step]
+    buf[1::4] = data[ch*SAMPLE_SZ+1::step]
+    buf[2::4] = hi
+    buf[3::4] = hi.translate(SIGN_EXT)
+    samples = array.array('i', buf)
+    if sys.byteorder == 'big': samples.byteswap()
+    return samples
+
+def from_int32(samples, out, n_ch, ch):
+    if sys.byteorder == 'big': samples.byteswap()
+    buf = samples.tobytes()
+    step = n_ch*SAMPLE_SZ
+    out[ch*SAMPLE_SZ::step] = buf[2::4]
+    out[ch*SAMPLE_SZ+1::step] = buf[1::4]
+    out[ch*SAMPLE_SZ+2::step] = buf[0::4]
+
+def encode_data(data:bytes, n_ch:int, codec:str) -> bytes:
+    planes = list()
+    for ch in range(n_ch):
+        samples = to_int32(data, n_ch, ch)
+        deltas = array.array('i', samples[:1])
+        deltas.extend(map(operator.sub, samples[1:], samples[:-1]))
+        if sys.byteorder == 'big': deltas.byteswap()
+        planes.append(deltas.tobytes())
+    buf = b''.join(planes)
+    shuffled = b''.join(buf[i::4] for i in range(4))
+    return COMPRESSORS[codec][0](shuffled)
+
+def decode_data(data:bytes, n_ch:int, codec:str) -> bytes:
+    shuffled = COMPRESSORS[codec][1](data)
+    n_vals = len(shuffled)//4
+    buf = bytearray(len(shuffled))
+    for i in range(4): buf[i::4] = shuffled[i*n_vals:(i+1)*n_vals]
+    n_samples = n_vals//n_ch
+    out = bytearray(n_vals*SAMPLE_SZ)
+    for ch in range(n_ch):
+        deltas = array.array('i', buf[ch*n_samples*4:(ch+1)*n_samples*4])
+        if sys.byteorder == 'big': deltas.byteswap()
+        from_int32(array.array('i', itertools.accumulate(deltas)), out, n_ch, ch)
+    return bytes(out)
+
+def encode_doc(doc:dict, codec:str) -> dict:
+    if codec == 'raw': return doc
+    encoded = dict(doc)
+    encoded['data'] = encode_data(doc['data'], n_channels(doc['channels']), codec)
+    encoded['codec'] = codec_name(codec)
+    return encoded
+
+def decode_doc(doc:dict) -> bytes:
+    '''Raw interleaved samples of a node_data document'''
+    codec = doc.get('codec')
+    if codec is None: return doc['data']
+    if not codec.startswith('delta24_') or codec[8:] not in COMPRESSORS:
+        raise ValueError(f'Unknown codec {codec}')
+    return decode_data(doc['data'], n_channels(doc['channels']), codec[8:])
@@ -1,8 +1,10 @@
-import queue, logging, threading, time, copy, collections, enum
+import logging, threading, time, copy, collections, enum
 import bson
-import pymongo, pymongo.errors
 from nmea_true_time import TRUE_TIME
 from config import PROGRAM_CONFIG
+from db_writer import DB_WRITE_REQUEST
+from backfill import BACKFILL, PARTIAL_NODE, PARTIAL_SECOND
+from msg_bus import MSG_BUS, LANE
 from protocol.cha_enums import *
 from protocol.cs_enums import *
 from protocol.cha_structs import *
@@ -21,10 +23,38 @@ class JOB_IFACE_STATE(enum.Enum):
     WAIT_STOP_ACK = enum.auto()
     FINISHED = enum.auto()
 
+class RTT_ESTIMATOR:
+    '''
+    Stream requests round trip time on one interface, RFC 6298 smoothing, seconds.
+    Sampled from start/stop ACKs of requests sent once (Karn).
+    '''
+    INITIAL_RTO = 0.1
+    MIN_RTO = 0.02
+    MAX_RTO = 1.0
+    ALPHA = 1/8
+    BETA = 1/4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = RTT_ESTIMATOR.INITIAL_RTO
+
+    def sample(self, rtt):
+        if self.srtt is None: self.srtt, self.rttvar = rtt, rtt/2
+        else:
+            self.rttvar += RTT_ESTIMATOR.BETA*(abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += RTT_ESTIMATOR.ALPHA*(rtt - self.srtt)
+        self.rto = min(max(self.srtt + 4*self.rttvar, RTT_ESTIMATOR.MIN_RTO), RTT_ESTIMATOR.MAX_RTO)
+
 class STREAM_INTERFACE_JOB:
+    # stats colours only, timeouts follow the interface RTO
     WAIT_START_TIMEOUT_MS = 200
     WAIT_STOP_TIMEOUT_MS = 100
     WAIT_DATA_TIMEOUT_MS = 1500
+    START_ATTEMPTS = 4
+    STOP_ATTEMPTS = 3
+    FEEDBACK_ATTEMPTS = 4 # in a row without new data
+    REORDER_PACKETS = 2 # a missing packet is a gap once a node packet this far after it is received
     rand_id_ctr = 0
 
     def packet_n(self, node_id, packet_in_node):
@@ -56,26 +86,44 @@ class STREAM_INTERFACE_JOB:
         self.iface = iface
         self.rand_id = self.stream_rand_id()
         self.timestamp = timestamp
-        self.job_packet_numbers = list()
         self.node_ids = list()
         self.node_id_to_srm_sn = dict()
         for dev in devs_list:
             self.node_ids.append(dev['addr'])
             self.node_id_to_srm_sn.update({dev['addr']:dev['srm_serial_bytes']})
+        # packet sets are bitmasks in STREAM_START_REQUEST layout, bit n is packet_n()
+        self.node_mask = (1<<self.ppn) - 1
+        self.job_packet_mask = 0
         for node_id in self.node_ids:
-            for n in range(self.ppn): 
-                packet_n = self.packet_n(node_id, n)
-                self.job_packet_numbers.append(packet_n)
-        self.recvd_packet_numbers = list()
+            self.job_packet_mask |= self.node_mask << self.packet_n(node_id, 0)
+        self.recvd_packet_mask = 0
+        # one preallocated buffer per node, packets are copied into their slots
+        self.node_bufs = {sn:bytearray(adc_params.bytes_per_node()) for sn in self.node_id_to_srm_sn.values()}
+        self.stored_masks = {sn:0 for sn in self.node_id_to_srm_sn.values()}
         self.state = JOB_IFACE_STATE.INACTIVE
-        self.debug(f'{iface.name}:{len(self.job_packet_numbers)} packets')
-
-        self.send_start = lambda p: send_to_chassis(STREAM_START_REQUEST(
-            self.iface, self.rand_id, self.timestamp, p, self.adc_params.code))
-        self.send_feedback = lambda p: send_to_chassis(STREAM_FEEDBACK_REQUEST(
-            self.iface, self.rand_id, self.timestamp, p))
-        self.send_stop = lambda: send_to_chassis(STREAM_STOP_REQUEST(
-            self.iface, self.rand_id))
+        self.admitted = False # started by the streamer link admission
+        self.link = None # IFACE_LINK once admitted
+        self.rtt = RTT_ESTIMATOR() # shared with the link once admitted
+        self.retx_time = None # current request RTO expiry
+        self.attempts = 0 # of the current request
+        self.rtt_probe = None # send time of the current request while sent once
+        self.fb_requested = 0 # packets asked for by feedbacks
+        self.new_data = False
+        self.tx_stats = {'start': 0, 'feedback': 0, 'stop': 0}
+        self.backfill = None # PARTIAL_SECOND this job requests again
+        self.lock = threading.Lock() # data may be handled on the chassis RX thread
+        self.signal = None # data complete callback, set by the streamer
+        self.partial_nodes = list() # PARTIAL_NODEs missing packets when finished
+        self.debug(f'{iface.name}:{self.job_packet_mask.bit_count()} packets')
+
+        # requests and db writes are queued under the job lock and sent by flush() after it is released
+        self.outbox = list() # (send, msg)
+        self.send_start = lambda p: self.outbox.append((send_to_chassis, STREAM_START_REQUEST(
+            self.iface, self.rand_id, self.timestamp, p, self.adc_params.code)))
+        self.send_feedback = lambda p: self.outbox.append((send_to_chassis, STREAM_FEEDBACK_REQUEST(
+            self.iface, self.rand_id, self.timestamp, p)))
+        self.send_stop = lambda: self.outbox.append((send_to_chassis, STREAM_STOP_REQUEST(
+            self.iface, self.rand_id)))
         
         self.start_ack_start_time = None
         self.start_wait_time = 0
@@ -88,27 +136,97 @@ class STREAM_INTERFACE_JOB:
         self.stop_ack_recvd = False
         self.db_write_time = None
         self.db_index_time = 0
-        self.stored_data = dict()
         self.joined_data = dict()
 
         self.data_to_db = list()
         self.time_to_db = list()
-        self.db = None
-        self.data_collection = None
-        self.time_cache_collection = None
+        self.send_to_db = None
 
         self.bson_time_start = bson.Int64(self.timestamp*1000000000)
 
-    def append_db(self, db, db_config):
-        self.db = db
-        self.data_collection = self.db[db_config['data_collection']]
-        self.time_cache_collection = self.db[db_config['timecache_collection']]
+    def append_db(self, send_to_db):
+        self.send_to_db = send_to_db
+
+    def packets_left(self):
+        return (self.job_packet_mask & ~self.recvd_packet_mask).bit_count()
+
+    def drain_time(self, whole_link=False):
+        '''
+        Time for the link backlog up to and including this job, 0 until the rate is known.
+        Packets resent on feedback queue behind the whole link backlog.
+        '''
+        if self.link is None or not self.link.rate: return 0
+        jobs = self.link.jobs
+        if not whole_link and self in jobs: jobs = jobs[:jobs.index(self) + 1]
+        return sum(job.packets_left() for job in jobs)/self.link.rate
+
+    def transmit(self, kind, send, now, retransmission=False, timeout=0):
+        send()
+        self.tx_stats[kind] += 1
+        self.attempts = self.attempts + 1 if retransmission else 1
+        self.rtt_probe = None if retransmission else now
+        self.retx_time = now + self.rtt.rto + timeout
+
+    def rtt_sample(self, recv_time):
+        if self.rtt_probe is not None: self.rtt.sample(max(recv_time - self.rtt_probe, 0))
+        self.rtt_probe = None
+
+    def gaps(self):
+        '''Missing packets followed by a received packet of the same node REORDER_PACKETS later'''
+        gaps = 0
+        for node_id in self.node_ids:
+            base = self.packet_n(node_id, 0)
+            recvd = (self.recvd_packet_mask >> base) & self.node_mask
+            below = recvd.bit_length() - STREAM_INTERFACE_JOB.REORDER_PACKETS
+            if below > 0: gaps |= (((1<<below) - 1) & ~recvd) << base
+        return gaps
+
+    def start_stop(self, now):
+        self.state = JOB_IFACE_STATE.WAIT_STOP_ACK
+        self.stop_ack_start_time = now
+        self.transmit('stop', self.send_stop, now)
+
+    def restore(self, second:PARTIAL_SECOND):
+        '''Backfill job: nodes start with the packets already held, only missing ones are requested'''
+        self.backfill = second
+        for node in second.nodes:
+            self.node_bufs[node.sn] = node.buf
+            self.stored_masks[node.sn] = node.mask
+            self.recvd_packet_mask |= node.mask << self.packet_n(node.addr, 0)
+
+    def finish(self):
+        self.state = JOB_IFACE_STATE.FINISHED
+        # incomplete nodes are stored partial and kept for backfill
+        held = {node.sn:node.mask for node in self.backfill.nodes} if self.backfill is not None else dict()
+        sn_to_node_id = {sn:node_id for node_id, sn in self.node_id_to_srm_sn.items()}
+        for sn, buf in self.node_bufs.items():
+            if not self.stored_masks[sn]: continue
+            self.partial_nodes.append(PARTIAL_NODE(sn_to_node_id[sn], sn, buf, self.stored_masks[sn]))
+            if self.send_to_db is not None and self.stored_masks[sn] != held.get(sn):
+                self.queue_doc(sn, bytes(buf), self.stored_masks[sn])
+        self.node_bufs.clear()
+        if self.data_to_db: self.outbox.append((self.send_to_db, DB_WRITE_REQUEST(self.data_to_db, self.time_to_db, self.bson_time_start, self)))
+        self.data_to_db = None
+        self.time_to_db = None
+
+    def flush(self):
+        '''Sends what work() queued, call without the job lock held'''
+        with self.lock: outbox, self.outbox = self.outbox, list()
+        for send, msg in outbox: send(msg)
+
+    def release_data(self):
+        '''Sample data is with the monitor, db writer and backfill: only the stats row is kept'''
+        self.joined_data = dict()
+        self.partial_nodes = list()
+        self.backfill = None
         
     def work(self, now):
+        # requests are repeated on RTO expiry only, feedback also goes out when a gap shows up
         if self.state is JOB_IFACE_STATE.INACTIVE:
             self.start_ack_start_time = now
             self.state = JOB_IFACE_STATE.WAIT_START_ACK
             self.debug('Job started')
+            self.transmit('start', lambda: self.send_start(self.job_packet_mask & ~self.recvd_packet_mask), now)
 
         if self.state is JOB_IFACE_STATE.WAIT_START_ACK:
             self.start_wait_time = int((now - self.start_ack_start_time)*1000)
@@ -116,95 +234,70 @@ class STREAM_INTERFACE_JOB:
                 self.state = JOB_IFACE_STATE.WAIT_DATA
                 self.debug(f'Start ack`ed in {self.start_wait_time}ms')
                 self.data_recv_start_time = now
-            elif self.start_wait_time > STREAM_INTERFACE_JOB.WAIT_START_TIMEOUT_MS:
-                self.warning(f'Wait start ACK timeout')
-                self.state = JOB_IFACE_STATE.WAIT_STOP_ACK
-                self.stop_ack_start_time = now
-            else:
-                self.send_start(self.job_packet_numbers)
+                self.attempts = 0
+                self.retx_time = now + self.rtt.rto + self.drain_time()
+            elif now >= self.retx_time:
+                if self.attempts >= STREAM_INTERFACE_JOB.START_ATTEMPTS:
+                    self.warning(f'Wait start ACK timeout')
+                    self.start_stop(now)
+                else: self.transmit('start', lambda: self.send_start(self.job_packet_mask & ~self.recvd_packet_mask), now, True)
 
         if self.state is JOB_IFACE_STATE.WAIT_DATA:
-            self.data_wait_time = int((now - self.data_recv_start_time)*1000)
-            if set(self.job_packet_numbers) == set(self.recvd_packet_numbers):
-                self.data_recvd = True
-                self.state = JOB_IFACE_STATE.WAIT_STOP_ACK
+            if not self.data_recvd: self.data_wait_time = int((now - self.data_recv_start_time)*1000)
+            if self.data_recvd:
                 self.debug(f'Data recvd in {self.data_wait_time}ms')
-                self.stop_ack_start_time = now
-            elif self.data_wait_time > STREAM_INTERFACE_JOB.WAIT_DATA_TIMEOUT_MS:
-                self.warning(f'Data wait timeout')
-                self.state = JOB_IFACE_STATE.WAIT_STOP_ACK
-                self.stop_ack_start_time = now
-            else:
-                self.send_feedback(self.recvd_packet_numbers)
+                self.start_stop(now)
+            elif self.new_data and (gaps := self.gaps() & ~self.fb_requested):
+                self.fb_requested |= gaps
+                self.transmit('feedback', lambda: self.send_feedback(self.recvd_packet_mask), now,
+                              timeout=self.drain_time(True))
+            elif now >= self.retx_time:
+                if self.attempts >= STREAM_INTERFACE_JOB.FEEDBACK_ATTEMPTS:
+                    self.warning(f'Data wait timeout')
+                    self.start_stop(now)
+                else:
+                    self.fb_requested = self.job_packet_mask & ~self.recvd_packet_mask
+                    # backoff while nothing arrives
+                    self.transmit('feedback', lambda: self.send_feedback(self.recvd_packet_mask), now, True,
+                                  self.drain_time(True) + self.rtt.rto*(2**self.attempts - 1))
+            self.new_data = False
 
         if self.state is JOB_IFACE_STATE.WAIT_STOP_ACK:
             self.stop_wait_time = int((now - self.stop_ack_start_time)*1000)
             if self.stop_ack_recvd:
-                self.state = JOB_IFACE_STATE.FINISHED
+                self.finish()
                 self.debug(f'Stop ack`ed in {self.stop_wait_time}ms')
-            elif self.stop_wait_time > STREAM_INTERFACE_JOB.WAIT_STOP_TIMEOUT_MS:
-                self.warning(f'Wait stop ACK timeout')
-                self.state = JOB_IFACE_STATE.FINISHED
-            else:
-                self.send_stop()
-
-        if self.state is JOB_IFACE_STATE.FINISHED:
-            if self.data_to_db and (self.data_collection is not None):
-                try:
-                    db_write_start = time.monotonic()
-                    self.data_collection.insert_many(self.data_to_db)
-                    self.db_write_time = int((time.monotonic() - db_write_start)*1000)
-                except Exception as e:
-                    self.log.warning(f'DB insert_many exception {repr(e)}')
-                self.data_to_db = None
-
-            if self.time_to_db and (self.data_collection is not None):
-                start = time.monotonic() 
-                for int_mac in self.time_to_db:
-                    try:
-                        self.time_cache_collection.update_one(
-                            {"serial": int_mac}, 
-                            {"$max": { "time_start": self.bson_time_start}}, 
-                            upsert=True)
-                    except Exception as e:
-                        self.log.warning(f'DB update_one exception {repr(e)}')
-                self.db_index_time += int((time.monotonic() - start)*1000)
-                self.time_to_db = None
+            elif now >= self.retx_time:
+                if self.attempts >= STREAM_INTERFACE_JOB.STOP_ATTEMPTS:
+                    self.warning(f'Wait stop ACK timeout')
+                    self.finish()
+                else: self.transmit('stop', self.send_stop, now, True)
 
-    
     def store_data(self, packet:STREAM_DATA_RESPONSE):
         sn = self.node_id_to_srm_sn[packet.node_id]
         #print(sn)
-        if sn not in self.stored_data: self.stored_data.update({sn:dict()})
-        if packet.packet_n not in self.stored_data[sn]:
-            self.stored_data[sn].update({packet.packet_n:packet.payload})
-            if len(self.stored_data[sn]) == self.ppn:
-                data = [self.stored_data[sn][i] for i in range(self.ppn)]
-                result = b''.join(data)
+        if sn not in self.node_bufs: return # node already complete
+        bit = 1<<packet.packet_n
+        if not (self.stored_masks[sn] & bit):
+            packet_sz = UNI_ADC_CFG.PACKET_PAYLOAD_SZ
+            offset = packet.packet_n*packet_sz
+            slot = memoryview(self.node_bufs[sn])[offset:offset+packet_sz]
+            if packet.copy_payload_to(slot) != packet_sz:
+                self.warning(f'Short packet {packet.node_id}:{packet.packet_n}')
+            self.stored_masks[sn] |= bit
+            if self.stored_masks[sn] == self.node_mask:
+                # bson can't encode bytearray: this copy is shared by db and monitor
+                result = bytes(self.node_bufs.pop(sn))
                 self.joined_data.update({sn.decode():result})
-                if self.db is not None:
-                    int_mac = bson.Int64(int.from_bytes(sn, byteorder='little'))
-
-                    post = {
-                        "serial": int_mac,
-                        "time_start": self.bson_time_start,
-                        "time_diff": bson.Int64(0),
-                        "time_diff_measurement_time": bson.Int64(0),
-                        "samples_count": self.adc_params.datarate_value(),
-                        "frequency": CS_ADC_DR_CODE[self.adc_params.adc_datarate.name],
-                        "channels": self.adc_params.ch_bit_mask,
-                        "gain": self.adc_params.gain_bit_mask,
-                        "data": result
-                    }
+                if self.send_to_db is not None:
+                    # a backfilled record replaces the partial one
+                    self.queue_doc(sn, result, self.node_mask if self.backfill is not None else None)
 
                     #post_time = (
                     #    {"serial": int_mac},
                     #    {"$max": {"time_start": self.bson_time_start}}
                     #)
 
-                    self.data_to_db.append(post)
-                    self.time_to_db.append(int_mac)
-
                     #try:
                     #    start = time.monotonic()
                     #    self.time_cache_collection.update_one(
@@ -223,21 +316,59 @@ class STREAM_INTERFACE_JOB:
                 #with open(f'/home/ntcmg/tmp/{self.name}_{packet.node_id:2d}.dat', 'wb') as f:
                 #    f.write(result)
 
+    def queue_doc(self, sn, data:bytes, packets=None):
+        int_mac = bson.Int64(int.from_bytes(sn, byteorder='little'))
+        post = {
+            "serial": int_mac,
+            "time_start": self.bson_time_start,
+            "time_diff": bson.Int64(0),
+            "time_diff_measurement_time": bson.Int64(0),
+            "samples_count": self.adc_params.datarate_value(),
+            "frequency": CS_ADC_DR_CODE[self.adc_params.adc_datarate.name],
+            "channels": self.adc_params.ch_bit_mask,
+            "gain": self.adc_params.gain_bit_mask,
+            "data": data
+        }
+        if packets is not None: post["packets"] = packets
+        self.data_to_db.append(post)
+        self.time_to_db.append(int_mac)
+
     def process_data_packet(self, packet:STREAM_DATA_RESPONSE):
-        packet_n = self.packet_n(packet.node_id, packet.packet_n)
-        if packet_n not in self.recvd_packet_numbers:
-            self.recvd_packet_numbers.append(packet_n)
-        if set(self.job_packet_numbers) == set(self.recvd_packet_numbers):
-            self.data_recvd = True
-            self.send_stop()
+        # a stale frame (rand_id wrap) or a bad packet_n must not set another node's bit
+        if packet.node_id not in self.node_id_to_srm_sn or packet.packet_n >= self.ppn:
+            self.log.error(f'Unexpected packet {packet.node_id}:{packet.packet_n}')
+            return
+        bit = 1<<self.packet_n(packet.node_id, packet.packet_n)
+        if not (self.recvd_packet_mask & bit):
+            self.recvd_packet_mask |= bit
+            self.new_data = True
+            if self.state is JOB_IFACE_STATE.WAIT_DATA:
+                # feedback answers queue behind the link backlog: new data restarts the RTO, no RTT sample
+                self.attempts = 0
+                self.retx_time = packet.recv_time + self.rtt.rto + self.drain_time()
         if packet.payload_present: self.store_data(packet)
         else: self.log.error(f'Empty packet {packet.node_id}:{packet.packet_n}')
+        if self.recvd_packet_mask == self.job_packet_mask and not self.data_recvd:
+            self.data_recvd = True
+            if self.state is JOB_IFACE_STATE.WAIT_DATA:
+                # packets come in batches, some may have been received before the start ACK was handled
+                self.data_wait_time = max(int((packet.recv_time - self.data_recv_start_time)*1000), 0)
+            # STOP is sent by the streamer thread
+            if self.signal is not None: self.signal(self)
+
+    def rx_data(self, packet:STREAM_DATA_RESPONSE):
+        '''Stream sink, called on the chassis RX thread'''
+        with self.lock:
+            if self.link is not None: self.link.data_packet_rx(packet.recv_time)
+            self.rx_packet(packet)
     
     def rx_packet(self, packet:CHA_RESPONSE):
 
         if self.state is JOB_IFACE_STATE.WAIT_START_ACK:
             if isinstance(packet, (STREAM_START_RESPONSE, STREAM_DATA_RESPONSE)):
-                if not self.start_ack_recvd: self.start_ack_recvd = True
+                if not self.start_ack_recvd:
+                    self.start_ack_recvd = True
+                    self.rtt_sample(packet.recv_time)
                 if isinstance(packet, STREAM_DATA_RESPONSE):
                     if not self.data_recvd: self.process_data_packet(packet)
             else: # STREAM_STOP_RESPONSE
@@ -251,7 +382,9 @@ class STREAM_INTERFACE_JOB:
 
         elif self.state is JOB_IFACE_STATE.WAIT_STOP_ACK:
             if isinstance(packet, STREAM_STOP_RESPONSE):
-                if not self.stop_ack_recvd: self.stop_ack_recvd = True
+                if not self.stop_ack_recvd:
+                    self.stop_ack_recvd = True
+                    self.rtt_sample(packet.recv_time)
             elif isinstance(packet, STREAM_DATA_RESPONSE):
                 if not self.data_recvd: self.process_data_packet(packet)
             else:
@@ -265,16 +398,10 @@ class STREAM_INTERFACE_JOB:
                  ]
     
     def generate_stats(self):
-        #req_packs = struct.pack('>L', *self.job_packet_numbers[:1]).hex()
-        mask = [0]*4
-        for i in range(len(mask)):
-            for j in range(32):
-                if (i*32+j) in self.recvd_packet_numbers:
-                    mask[i] |= 1<<j
-
-        recv_packs = struct.pack('<4L', *mask).hex().upper()
-        #recv_packs = len(self.recvd_packet_numbers)
-        color = 'green' if (set(self.job_packet_numbers)==set(self.recvd_packet_numbers)) else 'red'
+        # first 4 words of the mask, same text as struct.pack('<4L', ...)
+        recv_packs = (self.recvd_packet_mask & ((1<<128)-1)).to_bytes(16, 'little').hex().upper()
+        #recv_packs = self.recvd_packet_mask.bit_count()
+        color = 'green' if (self.recvd_packet_mask == self.job_packet_mask) else 'red'
 
         def lat(success, time, timeout):
             if not success: return {'txt':'---', 'color':'red'}
@@ -293,7 +420,7 @@ class STREAM_INTERFACE_JOB:
 
 class STREAM_JOB:
     def __init__(self, send_to_chassis, send_to_mon, timestamp:int,  adc_params:UNI_ADC_CFG, \
-                 active_devs:dict[CHA_LR_IF_TYPE:list]):
+                 active_devs:dict[CHA_LR_IF_TYPE:list], backfill:PARTIAL_SECOND=None):
         self.log = logging.getLogger('JOB')
         self.timestamp = timestamp
         #self.log.debug(f'[{self.timestamp}] Job scheduled')
@@ -301,16 +428,20 @@ class STREAM_JOB:
         self.state = JOB_GLOBAL_STATE.INACTIVE
         self.send_to_mon = send_to_mon
         self.data_sent_to_mon = False
+        self.backfill = backfill
 
         self.iface_jobs = dict()
         for iface, devs_list in active_devs.items():
             self.iface_jobs.update({iface:STREAM_INTERFACE_JOB(
                     iface, adc_params, send_to_chassis, timestamp, devs_list
             )})
+        if backfill is not None:
+            self.iface_jobs[backfill.iface].restore(backfill)
+            self.data_sent_to_mon = True # not live data
 
-    def append_db(self, db, db_config):
+    def append_db(self, send_to_db):
         for job in self.iface_jobs.values():
-            job.append_db(db, db_config)
+            job.append_db(send_to_db)
 
     def work(self, now):
         if self.state is JOB_GLOBAL_STATE.INACTIVE:
@@ -320,7 +451,9 @@ class STREAM_JOB:
         if self.state is JOB_GLOBAL_STATE.ACTIVE:
             ifaces_finished = True
             for iface, job in self.iface_jobs.items(): 
-                job.work(now)
+                if job.admitted:
+                    with job.lock: job.work(now)
+                    job.flush()
                 if job.state is not JOB_IFACE_STATE.FINISHED: 
                     ifaces_finished = False
             if ifaces_finished: self.state = JOB_GLOBAL_STATE.FINISHED
@@ -340,12 +473,57 @@ class STREAM_JOB:
 
         return self.state
 
-    def rx_packet(self, packet:CHA_RESPONSE):
-        if packet.hdr.if_type in self.iface_jobs:
-            self.iface_jobs[packet.hdr.if_type].rx_packet(packet)
-    
-    def generate_stats(self):
-        return [job.generate_stats() for job in self.iface_jobs.values()]
+class IFACE_LINK:
+    '''
+    Stream jobs admission on one interface: jobs are pipelined while the measured
+    data packet rate drains the link backlog within admission_window seconds.
+    Admitted jobs share the interface RTT estimate.
+    '''
+    RATE_SAMPLE_TIME = 0.1
+    RATE_ALPHA = 0.3
+    IDLE_GAP = 0.1 # longer gaps between data packets are idle link time
+
+    def __init__(self, cfg):
+        self.max_jobs = cfg['max_jobs_per_iface']
+        self.admission_window = cfg['admission_window']
+        self.jobs:list[STREAM_INTERFACE_JOB] = list()
+        self.rate = None # data packets/s while the link is busy
+        self.rtt = RTT_ESTIMATOR()
+        self.busy_time = 0
+        self.busy_packets = 0
+        self.last_data_rx = None
+        self.last_admission = 0
+
+    def backlog(self):
+        return sum(job.packets_left() for job in self.jobs)
+
+    def can_admit(self, job:STREAM_INTERFACE_JOB, now, min_interval):
+        if not self.jobs: return now - self.last_admission > min_interval
+        if len(self.jobs) >= self.max_jobs or self.rate is None: return False
+        return (self.backlog() + job.packets_left())/self.rate <= self.admission_window
+
+    def admit(self, job:STREAM_INTERFACE_JOB, now):
+        job.admitted = True
+        job.link = self
+        job.rtt = self.rtt
+        self.jobs.append(job)
+        self.last_admission = now
+
+    def data_packet_rx(self, recv_time):
+        # RX thread receive times: packets are handed over to the streamer in batches
+        gap = recv_time - self.last_data_rx if self.last_data_rx is not None else None
+        self.last_data_rx = recv_time
+        if gap is None or gap > IFACE_LINK.IDLE_GAP: return
+        self.busy_time += max(gap, 0)
+        self.busy_packets += 1
+        if self.busy_time >= IFACE_LINK.RATE_SAMPLE_TIME:
+            sample = self.busy_packets/self.busy_time
+            if self.rate is None: self.rate = sample
+            else: self.rate += IFACE_LINK.RATE_ALPHA*(sample - self.rate)
+            self.busy_time, self.busy_packets = 0, 0
+
+    def update(self):
+        self.jobs = [job for job in self.jobs if job.state is not JOB_IFACE_STATE.FINISHED]
 
 class LINRET_STREAMREADER:
     JOB_CALL_MIN_INTERVAL = 0.015 # 15 ms
@@ -353,141 +531,190 @@ class LINRET_STREAMREADER:
     def __init__(self, pc:PROGRAM_CONFIG, true_time:TRUE_TIME):
         self.true_time = true_time
         self.program_config = pc
-        self.db_config = pc.get_db_config()
         self.log = logging.getLogger('STREAM')
-        self._queue = queue.Queue(maxsize=25)
+        self.bus = MSG_BUS(self.msg_lane, pc.get_msg_bus()['streamer'])
         self.t = threading.Thread(target=self.stream_loop, args=[])
         self.run = lambda: self.t.start()
         self.join = lambda: self.t.join()
         self.last_job_call_time = 0
         self.last_stats_send = 0
-        self.last_ty_db_connect = 0
-        self.jobs_queue = collections.deque([], maxlen=5)
+        self.jobs:list[STREAM_JOB] = list() # queued and running: live jobs by timestamp, backfills as they come due
         self.jobs_stats = collections.deque([], maxlen=20)
-        self.active_job:STREAM_JOB = None
-        self.last_tx_time = 0
-        self.last_job_finish_time = 0
+        self.jobs_cfg = pc.get_stream_jobs()
+        self.backfill = BACKFILL(pc.get_backfill())
+        self.links:dict[CHA_LR_IF_TYPE, IFACE_LINK] = dict()
+        self.routes:dict[tuple, STREAM_INTERFACE_JOB] = dict() # (if_type, rand_id) of admitted jobs
+        self.job_active = False
+        self.register_sink = None
+        self.unregister_sink = None
         self.delay_between_requests = pc.get_delay_between_requests()
         self.delay_before_request = pc.get_delay_before_request()
 
-        self.db_client = pymongo.MongoClient(self.db_config['url'])
-        self.db = self.db_client[self.db_config['db_name']]
-        self.db_connected = False
-        
         self.dbg_stats = {
             'queue_full_drops': 0,
             'invalid_packets_drops': 0,
             'stream_rx_while_no_job': 0,
+            'jobs_dropped': 0,
+            'iface_jobs_active': 0,
+            'link_rates': dict(),
+            'link_rtt_ms': dict(),
+            'stream_requests': {'start': 0, 'feedback': 0, 'stop': 0},
             'job_queue_len': 0
         }
 
-    def try_connect_to_db(self, now):
-        if now - self.last_ty_db_connect > 5:
-            self.last_ty_db_connect = now
-            try:
-                self.db_client.admin.command('ping')
-                if not self.db_connected:
-                    collection = self.db[self.db_config['data_collection']]
-                    time_cache_collection = self.db[self.db_config['timecache_collection']]
-                    indexes = collection.list_indexes()
-                    indexes = [index['name'] for index in indexes]
-                    if 'serial_1' not in indexes:
-                        collection.create_index([("serial", 1)], unique=False)
-                    if 'time_start_1' not in indexes:
-                        collection.create_index([("time_start", 1)], unique=False)
-                    if 'serial_1_time_start_1' not in indexes:
-                        collection.create_index([("serial", 1), ("time_start", 1)], unique=True)
-                    indexes = time_cache_collection.list_indexes()
-                    indexes = [index['name'] for index in indexes]
-                    if 'serial_1' not in indexes:
-                        time_cache_collection.create_index([("serial", 1)], unique=False)
-                    if 'time_start_1' not in indexes:
-                        time_cache_collection.create_index([("time_start", 1)], unique=False)
-                    if 'serial_1_time_start_1' not in indexes:
-                        time_cache_collection.create_index([("serial", 1), ("time_start", 1)], unique=True)
-                    self.log.warning(f'Connected to DB {self.db_config["url"]}')
-                self.db_connected = True
-            except pymongo.errors.ConnectionFailure:
-                self.log.error("Connection to DB error")
-                if self.db_connected: self.log.error("Connection to DB lost")
-                self.db_connected = False
-
-    def register_msg_handlres(self, to_cha, to_core, to_mon):
+    def register_msg_handlres(self, to_cha, to_core, to_mon, to_db):
         self.send_to_chassis = to_cha
         self.send_to_mon = to_mon
         self.send_to_core = to_core
+        self.send_to_db = to_db
+
+    def register_stream_sinks(self, register, unregister):
+        '''Admitted jobs get their STREAM_DATA on the chassis RX thread, not through the bus'''
+        self.register_sink = register
+        self.unregister_sink = unregister
 
     def stats_sender(self, now):
         if now - self.last_stats_send > 1:
-            jobs_stats = [STREAM_INTERFACE_JOB.STATS_HDR] + list(self.jobs_stats)
+            # rows are generated here: db times are filled in by the writer after the job is done
+            jobs_stats = [STREAM_INTERFACE_JOB.STATS_HDR] + [job.generate_stats() for job in self.jobs_stats]
 
+            self.dbg_stats.update(self.backfill.get_stats())
+            self.dbg_stats['queue_full_drops'] = self.bus.n_drops()
+            self.dbg_stats['bus'] = self.bus.get_stats()
             stats = {
                 'streamer_stats': copy.deepcopy(self.dbg_stats),
                 'jobs_stats': jobs_stats
                 }
-            stats['job_queue_len'] = len(self.jobs_queue)
+            stats['job_queue_len'] = len(self.jobs)
             self.send_to_mon(stats)
             self.last_stats_send = now
 
+    def msg_lane(self, msg):
+        if isinstance(msg, STREAM_DATA_RESPONSE): return LANE.DATA
+        return LANE.CONTROL
+
     def send_msg_to_streamer(self, msg):
-        try: self._queue.put_nowait(msg)
-        except queue.Full: self.dbg_stats['queue_full_drops'] += 1
+        self.bus.put(msg)
+
+    def enqueue_job(self, job:STREAM_JOB):
+        if len(self.jobs) >= self.jobs_cfg['max_queued_jobs']:
+            # oldest job not started on any interface, chassis buffers keep the newest seconds,
+            # a waiting backfill goes first and is put back for a later attempt
+            waiting = [queued for queued in self.jobs if not any(j.admitted for j in queued.iface_jobs.values())] + [job]
+            dropped = next((queued for queued in waiting if queued.backfill is not None), waiting[0])
+            self.log.warning(f'Job queue full, job {dropped.timestamp} dropped')
+            self.dbg_stats['jobs_dropped'] += 1
+            if (second := dropped.backfill) is not None:
+                self.backfill.add(second.timestamp, second.iface, second.adc_params, second.nodes,
+                                  time.monotonic(), second.attempts + 1)
+            if dropped is job: return
+            self.jobs.remove(dropped)
+        job.append_db(self.send_to_db)
+        self.jobs.append(job)
+
+    def admit_jobs(self, now):
+        abs_time = self.true_time.get_true_time()
+        if abs_time is None: return
+        blocked = set() # jobs start in timestamp order on every interface
+        for job in self.jobs:
+            # backfills are queued behind newer live jobs that may not be due yet
+            if (abs_time - job.timestamp) <= self.delay_before_request: continue
+            for iface, iface_job in job.iface_jobs.items():
+                if iface_job.admitted or iface in blocked: continue
+                if iface not in self.links: self.links[iface] = IFACE_LINK(self.jobs_cfg)
+                link = self.links[iface]
+                if not link.can_admit(iface_job, now, self.delay_between_requests):
+                    blocked.add(iface)
+                    continue
+                link.admit(iface_job, now)
+                iface_job.signal = self.send_msg_to_streamer
+                self.routes[(iface, iface_job.rand_id)] = iface_job
+                if self.register_sink: self.register_sink((iface, iface_job.rand_id), iface_job.rx_data)
+
+    def start_backfills(self, now):
+        # behind the live jobs in the queue, never pushes one out
+        abs_time = self.true_time.get_true_time()
+        if abs_time is None: return
+        for second in self.backfill.due(now, abs_time, self.jobs_cfg['max_queued_jobs'] - len(self.jobs)):
+            devs = [{'addr':node.addr, 'srm_serial_bytes':node.sn} for node in second.nodes]
+            self.enqueue_job(STREAM_JOB(self.send_to_chassis, self.send_to_mon, second.timestamp,
+                                        second.adc_params, {second.iface: devs}, second))
+
+    def backfill_result(self, job:STREAM_INTERFACE_JOB, now):
+        if job.backfill is None:
+            self.backfill.add(job.timestamp, job.iface, job.adc_params, job.partial_nodes, now)
+        else:
+            incomplete = {node.sn for node in job.partial_nodes}
+            complete = [node.sn for node in job.backfill.nodes if node.sn not in incomplete]
+            self.backfill.done(job.backfill, UNI_ADC_CFG.PACKET_PAYLOAD_SZ, complete, job.partial_nodes, now)
 
     def job_scheduler(self, now):
-        #print("1")
-        if (now - self.last_job_call_time) < LINRET_STREAMREADER.JOB_CALL_MIN_INTERVAL:
+        dt = now - self.last_job_call_time
+        if dt < LINRET_STREAMREADER.JOB_CALL_MIN_INTERVAL: return
+        self.last_job_call_time = now
+
+        self.start_backfills(now)
+        self.admit_jobs(now)
+        for job in list(self.jobs):
+            if job.work(now) is JOB_GLOBAL_STATE.FINISHED:
+                self.jobs_stats.extend(job.iface_jobs.values())
+                self.jobs.remove(job)
+                for iface_job in job.iface_jobs.values():
+                    self.routes.pop((iface_job.iface, iface_job.rand_id), None)
+                    if self.unregister_sink: self.unregister_sink((iface_job.iface, iface_job.rand_id))
+                    for kind, n in iface_job.tx_stats.items(): self.dbg_stats['stream_requests'][kind] += n
+                    self.backfill_result(iface_job, now)
+                    iface_job.release_data()
+
+        for link in self.links.values(): link.update()
+        n_active = sum(len(link.jobs) for link in self.links.values())
+        self.dbg_stats['iface_jobs_active'] = n_active
+        self.dbg_stats['link_rates'] = {iface.name:int(link.rate or 0) for iface, link in self.links.items()}
+        self.dbg_stats['link_rtt_ms'] = {iface.name:{'srtt':round((link.rtt.srtt or 0)*1000, 1), 'rto':round(link.rtt.rto*1000, 1)}
+                                         for iface, link in self.links.items()}
+        # core pauses polling while any stream job is on a link
+        if bool(n_active) != self.job_active:
+            self.job_active = bool(n_active)
+            self.send_to_core('job_active' if self.job_active else 'job_finished')
+
+    def rx_packet(self, packet:CHA_RESPONSE):
+        if (iface_job := self.routes.get((packet.hdr.if_type, packet.hdr.random_id))) is None:
+            self.dbg_stats['stream_rx_while_no_job'] += 1
             return
-        else: self.last_job_call_time = now
-        
-        if self.active_job:
-            if self.active_job.work(now) is JOB_GLOBAL_STATE.FINISHED:
-                self.jobs_stats.extend(self.active_job.generate_stats())
-                self.active_job = None
-                self.send_to_core('job_finished')
-
-        delay_ok = (now > (self.last_job_finish_time + self.delay_between_requests))
-        if (not self.active_job) and self.jobs_queue and delay_ok:
-            abs_time = self.true_time.get_true_time()
-            #print("CCC")
-            if abs_time is not None:
-                if (abs_time - self.jobs_queue[0].timestamp) > self.delay_before_request:
-                    self.active_job = self.jobs_queue.popleft()
-                    #self.log.debug(f'{self.active_job.timestamp}:{abs_time - self.active_job.timestamp}')
-                    if self.db_connected: self.active_job.append_db(self.db, self.db_config)
-                    self.active_job.work(now)
-                    self.send_to_core('job_active')
+        with iface_job.lock:
+            if isinstance(packet, STREAM_DATA_RESPONSE): self.links[packet.hdr.if_type].data_packet_rx(packet.recv_time)
+            iface_job.rx_packet(packet)
+        if isinstance(packet, (STREAM_START_RESPONSE, STREAM_STOP_RESPONSE)): self.job_transition(iface_job)
+
+    def job_transition(self, job:STREAM_INTERFACE_JOB):
+        # ACK or data complete: next state right away instead of on the next scheduler tick
+        with job.lock:
+            if job.state is not JOB_IFACE_STATE.FINISHED: job.work(time.monotonic())
+        job.flush()
 
     def stream_loop(self):
         self.log.debug('Streamer loop start')
 
         while True:
             now = time.monotonic()
-            self.try_connect_to_db(now)
             self.stats_sender(now)
             self.job_scheduler(now)
 
-            try: msg = self._queue.get(timeout=0.025)
-            except queue.Empty: continue
+            if not all(self.handle_msg(msg) for msg in self.bus.get_batch(timeout=0.025)): break
 
-            if isinstance(msg, str) and msg == 'shutdown': 
-                break
+        self.log.debug('Streamer loop finish')
 
-            elif isinstance(msg, CHA_RESPONSE): 
-                if self.active_job: 
-                    self.active_job.rx_packet(msg)
-                else: self.dbg_stats['stream_rx_while_no_job'] += 1
+    def handle_msg(self, msg):
+        '''False on shutdown'''
+        if isinstance(msg, str) and msg == 'shutdown': 
+            return False
 
-            elif isinstance(msg, STREAM_JOB): 
-                self.jobs_queue.append(msg)
+        elif isinstance(msg, CHA_RESPONSE): self.rx_packet(msg)
 
-            else: self.dbg_stats['invalid_packets_drops'] += 1
+        elif isinstance(msg, STREAM_JOB): self.enqueue_job(msg)
 
-        if self.db_client: self.db_client.close()
-        self.log.debug('Streamer loop finish')
+        elif isinstance(msg, STREAM_INTERFACE_JOB): self.job_transition(msg)
 
-    def tx_traffic_shaper(self, packet):
-        now = time.monotonic()
-        if now - self.last_tx_time > LINRET_STREAMREADER.TX_MIN_INTERVAL:
-            self.send_to_chassis(packet)
-            self.last_tx_time = now
+        else: self.dbg_stats['invalid_packets_drops'] += 1
+        return True
 
@@ -0,0 +1,45 @@
+import heapq
+
+class TIMER_HEAP:
+    '''
+    Named deadlines (monotonic time), at most one pending deadline per name.
+    Rescheduling or cancelling leaves a stale heap entry, skipped on pop.
+    '''
+    def __init__(self):
+        self.heap = list()
+        self.pending = dict() # name -> (deadline, seq)
+        self.seq = 0
+
+    def schedule(self, name, deadline):
+        self.seq += 1
+        self.pending[name] = (deadline, self.seq)
+        heapq.heappush(self.heap, (deadline, self.seq, name))
+
+    def cancel(self, name):
+        self.pending.pop(name, None)
+
+    def deadline(self, name):
+        entry = self.pending.get(name)
+        return entry[0] if entry else None
+
+    def drop_stale(self):
+        while self.heap:
+            deadline, seq, name = self.heap[0]
+            if self.pending.get(name) == (deadline, seq): return
+            heapq.heappop(self.heap)
+
+    def next_deadline(self):
+        self.drop_stale()
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now) -> list:
+        '''(name, deadline) of expired timers, earliest first'''
+        due = list()
+        while (deadline := self.next_deadline()) is not None and deadline <= now:
+            _, _, name = heapq.heappop(self.heap)
+            del self.pending[name]
+            due.append((name, deadline))
+        return due
+
+    def __len__(self):
+        return len(self.pending)
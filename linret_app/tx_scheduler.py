@@ -0,0 +1,115 @@
+'''
+Chassis TX scheduling.
+Requests are queued per priority class and destination interface and leave in batches,
+highest class first. Each interface has a token bucket ('rate' frames/s, up to 'burst'
+frames at once) so a burst of polling or feedback does not overrun one link while the
+others idle. Per class queue depth and queueing latency are exported to the monitor.
+'''
+import collections, enum
+
+class TX_CLASS(enum.IntEnum):
+    STREAM_CONTROL = 0
+    CLOCK_SYNC = 1
+    ACQ_CONTROL = 2
+    POLLING = 3
+
+class TOKEN_BUCKET:
+    __slots__ = ('rate', 'burst', 'tokens', 'last')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last)*self.rate)
+        self.last = now
+
+    def next_token(self, now):
+        return now if self.tokens >= 1 else now + (1 - self.tokens)/self.rate
+
+class TX_SCHEDULER:
+    def __init__(self, classify, cfg, now):
+        self.classify = classify
+        self.rate = cfg['rate']
+        self.burst = cfg['burst']
+        self.iface_cfg = cfg['iface'] # if_type name -> {'rate', 'burst'} overrides
+        self.max_queue = cfg['max_queue']
+        self.queues = [dict() for _ in TX_CLASS] # class -> if_type -> deque of (queued time, msg)
+        self.buckets = dict()
+        self.depth = 0
+        self.now = now
+        self.stats = {tx_class.name:{'depth': 0, 'max_depth': 0, 'sent': 0, 'latency_ms': None, 'max_latency_ms': None}
+                      for tx_class in TX_CLASS}
+        self.latency_sum = [0 for _ in TX_CLASS]
+        self.latency_n = [0 for _ in TX_CLASS]
+
+    def bucket(self, if_type):
+        bucket = self.buckets.get(if_type)
+        if bucket is None:
+            cfg = self.iface_cfg.get(getattr(if_type, 'name', str(if_type)), {})
+            bucket = TOKEN_BUCKET(cfg.get('rate', self.rate), cfg.get('burst', self.burst), self.now)
+            self.buckets[if_type] = bucket
+        return bucket
+
+    def put(self, msg, now):
+        tx_class = self.classify(msg)
+        if_type = msg.hdr.if_type
+        q = self.queues[tx_class].get(if_type)
+        if q is None: q = self.queues[tx_class][if_type] = collections.deque()
+        q.append((now, msg))
+        self.depth += 1
+        stats = self.stats[tx_class.name]
+        stats['depth'] += 1
+        if stats['depth'] > stats['max_depth']: stats['max_depth'] = stats['depth']
+
+    def full(self):
+        return self.depth >= self.max_queue
+
+    def next_batch(self, now, max_n) -> list:
+        '''Up to max_n messages the interface buckets allow now, class priority order'''
+        self.now = now
+        batch = list()
+        for bucket in self.buckets.values(): bucket.refill(now)
+        for tx_class in TX_CLASS:
+            stats = self.stats[tx_class.name]
+            for if_type, q in self.queues[tx_class].items():
+                bucket = self.bucket(if_type)
+                while q and bucket.tokens >= 1 and len(batch) < max_n:
+                    queued, msg = q.popleft()
+                    bucket.tokens -= 1
+                    batch.append(msg)
+                    latency = now - queued
+                    self.latency_sum[tx_class] += latency
+                    self.latency_n[tx_class] += 1
+                    if stats['max_latency_ms'] is None or latency*1000 > stats['max_latency_ms']:
+                        stats['max_latency_ms'] = round(latency*1000, 2)
+                    stats['depth'] -= 1
+                    stats['sent'] += 1
+        self.depth -= len(batch)
+        return batch
+
+    def next_send(self, now):
+        '''Earliest time a queued message gets a token, None when idle'''
+        deadline = None
+        for queues in self.queues:
+            for if_type, q in queues.items():
+                if not q: continue
+                bucket = self.bucket(if_type)
+                bucket.refill(now)
+                due = bucket.next_token(now)
+                if deadline is None or due < deadline: deadline = due
+        return deadline
+
+    def get_stats(self):
+        '''Latencies are over the period since the previous call'''
+        for tx_class in TX_CLASS:
+            stats = self.stats[tx_class.name]
+            n = self.latency_n[tx_class]
+            stats['latency_ms'] = round(self.latency_sum[tx_class]/n*1000, 2) if n else None
+            self.latency_sum[tx_class] = 0
+            self.latency_n[tx_class] = 0
+        stats_copy = {name:dict(stats) for name, stats in self.stats.items()}
+        for stats in self.stats.values(): stats['max_latency_ms'] = None
+        return stats_copy